@@ -0,0 +1,130 @@
+#! /usr/bin/env python3
+
+'''
+account_state
+
+'''
+import time
+import logging
+import threading
+
+
+## Seconds between REST reconciliations (margin interest is only known from REST).
+DEFAULT_RECONCILE_INTERVAL = 300
+
+## Empty wallet [free, locked].
+EMPTY_WALLET = [0.0, 0.0]
+
+
+class AccountState(object):
+
+    def __init__(self, rest_api, market_type, reconcile_interval=DEFAULT_RECONCILE_INTERVAL):
+        '''
+        Account balances shared by all the traders, indexed by asset.
+
+        -> Incremental updates.
+            Fed by the notifier with the user data stream events, outboundAccountPosition/outboundAccountInfo
+            replace the listed assets and balanceUpdate adds its delta to the free balance.
+
+        -> Reads.
+            Wallets are stored as [free, locked] lists that are replaced (never changed in place) so traders can
+            read them from any thread in O(1). version goes up with each change so traders only copy on change.
+
+        -> Reconciliation.
+            A full REST get_account is only used at start up and every reconcile_interval seconds (this also picks
+            up margin interest). Assets changed by the stream while the request was out are not overwritten.
+        '''
+        self.rest_api = rest_api
+        self.market_type = market_type
+        self.reconcile_interval = reconcile_interval
+
+        self.wallets = {}
+        self.loans = {}
+        self.updated_at = {}
+
+        self.version = 0
+        self.last_reconcile_time = 0
+
+        self.lock = threading.Lock()
+
+
+    def reconcile(self):
+        ''' Reload every balance (and margin loan) from the REST api. '''
+        request_time = time.time()
+        user_info = self.rest_api.get_account(self.market_type)
+
+        if self.market_type == 'MARGIN':
+            balances = user_info['userAssets']
+        else:
+            balances = user_info['balances']
+
+        with self.lock:
+            for balance in balances:
+                asset = balance['asset']
+                if self.updated_at.get(asset, 0) > request_time:
+                    continue
+
+                self.wallets[asset] = [float(balance['free']), float(balance['locked'])]
+                if 'borrowed' in balance:
+                    self.loans[asset] = float(balance['borrowed'])+float(balance['interest'])
+
+            self.version += 1
+            self.last_reconcile_time = time.time()
+
+        logging.info('[AccountState] Reconciled {0} balances.'.format(len(balances)))
+
+
+    def reconcile_due(self):
+        return((time.time()-self.last_reconcile_time) > self.reconcile_interval)
+
+
+    def on_update(self, symbol, kind, data):
+        ''' Notifier listener, applies user data stream account events. '''
+        if kind != 'account' or not data:
+            return
+
+        event_type = data.get('e')
+        now = time.time()
+
+        with self.lock:
+            if event_type in ['outboundAccountPosition', 'outboundAccountInfo']:
+                for wallet in data['B']:
+                    self.wallets[wallet['a']] = [float(wallet['f']), float(wallet['l'])]
+                    self.updated_at[wallet['a']] = now
+
+            elif event_type == 'balanceUpdate':
+                free, locked = self.wallets.get(data['a'], EMPTY_WALLET)
+                self.wallets[data['a']] = [free+float(data['d']), locked]
+                self.updated_at[data['a']] = now
+
+            else:
+                return
+
+            self.version += 1
+
+
+    def record_loan(self, asset, amount):
+        ''' Add to (or with a negative amount take off) the margin loan held for an asset after a borrow/repay. '''
+        with self.lock:
+            self.loans[asset] = max(self.loans.get(asset, 0.0)+amount, 0.0)
+            self.updated_at[asset] = time.time()
+            self.version += 1
+
+
+    def get_wallet(self, asset):
+        return(self.wallets.get(asset, EMPTY_WALLET))
+
+
+    def get_wallet_pair(self, base_asset, quote_asset):
+        ''' Wallets in the trader wallet_pair format {asset:[free, locked]}. '''
+        return({base_asset:self.get_wallet(base_asset), quote_asset:self.get_wallet(quote_asset)})
+
+
+    def get_loan(self, asset):
+        ''' Borrowed amount plus interest for a margin asset. '''
+        return(self.loans.get(asset, 0.0))
+
+
+    def get_balances(self):
+        ''' Every asset with a non zero balance {asset:[free, locked]}. '''
+        return({asset:wallet for asset, wallet in list(self.wallets.items()) if (wallet[0]+wallet[1]) > 0})
@@ -0,0 +1,187 @@
+#! /usr/bin/env python3
+
+'''
+async_runtime
+
+'''
+import asyncio
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+## Default number of executor threads used for trader passes (each pass is blocking, including its REST order calls).
+DEFAULT_WORKERS = 4
+
+## Traders are re-run after this many seconds without new data (for timed conditions).
+DEFAULT_IDLE_TIMEOUT = 5
+
+## Seconds between saving the changed traders to the state journal.
+PERSIST_INTERVAL = 1
+
+## Default seconds between UI pushes.
+PUSH_INTERVAL = 0.25
+
+## Seconds between connection checks (and the delay before the first one).
+CONNECTION_INTERVAL = 1
+CONNECTION_DELAY = 20
+
+
+class EventLoopScheduler(object):
+
+    def __init__(self, bot_core, workers=DEFAULT_WORKERS, idle_timeout=DEFAULT_IDLE_TIMEOUT, push_callback=None, push_interval=PUSH_INTERVAL):
+        '''
+        Schedules the BotCore background work from a single asyncio event loop (in its own thread so
+        flask/socketio keep the main thread).
+
+        The loop only decides when work runs, the work itself is the same blocking code the THREAD and
+        SCHEDULER modes run and it is done on a ThreadPoolExecutor (none of the I/O is non-blocking). Compared
+        to SCHEDULER mode waiting for data and timers costs no thread, the passes running at once are still
+        limited to the executor workers.
+
+        -> Socket ingestion.
+            The notifier listener hands each update to the loop with call_soon_threadsafe, which sets the
+            markets asyncio.Event so its trader task wakes as soon as data arrives (no sleep polling).
+
+        -> Trader passes.
+            Each market has a task that awaits its event then runs the blocking BaseTrader.run_iteration
+            (indicators, conditions and REST order calls) on an executor thread. A market never has more
+            than one pass in flight and updates that come in during a pass trigger one more pass.
+
+        -> Persistence, UI pushes and the connection monitor.
+            Timers on the loop, their blocking calls (file writes, REST ping) run in the loops default executor
+            so they never hold up a trader pass.
+        '''
+        self.bot_core = bot_core
+        self.workers = workers
+        self.idle_timeout = idle_timeout
+        self.push_callback = push_callback
+        self.push_interval = push_interval
+
+        self.traders = {}
+        self.events = {}
+
+        self.loop = None
+        self.executor = None
+        self.tasks = []
+        self.state = 'READY'
+
+
+    def add_trader(self, trader_):
+        self.traders.update({trader_.base_asset+trader_.quote_asset:trader_})
+
+
+    def on_update(self, symbol, kind, data):
+        ''' Notifier listener (called from the socket thread), wake the markets trader task. '''
+        if self.loop == None or not symbol in self.events:
+            return
+
+        try:
+            self.loop.call_soon_threadsafe(self.events[symbol].set)
+        except RuntimeError:
+            ## Loop has been closed.
+            pass
+
+
+    def start(self):
+        logging.info('[EventLoopScheduler] Starting event loop for {0} traders with {1} executor threads.'.format(len(self.traders), self.workers))
+        self.state = 'RUN'
+
+        self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='async-executor')
+        self.loop = asyncio.new_event_loop()
+
+        threading.Thread(target=self._run_loop, name='async-runtime', daemon=True).start()
+
+
+    def stop(self):
+        self.state = 'STOP'
+        if self.loop != None:
+            self.loop.call_soon_threadsafe(self._cancel_tasks)
+
+
+    def _cancel_tasks(self):
+        for task in self.tasks:
+            task.cancel()
+
+
+    def _run_loop(self):
+        asyncio.set_event_loop(self.loop)
+
+        try:
+            self.loop.run_until_complete(self._main())
+        finally:
+            self.executor.shutdown(wait=False)
+            self.loop.close()
+
+
+    async def _main(self):
+        ## Events are made on the loop, updates before this point are covered by the first pass.
+        for symbol in self.traders:
+            self.events.update({symbol:asyncio.Event()})
+
+        self.tasks = [asyncio.ensure_future(self._trader_task(symbol, trader_)) for symbol, trader_ in self.traders.items()]
+        self.tasks.append(asyncio.ensure_future(self._persist_task()))
+        self.tasks.append(asyncio.ensure_future(self._connection_task()))
+
+        if self.push_callback:
+            self.tasks.append(asyncio.ensure_future(self._push_task()))
+
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        logging.info('[EventLoopScheduler] Event loop stopped.')
+
+
+    async def _trader_task(self, symbol, trader_):
+        event = self.events[symbol]
+
+        while self.state != 'STOP' and trader_.state_data['runtime_state'] != 'STOP':
+            try:
+                await asyncio.wait_for(event.wait(), self.idle_timeout)
+            except asyncio.TimeoutError:
+                pass
+
+            ## Cleared before the pass so updates that arrive during it trigger another pass.
+            event.clear()
+
+            try:
+                await self.loop.run_in_executor(self.executor, trader_.run_iteration)
+            except Exception as error:
+                logging.exception('[EventLoopScheduler] {0} pass failed: {1}'.format(trader_.print_pair, error))
+
+
+    async def _persist_task(self):
+        while self.state != 'STOP':
+            await asyncio.sleep(PERSIST_INTERVAL)
+
+            try:
+                await self.loop.run_in_executor(None, self.bot_core.save_traders)
+            except Exception as error:
+                logging.exception('[EventLoopScheduler] Failed to save traders: {0}'.format(error))
+
+
+    async def _push_task(self):
+        while self.state != 'STOP':
+            await asyncio.sleep(self.push_interval)
+
+            if self.bot_core.coreState != 'RUN':
+                continue
+
+            try:
+                await self.loop.run_in_executor(None, self.push_callback)
+            except Exception as error:
+                logging.exception('[EventLoopScheduler] UI push failed: {0}'.format(error))
+
+
+    async def _connection_task(self):
+        await asyncio.sleep(CONNECTION_DELAY)
+
+        while self.state != 'STOP':
+            await asyncio.sleep(CONNECTION_INTERVAL)
+
+            if self.bot_core.coreState != 'RUN':
+                continue
+
+            ## The ping/socket restart block so they are run in the executor.
+            try:
+                await self.loop.run_in_executor(None, self.bot_core.check_connection)
+            except Exception as error:
+                logging.exception('[EventLoopScheduler] Connection check failed: {0}'.format(error))
@@ -0,0 +1,139 @@
+#! /usr/bin/env python3
+
+'''
+backtester
+
+'''
+import json
+import time
+import logging
+import numpy as np
+
+from . import trader
+from . import candle_archive
+from . import matching_engine
+
+
+## Market rules used when none are given (BTC quoted market with 8 decimal precision).
+DEFAULT_RULES = {'LOT_SIZE':8, 'TICK_SIZE':8, 'MINIMUM_NOTATION':0.0001, 'isFiat':False, 'invFiatToBTC':False}
+
+
+def load_candles(file_path):
+    '''
+    Load stored candles as an oldest first (n, 6) array.
+    .bin candle archives (as saved by pullCandles) and .npy files are memory mapped and expected oldest first, 
+    .json files (cache file or plain list) use the newest first socket format.
+    '''
+    if file_path.endswith('.bin'):
+        return(candle_archive.CandleArchive(file_path).candles())
+
+    if file_path.endswith('.npy'):
+        return(np.load(file_path, mmap_mode='r'))
+
+    with open(file_path, 'r') as file:
+        file_data = json.loads(file.read())
+
+    if type(file_data) == dict:
+        file_data = file_data['data']
+
+    return(np.asarray(file_data, dtype=np.float64)[::-1])
+
+
+class ReplayData(object):
+
+    def __init__(self, candles, window=500, spread=0.0):
+        '''
+        The data_if used to replay stored candles through a BaseTrader.
+
+        candles is an oldest first (n, 6) array, the trader is given a newest first view of the last
+        window candles at the current position and a one level book around the close (spread is the
+        fractional distance between bid and ask).
+        '''
+        self.candles = np.asarray(candles, dtype=np.float64)
+        self.window = window
+        self.spread = spread
+
+        self.position = min(window, len(self.candles))-1
+
+        ## Candle times in ms are converted to seconds for the trader clock.
+        self.time_scale = 1000.0 if (len(self.candles) and self.candles[-1][0] > 1e11) else 1.0
+
+
+    def step(self):
+        ''' Move on to the next candle, returns False once all the candles have been replayed. '''
+        self.position += 1
+        return(self.position < len(self.candles))
+
+
+    def get_candle_data(self, symbol):
+        start = max(0, self.position-self.window+1)
+        return(self.candles[start:self.position+1][::-1])
+
+
+    def get_depth_data(self, symbol):
+        close = self.candles[self.position][4]
+        half_spread = close*self.spread/2
+        volume = self.candles[self.position][5]
+        return({'a':[[close+half_spread, volume]], 'b':[[close-half_spread, volume]]})
+
+
+    def get_time(self):
+        return(self.candles[self.position][0]/self.time_scale)
+
+
+def run_backtest(market, candles, market_type='SPOT', MAC=0.0015, window=500, rules=None, spread=0.0, paper_matching=True, latency=0.0):
+    '''
+    Replay candles for one market through the real BaseTrader order logic and trader_configuration conditions.
+    Returns the trade ledger (same format as BaseTrader.trade_recorder).
+
+    The trader is stepped directly so no threads are started and nothing sleeps.
+    With paper_matching orders are filled by the matching engine (depth, queue position, fees and latency in seconds)
+    so orders placed on a candle are filled from the candles after it.
+    '''
+    quote_asset, base_asset = market.split('-')
+    replay_data = ReplayData(candles, window=window, spread=spread)
+
+    if paper_matching:
+        paper_engine = matching_engine.PaperMatchingEngine(fee=trader.COMMISION_FEE, latency=latency)
+    else:
+        paper_engine = None
+
+    trader_ = trader.BaseTrader(quote_asset, base_asset, None, data_if=replay_data, paper_engine=paper_engine)
+    trader_.setup_initial_values(market_type, 'TEST', dict(rules or DEFAULT_RULES))
+    trader_.start(MAC, {}, threaded=False)
+
+    if len(replay_data.candles) == 0:
+        return(trader_.trade_recorder)
+
+    while True:
+        trader_.run_iteration()
+        if not replay_data.step():
+            break
+
+    return(trader_.trade_recorder)
+
+
+def run_backtests(markets_candles, **kwargs):
+    ''' Run a backtest for each market in {market:candles}, one after another in the calling thread. '''
+    ledgers = {}
+
+    for market, candles in markets_candles.items():
+        start_time = time.time()
+        ledgers.update({market:run_backtest(market, candles, **kwargs)})
+        logging.info('[Backtester] {0}: replayed {1} candles in {2:.2f}s, {3} trades.'.format(
+            market, len(candles), time.time()-start_time, len(ledgers[market])))
+
+    return(ledgers)
+
+
+def summarise(trade_ledger):
+    ''' Basic stats for a trade ledger ([buy_price, buy_time, sell_price, sell_time, outcome, position_type], ...). '''
+    summary = {'trades':len(trade_ledger), 'wins':0, 'total':0.0, 'LONG':0.0, 'SHORT':0.0}
+
+    for trade in trade_ledger:
+        summary['total'] += trade[4]
+        summary[trade[5]] += trade[4]
+        if trade[4] > 0:
+            summary['wins'] += 1
+
+    return(summary)
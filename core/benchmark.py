@@ -0,0 +1,427 @@
+#! /usr/bin/env python3
+
+'''
+benchmark
+
+Time the trader hot paths at 1, 10, 100 and 1000 markets on seeded synthetic data.
+Usage: python3 -m core.benchmark [results file] [baseline results file]
+       python3 -m core.benchmark compare <baseline results file> <results file>
+'''
+import io
+import sys
+import copy
+import json
+import time
+import shutil
+import logging
+import platform
+import tempfile
+import contextlib
+import numpy as np
+
+import trader_configuration as TC
+
+from . import trader
+from . import handler
+from . import backtester
+from . import state_journal
+from .indicators import bench
+
+
+## Market counts each case is timed at.
+BENCH_MARKETS = [1, 10, 100, 1000]
+
+## Candles, depth levels and saved trades per synthetic market.
+BENCH_CANDLES = 500
+BENCH_DEPTH = 20
+BENCH_TRADES = 50
+
+## Timed runs per case (after a warm up run), the best and median are kept.
+BENCH_REPEATS = 5
+
+BENCH_SEED = 1
+BENCH_MAC = 0.0015
+
+## A case is a regression if its best time is this much slower than the baseline (and over the noise floor in ms).
+DEFAULT_THRESHOLD = 0.1
+NOISE_FLOOR_MS = 0.05
+
+RESULTS_VERSION = 1
+
+
+def make_depth(price, levels=BENCH_DEPTH, seed=1):
+    ''' Seeded book around a price {'a':[[price, qty], ...], 'b':[...]} (best level first). '''
+    random = np.random.default_rng(seed)
+    tick = price*0.0001
+    steps = np.arange(1, levels+1)
+
+    ask_prices = price+(tick*steps)
+    bid_prices = price-(tick*steps)
+    ask_quantities = random.uniform(0.1, 10, levels)
+    bid_quantities = random.uniform(0.1, 10, levels)
+
+    return({
+        'a':[[float(level_price), float(quantity)] for level_price, quantity in zip(ask_prices, ask_quantities)],
+        'b':[[float(level_price), float(quantity)] for level_price, quantity in zip(bid_prices, bid_quantities)]})
+
+
+def make_execution_report(symbol, order_id, side, price, quantity, status='FILLED', seed=1):
+    ''' Seeded user data stream executionReport (string values as sent by the exchange) for a LIMIT order. '''
+    random = np.random.default_rng(seed)
+    event_time = 1600000000000+int(random.integers(0, 86400000))
+    price = '{0:.8f}'.format(price)
+    quantity = '{0:.8f}'.format(quantity)
+
+    return({
+        'e':'executionReport',
+        'E':event_time,
+        's':symbol,
+        'c':'bench{0}'.format(int(random.integers(0, 1000000))),
+        'S':side,
+        'o':'LIMIT',
+        'f':'GTC',
+        'q':quantity,
+        'p':price,
+        'P':'0.00000000',
+        'F':'0.00000000',
+        'g':-1,
+        'C':'',
+        'x':'TRADE',
+        'X':status,
+        'r':'NONE',
+        'i':order_id,
+        'l':quantity,
+        'z':quantity,
+        'L':price,
+        'n':'{0:.8f}'.format(float(random.uniform(0, 0.001))),
+        'N':'BNB',
+        'T':event_time,
+        't':int(random.integers(0, 100000000)),
+        'w':False,
+        'm':True,
+        'M':True,
+        'O':event_time-1000,
+        'Z':'{0:.8f}'.format(float(price)*float(quantity)),
+        'Y':'{0:.8f}'.format(float(price)*float(quantity)),
+        'Q':'0.00000000'})
+
+
+def make_trades(count, price, seed=1):
+    ''' Seeded completed trades in the trade_recorder format. '''
+    random = np.random.default_rng(seed)
+    trades = []
+
+    for index in range(count):
+        buy_price = price*float(random.uniform(0.98, 1.02))
+        sell_price = buy_price*float(random.uniform(0.98, 1.02))
+        tokens = BENCH_MAC/buy_price
+        trades.append([
+            buy_price,
+            '2020-09-13 12:00:00',
+            sell_price,
+            '2020-09-13 13:00:00',
+            float('{0:.8f}'.format((sell_price-buy_price)*tokens)),
+            'LONG'])
+
+    return(trades)
+
+
+class BenchData(object):
+
+    def __init__(self, count, seed=BENCH_SEED, candles=BENCH_CANDLES):
+        '''
+        The data_if used by the benchmark traders, seeded candles and depth for count markets.
+        Market n is BTC-Mn (seeded with seed+n) so results are the same from run to run.
+        '''
+        self.markets = []
+        self.candles = {}
+        self.depths = {}
+
+        for index in range(count):
+            base_asset = 'M{0:04d}'.format(index)
+            symbol = base_asset+'BTC'
+            market_candles = np.asarray(bench.make_candles(candles, seed=seed+index), dtype=np.float64)
+
+            self.markets.append(base_asset)
+            self.candles.update({symbol:market_candles})
+            self.depths.update({symbol:make_depth(market_candles[0][4], seed=seed+index)})
+
+
+    def get_candle_data(self, symbol):
+        return(self.candles[symbol])
+
+
+    def get_depth_data(self, symbol):
+        return(self.depths[symbol])
+
+
+def make_traders(data, seed=BENCH_SEED):
+    ''' TEST traders for every market in the bench data, started and stepped once (out of SETUP). '''
+    traders = []
+
+    for index, base_asset in enumerate(data.markets):
+        symbol = base_asset+'BTC'
+        price = data.candles[symbol][0][4]
+
+        trader_ = trader.BaseTrader('BTC', base_asset, None, data_if=data)
+        trader_.setup_initial_values('SPOT', 'TEST', dict(backtester.DEFAULT_RULES))
+        trader_.load_trades(make_trades(BENCH_TRADES, price, seed=seed+index))
+        ## Enough of the base asset in the wallet for the executionReport BUY fills to complete.
+        trader_.start(BENCH_MAC, {base_asset:[2*BENCH_MAC/price, 0.0], 'BTC':[BENCH_MAC, 0.0]}, threaded=False)
+        trader_.run_iteration()
+        traders.append(trader_)
+
+    return(traders)
+
+
+def time_case(function, setup=None, repeats=BENCH_REPEATS):
+    '''
+    Time function(*setup()) in ms for a warm up run and repeats timed runs, setup is not timed.
+    Returns (best, median).
+    '''
+    times = []
+
+    for run in range(repeats+1):
+        args = setup() if setup else ()
+        start = time.perf_counter()
+        function(*args)
+        taken = (time.perf_counter()-start)*1000
+
+        if run > 0:
+            times.append(taken)
+
+    return(min(times), float(np.median(times)))
+
+
+def _order_status_setup(traders, data, seed):
+    '''
+    Positions with a placed order and the executionReport filling it, BUY orders for even markets and
+    SELL orders for odd ones. The traders are switched to REAL as executionReports are only read by live traders.
+    '''
+    def setup():
+        inputs = []
+
+        for index, trader_ in enumerate(traders):
+            trader_.configuration['run_type'] = 'REAL'
+            symbol = trader_.configuration['symbol']
+            price = data.candles[symbol][0][4]
+            quantity = BENCH_MAC/price
+            cp = copy.deepcopy(trader_.long_position)
+            order_id = index+1
+
+            if index % 2 == 0:
+                cp['order_type']['B'] = 'SIGNAL'
+                cp['order_status']['B'] = 'PLACED'
+                cp['order_id']['B'] = order_id
+                side = 'BUY'
+            else:
+                cp['order_type'].update({'B':None, 'S':'SIGNAL'})
+                cp['order_status']['S'] = 'PLACED'
+                cp['order_id']['S'] = order_id
+                cp.update({'buy_price':price, 'buy_time':1600000000, 'tokens_holding':quantity})
+                side = 'SELL'
+
+            report = make_execution_report(symbol, order_id, side, price, quantity, seed=seed+index)
+            inputs.append([trader_, cp, {'executionReport':report}])
+        return((inputs,))
+    return(setup)
+
+
+def _run_order_status(inputs):
+    for trader_, cp, socket_buffer_symbol in inputs:
+        trader_._order_status_manager('LONG', cp, socket_buffer_symbol)
+
+
+def _trade_manager_setup(traders):
+    ''' Waiting positions so each trader checks its entry conditions (and places a TEST order on a signal). '''
+    def setup():
+        inputs = []
+        for trader_ in traders:
+            trader_.configuration['run_type'] = 'TEST'
+            cp = copy.deepcopy(trader_.long_position)
+            cp['order_type'].update({'B':'WAIT', 'S':None})
+            cp['order_status'].update({'B':None, 'S':None})
+            cp['currency_left'] = BENCH_MAC
+            inputs.append([trader_, cp, trader_.candle_enpoint(trader_.configuration['symbol'])])
+        return((inputs,))
+    return(setup)
+
+
+def _run_trade_manager(inputs):
+    for trader_, cp, candles in inputs:
+        trader_._trade_manager('LONG', cp, trader_.indicators, candles)
+
+
+def _journal_setup(traders, price_seed):
+    ''' A new trade for every trader so each one has an entry to journal. '''
+    def setup():
+        for index, trader_ in enumerate(traders):
+            price = trader_.market_prices['lastPrice']
+            trader_._record_trade(make_trades(1, price, seed=price_seed+index)[0])
+            trader_.mark_dirty()
+        return((traders,))
+    return(setup)
+
+
+def run_markets(count, seed=BENCH_SEED, repeats=BENCH_REPEATS, state_dir=None):
+    ''' Time every case at count markets, returns a list of results. '''
+    data = BenchData(count, seed=seed)
+    traders = make_traders(data, seed=seed)
+    results = []
+
+    def add_result(case, timings):
+        best, median = timings
+        results.append({
+            'case':case,
+            'markets':count,
+            'best_ms':best,
+            'median_ms':median,
+            'per_market_us':(best*1000)/count})
+
+    all_candles = [data.candles[base_asset+'BTC'] for base_asset in data.markets]
+    add_result('technical_indicators', time_case(
+        lambda: [TC.technical_indicators(candles) for candles in all_candles], repeats=repeats))
+
+    add_result('main_iteration', time_case(
+        lambda: [trader_.run_iteration() for trader_ in traders], repeats=repeats))
+
+    add_result('order_status_manager', time_case(_run_order_status, _order_status_setup(traders, data, seed), repeats=repeats))
+    add_result('trade_manager', time_case(_run_trade_manager, _trade_manager_setup(traders), repeats=repeats))
+
+    ## Same body as the /rest-api/v1/get_trader_data response built from BotCore.get_trader_data.
+    add_result('trader_data_json', time_case(
+        lambda: json.dumps({'call':True, 'data':[trader_.get_trader_data() for trader_ in traders]}), repeats=repeats))
+
+    journal = state_journal.StateJournal(state_dir)
+    journal.write_changes(traders)
+    add_result('journal_write', time_case(journal.write_changes, _journal_setup(traders, seed+count), repeats=repeats))
+    add_result('snapshot_compact', time_case(lambda: journal.compact(traders), repeats=repeats))
+    if journal.journal_file != None:
+        journal.journal_file.close()
+
+    ## The full traders.json dump used before the state journal (still read as a fallback on start up).
+    cache = handler.cache_handler(state_dir, None)
+    add_result('traders_json', time_case(
+        lambda: cache.save_cache_file([trader_.get_trader_data() for trader_ in traders], 'traders.json'), repeats=repeats))
+
+    return(results)
+
+
+def run(markets=BENCH_MARKETS, seed=BENCH_SEED, repeats=BENCH_REPEATS):
+    '''
+    Run every case at each market count, returns the results document (see save_results).
+    Trader logging and prints are silenced while timing, the persistence cases write to a temp dir.
+    '''
+    state_dir = tempfile.mkdtemp(prefix='trader_bench_')+'/'
+    results = []
+
+    logging.disable(logging.INFO)
+    try:
+        for count in markets:
+            start_time = time.time()
+            with contextlib.redirect_stdout(io.StringIO()):
+                results += run_markets(count, seed=seed, repeats=repeats, state_dir=state_dir)
+            sys.stderr.write('{0} markets done in {1:.1f}s\n'.format(count, time.time()-start_time))
+    finally:
+        logging.disable(logging.NOTSET)
+        shutil.rmtree(state_dir, ignore_errors=True)
+
+    return({
+        'version':RESULTS_VERSION,
+        'time':int(time.time()),
+        'seed':seed,
+        'repeats':repeats,
+        'candles':BENCH_CANDLES,
+        'python':platform.python_version(),
+        'numpy':np.__version__,
+        'platform':platform.platform(),
+        'results':results})
+
+
+def save_results(results, file_path):
+    with open(file_path, 'w') as file:
+        file.write(json.dumps(results, indent=2))
+
+
+def load_results(file_path):
+    with open(file_path, 'r') as file:
+        return(json.loads(file.read()))
+
+
+def compare(baseline, current, threshold=DEFAULT_THRESHOLD):
+    '''
+    Compare the best times of two results documents case by case.
+    Returns a list of {'case', 'markets', 'baseline_ms', 'current_ms', 'change', 'regression'}
+    (cases only in one of the documents are skipped).
+    '''
+    baseline_times = {(result['case'], result['markets']):result['best_ms'] for result in baseline['results']}
+    rows = []
+
+    for result in current['results']:
+        key = (result['case'], result['markets'])
+        if not key in baseline_times:
+            continue
+
+        baseline_ms = baseline_times[key]
+        current_ms = result['best_ms']
+        change = (current_ms-baseline_ms)/baseline_ms if baseline_ms else 0.0
+
+        rows.append({
+            'case':result['case'],
+            'markets':result['markets'],
+            'baseline_ms':baseline_ms,
+            'current_ms':current_ms,
+            'change':change,
+            'regression':change > threshold and (current_ms-baseline_ms) > NOISE_FLOOR_MS})
+
+    return(rows)
+
+
+def print_results(results):
+    print('{0:<22} {1:>8} {2:>12} {3:>12} {4:>14}'.format('case', 'markets', 'best ms', 'median ms', 'per market us'))
+
+    for result in results['results']:
+        print('{0:<22} {1:>8} {2:>12.3f} {3:>12.3f} {4:>14.2f}'.format(
+            result['case'],
+            result['markets'],
+            result['best_ms'],
+            result['median_ms'],
+            result['per_market_us']))
+
+
+def print_comparison(rows):
+    print('{0:<22} {1:>8} {2:>12} {3:>12} {4:>9}'.format('case', 'markets', 'baseline ms', 'current ms', 'change'))
+
+    for row in rows:
+        print('{0:<22} {1:>8} {2:>12.3f} {3:>12.3f} {4:>+8.1f}%{5}'.format(
+            row['case'],
+            row['markets'],
+            row['baseline_ms'],
+            row['current_ms'],
+            row['change']*100,
+            '  REGRESSION' if row['regression'] else ''))
+
+    regressions = len([row for row in rows if row['regression']])
+    print('{0} regression(s) over {1:.0f}%.'.format(regressions, DEFAULT_THRESHOLD*100))
+    return(regressions)
+
+
+def main(args):
+    ''' Returns the exit code (1 if the comparison found any regressions). '''
+    if args and args[0] == 'compare':
+        return(1 if print_comparison(compare(load_results(args[1]), load_results(args[2]))) else 0)
+
+    results = run()
+    print_results(results)
+
+    if args:
+        save_results(results, args[0])
+        print('Results saved to {0}'.format(args[0]))
+
+    if len(args) > 1:
+        return(1 if print_comparison(compare(load_results(args[1]), results)) else 0)
+    return(0)
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -11,15 +11,31 @@ import json
 import hashlib
 import logging
 import threading
+from concurrent import futures
 from decimal import Decimal
 from flask_socketio import SocketIO
-from flask import Flask, render_template, url_for, request
+from flask import Flask, render_template, url_for, request, make_response
 
 ## Binance API modules
 from binance_api import rest_master
 from binance_api import socket_master
 
 from . import trader
+from . import notifier
+from . import candle_store
+from . import candle_puller
+from . import candle_archive
+from . import scheduler
+from . import async_runtime
+from . import publisher
+from . import state_journal
+from . import trade_ledger
+from . import order_book
+from . import matching_engine
+from . import account_state
+from . import order_gateway
+from . import metrics
+from . import profiler
 
 APP         = Flask(__name__)
 SOCKET_IO   = SocketIO(APP)
@@ -30,6 +46,15 @@ BOT_CORE    = None
 host_ip = ''
 host_port = ''
 
+## Seconds between journaling trader changes (only traders that have changed are written).
+SAVE_INTERVAL = 1
+
+## Seconds between live candle checkpoints (also written on stop).
+CANDLE_CHECKPOINT_INTERVAL = 60
+
+## Max traders warmed up at once on start up (each blocks until its market has data).
+STARTUP_WORKERS = 128
+
 ALL_BTC_PAIRS = ['USDT', 'BKRW' 'TUSD', 'BUSD', 'USDC', 'PAX', 'AUD', 'BIDR', 'DAI', 'EUR', 'GBP', 'IDRT', 'NGN', 'RUB', 'TRY', 'ZAR', 'UAH']
 INVERT_FOR_BTC_FIAT = False
 
@@ -55,9 +80,6 @@ def dated_url_for(endpoint, **values):
 
 @APP.route('/', methods=['GET'])
 def control_panel():
-    web_updater_thread = threading.Thread(target=web_updater)
-    web_updater_thread.start()
-
     start_up_data = {'hostIP':host_ip, 
                     'hostPort':host_port}
 
@@ -77,7 +99,7 @@ def update_trader():
     post_data = request.get_json()
     current_trader = None
     for trader in BOT_CORE.trader_objects:
-        if trader.symbol == post_data['market']:
+        if trader.print_pair == post_data['market']:
             current_trader = trader
             break
 
@@ -87,16 +109,22 @@ def update_trader():
     elif post_data['action'] == 'remove':
         trader.stop()
     elif post_data['action'] == 'start':
-        if trader.runtime_state == 'FORCE_PAUSE':
-            trader.runtime_state = 'RUN'
+        if trader.state_data['runtime_state'] == 'FORCE_PAUSE':
+            trader.state_data['runtime_state'] = 'RUN'
 
     elif post_data['action'] == 'pause':
-        if trader.runtime_state == 'RUN':
-            trader.runtime_state = 'FORCE_PAUSE'
+        if trader.state_data['runtime_state'] == 'RUN':
+            trader.state_data['runtime_state'] = 'FORCE_PAUSE'
 
     else:
         return(json.dumps({'call':False}))
 
+    trader.mark_dirty()
+
+    ## Wake the trader so the state change is picked up straight away.
+    if BOT_CORE.notifier:
+        BOT_CORE.notifier.notify(trader.base_asset+trader.quote_asset, 'control')
+
     return(json.dumps({'call':True}))
 
 
@@ -106,37 +134,189 @@ def get_trader_data():
     return(json.dumps({'call':True, 'data':BOT_CORE.get_trader_data()}))
 
 
+@APP.route('/rest-api/v1/get_trades', methods=['GET'])
+def get_trades():
+    '''
+    Page of completed trades from the ledger, newest first.
+    Optional args: symbol, position_type, start_time, end_time (epoch seconds), before_id (next_id from the last page), limit.
+    '''
+    args = request.args
+    try:
+        trades = BOT_CORE.trade_ledger.query(
+            symbol=args.get('symbol', None),
+            position_type=args.get('position_type', None),
+            start_time=args.get('start_time', None),
+            end_time=args.get('end_time', None),
+            before_id=args.get('before_id', None),
+            limit=args.get('limit', 100))
+    except ValueError as error:
+        return(json.dumps({'call':False, 'message':str(error)}))
+    return(json.dumps({'call':True, 'data':trades}))
+
+
+@APP.route('/rest-api/v1/get_trade_pnl', methods=['GET'])
+def get_trade_pnl():
+    ''' Trade count, wins and total outcome per symbol/position type (same optional filters as get_trades). '''
+    args = request.args
+    try:
+        pnl = BOT_CORE.trade_ledger.pnl(
+            symbol=args.get('symbol', None),
+            position_type=args.get('position_type', None),
+            start_time=args.get('start_time', None),
+            end_time=args.get('end_time', None))
+    except ValueError as error:
+        return(json.dumps({'call':False, 'message':str(error)}))
+    return(json.dumps({'call':True, 'data':pnl}))
+
+
+def _market_data_args():
+    '''
+    Shared args for the candle/indicator endpoints:
+        symbol - comma seperated markets (BTC-ETH or ETHBTC), all markets if not set.
+        since - only candles with an open time >= since (the open candle is always included).
+        format - json (rows), columnar (a list per column) or binary (candles only, one market).
+    '''
+    symbols = request.args.get('symbol', None)
+    symbols = symbols.split(',') if symbols else None
+
+    since = request.args.get('since', None)
+    since = float(since) if since else None
+
+    data_format = request.args.get('format', 'json')
+
+    return(symbols, since, data_format)
+
+
+def _market_data_response(body, etag, mimetype='application/json', headers=None):
+    response = make_response(body)
+    response.mimetype = mimetype
+    response.set_etag(etag)
+    for key, value in (headers or {}).items():
+        response.headers[key] = value
+    return(response)
+
+
 @APP.route('/rest-api/v1/get_trader_indicators', methods=['GET'])
 def get_trader_indicators():
-    print(request.get_json())
-    return(json.dumps({'call':True, 'data':BOT_CORE.get_trader_indicators()}))
+    try:
+        symbols, since, data_format = _market_data_args()
+    except ValueError as error:
+        return(json.dumps({'call':False, 'message':str(error)}))
+
+    ## Indicators only change with the candles so they share the candle tag.
+    etag = BOT_CORE.get_candles_etag(symbols, 'indicators', since, data_format)
+    if etag in request.if_none_match:
+        return(_market_data_response('', etag), 304)
+
+    indicators = BOT_CORE.get_trader_indicators(symbols, since)
+    return(_market_data_response(json.dumps({'call':True, 'data':indicators}), etag))
 
 
 @APP.route('/rest-api/v1/get_trader_candles', methods=['GET'])
 def get_trader_candles():
-    print(request.get_json())
-    return(json.dumps({'call':True, 'data':BOT_CORE.get_trader_candles()}))
+    try:
+        symbols, since, data_format = _market_data_args()
+    except ValueError as error:
+        return(json.dumps({'call':False, 'message':str(error)}))
+
+    if not data_format in candle_store.DATA_FORMATS:
+        return(json.dumps({'call':False, 'message':'Unknown format {0}.'.format(data_format)}))
+
+    etag = BOT_CORE.get_candles_etag(symbols, 'candles', since, data_format)
+    if etag in request.if_none_match:
+        return(_market_data_response('', etag), 304)
+
+    candles = BOT_CORE.get_trader_candles(symbols, since)
+
+    if data_format == 'binary':
+        ## Raw little endian float64 rows (newest first), one market per request.
+        if len(candles) != 1:
+            return(json.dumps({'call':False, 'message':'Binary format requires a single symbol.'}))
+        market, market_candles = list(candles.items())[0]
+        return(_market_data_response(
+            candle_store.encode_candles(market_candles, data_format),
+            etag, 
+            mimetype='application/octet-stream',
+            headers={'X-Market':market, 'X-Columns':','.join(candle_store.CANDLE_COLUMNS), 'X-Rows':str(len(market_candles))}))
+
+    data = {market:candle_store.encode_candles(market_candles, data_format) for market, market_candles in candles.items()}
+    return(_market_data_response(json.dumps({'call':True, 'data':data}), etag))
 
 
 
+@APP.route('/rest-api/v1/get_scheduler_stats', methods=['GET'])
+def get_scheduler_stats():
+    if BOT_CORE.scheduler == None:
+        return(json.dumps({'call':False, 'message':'Traders are not running on the scheduler.'}))
+    return(json.dumps({'call':True, 'data':BOT_CORE.scheduler.get_stats()}))
+
+
+@APP.route('/metrics', methods=['GET'])
+def get_metrics():
+    ''' Trader stage timings (histograms and recent p50/p99/max) in the Prometheus text format. '''
+    if BOT_CORE.metrics_registry == None:
+        return(make_response('Stage metrics are disabled.\n', 404))
+
+    response = make_response(BOT_CORE.metrics_registry.render())
+    response.headers['Content-Type'] = metrics.CONTENT_TYPE
+    return(response)
+
+
+@APP.route('/rest-api/v1/start_profiler', methods=['POST'])
+def start_profiler():
+    '''
+    Start sampling every thread's stack while the traders keep running.
+    Optional json/args: duration (seconds), interval (seconds between samples), include_idle (also keep blocked threads).
+    '''
+    args = request.get_json(silent=True) or request.args
+    try:
+        started = BOT_CORE.profiler.start(
+            duration=args.get('duration', profiler.DEFAULT_DURATION),
+            interval=args.get('interval', profiler.DEFAULT_INTERVAL),
+            include_idle=str(args.get('include_idle', False)).lower() == 'true')
+    except ValueError as error:
+        return(json.dumps({'call':False, 'message':str(error)}))
+
+    if not started:
+        return(json.dumps({'call':False, 'message':'The profiler is already running.'}))
+    return(json.dumps({'call':True, 'data':BOT_CORE.profiler.get_status()}))
+
+
+@APP.route('/rest-api/v1/stop_profiler', methods=['POST'])
+def stop_profiler():
+    BOT_CORE.profiler.stop()
+    return(json.dumps({'call':True, 'data':BOT_CORE.profiler.get_status()}))
+
+
+@APP.route('/rest-api/v1/get_profile', methods=['GET'])
+def get_profile():
+    '''
+    Samples of the current/last profile as collapsed stacks (for flamegraph.pl/speedscope), rooted at the market
+    (print_pair) for trader work and the thread name otherwise. Optional args: market, format=status for the sample counts.
+    '''
+    if request.args.get('format', None) == 'status':
+        return(json.dumps({'call':True, 'data':BOT_CORE.profiler.get_status()}))
+
+    response = make_response(BOT_CORE.profiler.collapsed(market=request.args.get('market', None)))
+    response.headers['Content-Type'] = 'text/plain; charset=utf-8'
+    return(response)
+
+
 @APP.route('/rest-api/v1/test', methods=['GET'])
 def test_rest_call():
     return(json.dumps({'call':True,'data':'Hello World'}))
 
 
-def web_updater():
-    lastHash = None
+@SOCKET_IO.on('connect')
+def dashboard_connect():
+    ''' New dashboard clients get the full trader data and join the room the publisher pushes changes to. '''
+    BOT_CORE.publisher.send_snapshot(request.sid)
 
-    while True:
-        if BOT_CORE.coreState == 'RUN':
-            traderData = BOT_CORE.get_trader_data()
-            currHash = hashlib.md5(str(traderData).encode())
 
-            if lastHash != currHash:
-                lastHash = currHash
-                SOCKET_IO.emit('current_traders_data', {'data':traderData})
-
-        time.sleep(.25)
+@SOCKET_IO.on('resync')
+def dashboard_resync():
+    ''' Sent by a client that has missed an update. '''
+    BOT_CORE.publisher.send_snapshot(request.sid, join=False)
 
 
 class BotCore():
@@ -147,6 +327,11 @@ class BotCore():
         '''
         logging.info('[BotCore] Initilizing the BotCore object.')
 
+        ## Exchange endpoints (only set to use a test exchange such as the fake exchange used by the load test).
+        self.rest_url           = settings.get('rest_url') or candle_puller.REST_URL
+        if settings.get('rest_url') or settings.get('socket_url'):
+            set_exchange_urls(settings.get('rest_url'), settings.get('socket_url'))
+
         self.rest_api           = rest_master.Binance_REST(settings['public_key'], settings['private_key'])
         self.socket_api         = socket_master.Binance_SOCK()
 
@@ -163,9 +348,98 @@ class BotCore():
         self.MAC                = settings['trading_currency']
         self.candle_Interval    = settings['trader_interval']
 
+        ## Recent trades kept per trader (older trades are in the trade ledger).
+        self.trade_history      = settings.get('max_trade_history', 100)
+
         self.trader_objects     = []
         self.trading_markets    = settings['trading_markets']
 
+        ## Notifier used to pass socket updates on to the candle stores and (if enabled) wake the traders.
+        self.notifier           = notifier.DataNotifier()
+        self.notifier.hook_socket(self.socket_api)
+        self.notify_updates     = settings.get('notify_updates', True)
+
+        ## Request weight budget shared by everything that calls the REST api directly (order book snapshots and the order gateway).
+        self.weight_limiter     = candle_puller.WeightLimiter()
+
+        ## Local order books built from the diff depth stream (depth events then only wake traders when the top of book changes).
+        self.depth_speed        = settings.get('depth_update_speed', '100ms')
+        if settings.get('local_order_books', False):
+            self.order_books    = order_book.OrderBookSet(self.notifier, levels=self.max_depth, rest_url=self.rest_url, fallback=self.socket_api.get_live_depths, 
+                weight_limiter=self.weight_limiter)
+        else:
+            self.order_books    = None
+
+        ## Single queue for real orders that keeps within the exchange rate limits and coalesces/cancel-replaces orders.
+        if self.run_type == 'REAL' and settings.get('order_gateway', False):
+            self.order_gateway  = order_gateway.OrderGateway(settings['public_key'], settings['private_key'], rest_url=self.rest_url, 
+                weight_limiter=self.weight_limiter)
+        else:
+            self.order_gateway  = None
+
+        ## Matching engine paper (TEST) orders are filled by, None fills them once the last price reaches them.
+        if self.run_type == 'TEST' and settings.get('paper_matching', True):
+            self.paper_engine   = matching_engine.PaperMatchingEngine(fee=trader.COMMISION_FEE, latency=settings.get('paper_latency', 100)/1000.0)
+        else:
+            self.paper_engine   = None
+
+        ## Ring buffer candle stores shared between the socket and the traders.
+        self.candle_stores      = candle_store.CandleStoreSet(self.max_candles)
+        self.notifier.add_listener(self._on_socket_update)
+
+        ## Stage timings for every trader (tick to order uses the socket receive times kept by the notifier).
+        if settings.get('stage_metrics', True):
+            self.metrics_registry = metrics.MetricsRegistry(tick_times=self.notifier.tick_times)
+        else:
+            self.metrics_registry = None
+
+        ## On demand sampling profiler (started/stopped from the rest api).
+        self.profiler           = profiler.SamplingProfiler()
+
+        ## Account balances indexed by asset, updated from the user data stream (REST is only used to reconcile).
+        self.account_state      = account_state.AccountState(self.rest_api, self.market_type)
+        if self.run_type == 'REAL':
+            self.notifier.add_listener(self.account_state.on_update)
+
+        ## Completed trades are recorded to a SQLite ledger in the logs dir.
+        self.trade_ledger       = trade_ledger.TradeLedger('{0}{1}'.format(order_log_path, trade_ledger.LEDGER_FILE))
+
+        ## Trader state is saved as a journal of changes with periodic snapshots.
+        self.state_journal      = state_journal.StateJournal(cache_handler.cache_dir)
+
+        ## Single publisher pushing trader changes to every dashboard client.
+        self.publisher          = publisher.TraderPublisher(SOCKET_IO, lambda: self.trader_objects, push_interval=settings.get('ui_push_interval', publisher.DEFAULT_PUSH_INTERVAL))
+
+        ## THREAD runs a thread per trader, SCHEDULER runs traders on a fixed pool of workers when they have new data,
+        ## ASYNC schedules the traders and the core background work from one event loop (the work runs on a thread pool).
+        self.runtime_mode       = settings.get('runtime_mode', 'THREAD')
+        self.scheduler          = None
+        self.async_runtime      = None
+
+        if self.runtime_mode == 'SCHEDULER':
+            self.scheduler      = scheduler.TraderScheduler(workers=settings.get('scheduler_workers', scheduler.DEFAULT_WORKERS))
+            self.notifier.add_listener(self.scheduler.on_update, wakes=True)
+        elif self.runtime_mode == 'ASYNC':
+            self.async_runtime  = async_runtime.EventLoopScheduler(self, workers=settings.get('scheduler_workers', async_runtime.DEFAULT_WORKERS), 
+                push_callback=self.publisher.publish, push_interval=self.publisher.push_interval)
+            self.notifier.add_listener(self.async_runtime.on_update, wakes=True)
+
+        ## Archive closed live candles to the cache candles folder (same files as pullCandles).
+        self.candle_archives    = {}
+        self.archive_candles    = settings.get('archive_candles', False)
+
+        ## Checkpoint the live candles to the cache dir so a restart only fetches the candles missed while stopped.
+        self.checkpoint_candles = settings.get('checkpoint_candles', True)
+        self.checkpoint_path    = '{0}{1}'.format(cache_handler.cache_dir, candle_store.CHECKPOINT_FILE.format(self.candle_Interval))
+        self.checkpoint_time    = time.time()
+
+        ## Traders still waiting for their first market data (by symbol).
+        self.unready_traders    = {}
+
+        ## Used by the connection check.
+        self.connection_update_time = 0
+        self.connection_retries = 1
+
         self.coreState          = 'READY'
 
 
@@ -176,16 +450,26 @@ class BotCore():
         logging.info('[BotCore] Starting the BotCore object.')
         self.coreState = 'SETUP'
 
+        start_time = phase_time = time.time()
+        timings = []
+
         logging.info('[BotCore] Collecting market info.')
 
-        market_rules = self.cache_handler.read_cache_file('markets.json')
+        exchange_info = self.cache_handler.read_cache_file('markets.json')
 
-        if not(market_rules):
-            market_rules = self.rest_api.get_exchange_info()
-            self.cache_handler.save_cache_file(market_rules, 'markets.json')
-            market_rules = market_rules['symbols']
+        if not(exchange_info):
+            exchange_info = self.rest_api.get_exchange_info()
+            self.cache_handler.save_cache_file(exchange_info, 'markets.json')
         else:
-            market_rules = market_rules['data']['symbols']
+            exchange_info = exchange_info['data']
+
+        market_rules = exchange_info['symbols']
+        phase_time = _lap(timings, 'exchange info', phase_time)
+
+        if 'rateLimits' in exchange_info:
+            self.weight_limiter.set_limit(candle_puller.request_weight_limit(exchange_info['rateLimits']))
+            if self.order_gateway:
+                self.order_gateway.set_rate_limits(exchange_info['rateLimits'])
 
         ## check markets
         found_markets = []
@@ -233,7 +517,15 @@ class BotCore():
                 market['baseAsset'], 
                 self.rest_api, 
                 socket_api=self.socket_api,
-                logs_dir=self.order_log_path)
+                trade_ledger=self.trade_ledger,
+                notifier=self.notifier if (self.notify_updates and self.runtime_mode == 'THREAD') else None,
+                candle_stores=self.candle_stores,
+                trade_history=self.trade_history,
+                order_books=self.order_books,
+                paper_engine=self.paper_engine,
+                account_state=self.account_state,
+                order_gateway=self.order_gateway,
+                metrics_registry=self.metrics_registry)
             
             traderObject.setup_initial_values(
                 self.market_type, 
@@ -261,80 +553,160 @@ class BotCore():
             logging.info('[BotCore] Following market pairs are not supported for {0}: {1}'.format(self.market_type, not_support_text))
 
         valid_tading_markets = [market for market in found_markets if market not in not_supported]
+        phase_time = _lap(timings, 'trader setup', phase_time)
 
         ## setup the socket
         for market in valid_tading_markets:
             self.socket_api.set_candle_stream(symbol=market, interval=self.candle_Interval)
-            self.socket_api.set_manual_depth_stream(symbol=market, update_speed='1000ms')
+            self.socket_api.set_manual_depth_stream(symbol=market, update_speed=self.depth_speed)
 
         self.socket_api.set_userDataStream(self.rest_api, self.market_type)
 
-        self.socket_api.BASE_CANDLE_LIMIT = self.max_candles
+        ## With a recent checkpoint for every market only the candles since it are fetched.
+        interval_ms = candle_puller.INTERVAL_MS[self.candle_Interval]
+        trader_symbols = [trader_.base_asset+trader_.quote_asset for trader_ in self.trader_objects]
+        checkpoint = candle_store.load_checkpoint(self.checkpoint_path, interval_ms) if self.checkpoint_candles else {}
+        candle_limit = candle_store.checkpoint_fetch_limit(checkpoint, trader_symbols, self.max_candles, interval_ms)
+
+        if candle_limit < self.max_candles:
+            logging.info('[BotCore] Restoring candles from the checkpoint, fetching the last {0} candles per market.'.format(candle_limit))
+        else:
+            checkpoint = {}
+
+        self.socket_api.BASE_CANDLE_LIMIT = candle_limit
         self.socket_api.BASE_DEPTH_LIMIT = self.max_depth
 
         self.socket_api.build_query()
         self.socket_api.set_live_and_historic_combo(self.rest_api)
+        self.socket_api.BASE_CANDLE_LIMIT = self.max_candles
+
+        for sock_symbol in trader_symbols:
+            self.notifier.register(sock_symbol)
+            candles = self.socket_api.get_live_candles(sock_symbol)
+            if sock_symbol in checkpoint:
+                candles = candle_store.merge_candles(candles, checkpoint[sock_symbol])
+            self.candle_stores.seed(sock_symbol, candles)
+
+        ## Traders wait on their markets ready event, set here for markets the historic data is enough for and by the socket for the rest.
+        self.unready_traders = {trader_.base_asset+trader_.quote_asset:trader_ for trader_ in self.trader_objects}
+        for symbol in list(self.unready_traders):
+            self._check_ready(symbol)
+        phase_time = _lap(timings, 'historic data', phase_time)
 
         self.socket_api.start()
+        phase_time = _lap(timings, 'socket start', phase_time)
 
         ## check for active trades
         if self.run_type == 'REAL':
-            user_info = self.rest_api.get_account(self.market_type)
-            if self.market_type == 'SPOT':
-                wallet_balances = user_info['balances']
-            elif self.market_type == 'MARGIN':
-                wallet_balances = user_info['userAssets']
-            current_tokens = {}
-            
-            for balance in wallet_balances:
-                total_balance = (float(balance['free']) + float(balance['locked']))
-                if total_balance > 0:
-                    current_tokens.update({balance['asset']:[
-                                        float(balance['free']),
-                                        float(balance['locked'])]})
+            self.account_state.reconcile()
+            current_tokens = self.account_state.get_balances()
         else:
             current_tokens = {'BTC':[float(self.MAC), 0.0]}
 
-        cached_traders_data = self.cache_handler.read_cache_file('traders.json')
+        ## Recover the traders from the state journal (falling back to a traders.json from older versions).
+        cached_traders_data = self.state_journal.recover()
+        if cached_traders_data:
+            cached_traders_data = {'data':cached_traders_data}
+        else:
+            cached_traders_data = self.cache_handler.read_cache_file('traders.json')
+
+        ## Saved trader data by symbol.
+        cached_traders = {}
+        if cached_traders_data:
+            logging.debug('[BotCore] Cached trader data: {0}'.format(cached_traders_data['data']))
+            for cached_trader in cached_traders_data['data']:
+                m_split = cached_trader['market'].split('-')
+                cached_traders.update({m_split[1]+m_split[0]:cached_trader})
+        phase_time = _lap(timings, 'account and saved state', phase_time)
 
         ## start/setup traders
+        if self.archive_candles:
+            os.makedirs('{0}candles/'.format(self.cache_handler.cache_dir), exist_ok=True)
+
+        if self.order_gateway:
+            self.order_gateway.start()
+
+        ## Traders are warmed up at once so start up takes about as long as the slowest market.
         logging.info('[BotCore] Starting the trader objects.')
+        if self.trader_objects:
+            with futures.ThreadPoolExecutor(max_workers=min(len(self.trader_objects), STARTUP_WORKERS)) as pool:
+                warmup_times = list(pool.map(lambda trader_: self._start_trader(trader_, cached_traders, current_tokens), self.trader_objects))
+        else:
+            warmup_times = []
+
         for trader_ in self.trader_objects:
-            wallet_pair = {}
-            currSymbol = "{0}{1}".format(trader_.base_asset, trader_.quote_asset)
+            if self.scheduler:
+                self.scheduler.add_trader(trader_)
+            elif self.async_runtime:
+                self.async_runtime.add_trader(trader_)
+        phase_time = _lap(timings, 'trader warm up', phase_time)
+
+        if self.scheduler:
+            self.scheduler.start()
+
+        if self.async_runtime:
+            ## Connection checks and saving the traders are done on the event loop.
+            self.async_runtime.start()
+        else:
+            logging.debug('[BotCore] Starting connection manager thread.')
+            CM_thread = threading.Thread(target=self._connection_manager)
+            CM_thread.start()
+
+            logging.debug('[BotCore] Starting file manager thread.')
+            FM_thread = threading.Thread(target=self._file_manager)
+            FM_thread.start()
 
-            if cached_traders_data:
-                print(cached_traders_data['data'])
-                for cached_trader in cached_traders_data['data']:
-                    m_split = cached_trader['market'].split('-')
-                    if (m_split[1]+m_split[0]) == currSymbol:
-                        if 'short_position' in cached_trader:
-                            trader_.short_position      = cached_trader['short_position']
+        logging.info('[BotCore] BotCore successfully started.')
+        slowest = max(warmup_times, key=lambda warmup_time: warmup_time[1]) if warmup_times else ('-', 0.0)
+        logging.info('[BotCore] Started {0} traders in {1:.2f}s ({2}), slowest trader warm up {3} {4:.2f}s.'.format(
+            len(self.trader_objects), 
+            time.time()-start_time, 
+            ', '.join('{0} {1:.2f}s'.format(name, seconds) for name, seconds in timings), 
+            slowest[0], 
+            slowest[1]))
+        self.coreState = 'RUN'
 
-                        trader_.configuration           = cached_trader['configuration']
-                        trader_.custom_conditional_data = cached_trader['custom_conditions']
-                        trader_.long_position           = cached_trader['long_position']
-                        trader_.trade_recorder          = cached_trader['trade_record']
-                        trader_.state_data              = cached_trader['state_data']
+        ## The async runtime pushes dashboard updates from its event loop.
+        if self.async_runtime == None:
+            self.publisher.start()
 
-            if trader_.quote_asset in current_tokens:
-                wallet_pair.update({trader_.quote_asset:current_tokens[trader_.quote_asset]})
 
-            if trader_.base_asset in current_tokens:
-                wallet_pair.update({trader_.base_asset:current_tokens[trader_.base_asset]})
+    def _start_trader(self, trader_, cached_traders, current_tokens):
+        ''' Restore a traders saved state and start it (waiting for its market data), returns (market, seconds taken). '''
+        trader_start = time.time()
+        wallet_pair = {}
+        currSymbol = "{0}{1}".format(trader_.base_asset, trader_.quote_asset)
 
-            trader_.start(self.MAC, wallet_pair)
+        if currSymbol in cached_traders:
+            cached_trader = cached_traders[currSymbol]
+            if 'short_position' in cached_trader:
+                trader_.short_position      = cached_trader['short_position']
 
-        logging.debug('[BotCore] Starting connection manager thread.')
-        CM_thread = threading.Thread(target=self._connection_manager)
-        CM_thread.start()
+            trader_.configuration           = cached_trader['configuration']
+            trader_.custom_conditional_data = cached_trader['custom_conditions']
+            trader_.long_position           = cached_trader['long_position']
+            trader_.load_trades(cached_trader['trade_record'], cached_trader.get('trade_stats', None))
+            trader_.state_data              = cached_trader['state_data']
 
-        logging.debug('[BotCore] Starting file manager thread.')
-        FM_thread = threading.Thread(target=self._file_manager)
-        FM_thread.start()
+        if trader_.quote_asset in current_tokens:
+            wallet_pair.update({trader_.quote_asset:current_tokens[trader_.quote_asset]})
 
-        logging.info('[BotCore] BotCore successfully started.')
-        self.coreState = 'RUN'
+        if trader_.base_asset in current_tokens:
+            wallet_pair.update({trader_.base_asset:current_tokens[trader_.base_asset]})
+
+        ## The scheduler/async runtime step the traders so no trader thread is started for them.
+        threaded = not (self.scheduler or self.async_runtime)
+        trader_.start(self.MAC, wallet_pair, threaded=threaded, ready_event=self.notifier.ready_events[currSymbol])
+
+        return((trader_.print_pair, time.time()-trader_start))
+
+
+    def _check_ready(self, symbol):
+        ''' Set the symbols ready event once its trader has market data. '''
+        trader_ = self.unready_traders.get(symbol)
+        if trader_ != None and trader_.has_market_data():
+            self.unready_traders.pop(symbol, None)
+            self.notifier.set_ready(symbol)
 
 
     def stop(self):
@@ -342,25 +714,58 @@ class BotCore():
         if self.socket_api.socketRunning:
             self.socket_api.ws.close()
 
-        for trader_ in self.traderObjects:
+        for trader_ in self.trader_objects:
             trader_.stop()
 
+        if self.scheduler:
+            self.scheduler.stop()
+
+        if self.async_runtime:
+            self.async_runtime.stop()
+
+        self.publisher.stop()
+        self.profiler.stop()
         self.coreState = 'STOP'
 
+        if self.order_gateway:
+            self.order_gateway.stop()
+
+        self.state_journal.compact(self.trader_objects)
+        self.trade_ledger.close()
+
+        if self.checkpoint_candles:
+            self.save_candle_checkpoint()
+
 
     def _file_manager(self):
         while self.coreState != 'STOP':
-            time.sleep(15)
+            time.sleep(SAVE_INTERVAL)
+            self.save_traders()
+
+
+    def save_traders(self):
+        ''' Journal the traders that have changed and compact the journal into a snapshot when due. '''
+        self.state_journal.write_changes(self.trader_objects)
+        self.trade_ledger.flush()
+
+        if self.state_journal.needs_compaction():
+            self.state_journal.compact(self.trader_objects)
 
-            traders_data = self.get_trader_data()
-            self.cache_handler.save_cache_file(traders_data, 'traders.json')
+        if self.checkpoint_candles and self.coreState == 'RUN' and (time.time()-self.checkpoint_time) > CANDLE_CHECKPOINT_INTERVAL:
+            self.save_candle_checkpoint()
+
+
+    def save_candle_checkpoint(self):
+        ''' Write the live candles of every market to the checkpoint file. '''
+        self.checkpoint_time = time.time()
+        try:
+            self.candle_stores.save_checkpoint(self.checkpoint_path, candle_puller.INTERVAL_MS[self.candle_Interval])
+        except Exception as e:
+            logging.warning('[BotCore] Candle checkpoint failed: {0}.'.format(e))
 
 
     def _connection_manager(self):
         '''  '''
-        update_time = 0
-        retryCounter = 1
-
         time.sleep(20)
 
         while self.coreState != 'STOP':
@@ -369,21 +774,57 @@ class BotCore():
             if self.coreState != 'RUN':
                 continue
 
-            if self.socket_api.last_data_recv_time != update_time:
-                update_time = self.socket_api.last_data_recv_time
-            else:
-                if (update_time + (15*retryCounter)) < time.time():
-                    retryCounter += 1
-                    try:
-                        print(self.rest_api.test_ping())
-                    except Exception as e:
-                        logging.warning('[BotCore] Connection issue: {0}.'.format(e))
-                        continue
+            self.check_connection()
+
+
+    def check_connection(self):
+        ''' Ping the REST api (and restart the socket) if no socket data has been received for a while. '''
+        if self.socket_api.last_data_recv_time != self.connection_update_time:
+            self.connection_update_time = self.socket_api.last_data_recv_time
+        else:
+            if (self.connection_update_time + (15*self.connection_retries)) < time.time():
+                self.connection_retries += 1
+                try:
+                    print(self.rest_api.test_ping())
+                except Exception as e:
+                    logging.warning('[BotCore] Connection issue: {0}.'.format(e))
+                    return
+
+                logging.info('[BotCore] Connection issue resolved.')
+                if not(self.socket_api.socketRunning):
+                    logging.info('[BotCore] Attempting socket restart.')
+                    self.socket_api.start()
+
+        ## Periodically check the cached balances (and margin interest) against the REST api.
+        if self.run_type == 'REAL' and self.account_state.reconcile_due():
+            try:
+                self.account_state.reconcile()
+            except Exception as e:
+                logging.warning('[BotCore] Account reconcile failed: {0}.'.format(e))
+
+
+    def _on_socket_update(self, symbol, kind, data):
+        ''' Called by the notifier after the socket has handled a message. '''
+        if symbol in self.unready_traders:
+            self._check_ready(symbol)
+
+        if kind == 'candle':
+            candles = self.socket_api.get_live_candles(symbol)
+            if candles:
+                self.candle_stores.update(symbol, candles[0])
+
+            if self.archive_candles and data and data['k']['x']:
+                self._archive_candle(symbol, data['k'])
 
-                    logging.info('[BotCore] Connection issue resolved.')
-                    if not(self.socket_api.socketRunning):
-                        logging.info('[BotCore] Attempting socket restart.')
-                        self.socket_api.start()
+
+    def _archive_candle(self, symbol, kline):
+        ''' Append a closed kline from the socket to the symbols candle archive. '''
+        if not symbol in self.candle_archives:
+            self.candle_archives.update({symbol:candle_archive.CandleArchive(
+                candle_archive.archive_path('{0}candles/'.format(self.cache_handler.cache_dir), symbol, self.candle_Interval),
+                interval_ms=candle_puller.INTERVAL_MS[self.candle_Interval])})
+
+        self.candle_archives[symbol].append([[kline['t'], kline['o'], kline['h'], kline['l'], kline['c'], kline['v']]])
 
 
     def get_trader_data(self):
@@ -395,21 +836,89 @@ class BotCore():
         return(rData)
 
 
-    def get_trader_indicators(self):
+    def _select_traders(self, symbols=None):
+        ''' Traders for a list of markets (BTC-ETH or ETHBTC), all traders if None. '''
+        if not symbols:
+            return(self.trader_objects)
+        return([_trader for _trader in self.trader_objects if _trader.print_pair in symbols or (_trader.base_asset+_trader.quote_asset) in symbols])
+
+
+    def get_candles_etag(self, symbols=None, *extra):
+        ''' ETag for the selected markets candles (anything that changes the response is passed as extra). '''
+        tags = [self.candle_stores.get_store(_trader.base_asset+_trader.quote_asset).etag() for _trader in self._select_traders(symbols)]
+        return(hashlib.md5(str((tags, symbols, extra)).encode()).hexdigest())
+
+
+    def get_trader_indicators(self, symbols=None, since=None):
+        ''' Indicators per market, with since only the values for candles opened at or after since (and the open candle). '''
         indicator_data_set = {}
-        for _trader in self.trader_objects:
-            indicator_data_set.update({_trader.print_pair:_trader.indicators})
+        for _trader in self._select_traders(symbols):
+            count = None
+            if since != None:
+                count = len(self.candle_stores.get_store(_trader.base_asset+_trader.quote_asset).since(since))
+            indicator_data_set.update({_trader.print_pair:candle_store.slice_newest(_trader.indicators, count)})
         return(indicator_data_set)
 
 
-    def get_trader_candles(self):
+    def get_trader_candles(self, symbols=None, since=None):
+        ''' Newest first candle arrays per market, with since only the candles opened at or after since (and the open candle). '''
         candle_data_set = {}
-        for _trader in self.trader_objects:
+        for _trader in self._select_traders(symbols):
             sock_symbol = _trader.base_asset+_trader.quote_asset
-            candle_data_set.update({_trader.print_pair:self.socket_api.get_live_candles(sock_symbol)})
+            candle_data_set.update({_trader.print_pair:self.candle_stores.get_store(sock_symbol).since(since)})
         return(candle_data_set)
 
 
+def _lap(timings, name, since):
+    ''' Add the time since a phase started to the start up timings, returns the current time. '''
+    now = time.time()
+    timings.append((name, now-since))
+    return(now)
+
+
+def set_exchange_urls(rest_url=None, socket_url=None):
+    '''
+    Point the binance_api modules at another exchange (their base urls are module level so this applies to every
+    Binance_REST/Binance_SOCK). Raises a RuntimeError if a url can not be set so the bot never falls back to the
+    live exchange when a test exchange was asked for.
+    '''
+    for module, name, url in [(rest_master, 'REST_BASE', rest_url), (socket_master, 'SOCKET_BASE', socket_url)]:
+        if not url:
+            continue
+        if not hasattr(module, name):
+            raise RuntimeError('{0} has no {1}, unable to set the exchange url to {2}.'.format(module.__name__, name, url))
+        setattr(module, name, url.rstrip('/'))
+
+
+def pull_candles(cache_handler, days=365, rest_url=candle_puller.REST_URL):
+    '''
+    Download historic candles for all the trading markets into the cache candles folder.
+    Pulls resume from the last stored candle so this can be re-run to top the files up.
+    '''
+    from . import handler
+    settings = handler.settings_reader()
+
+    ## Use the exchanges request weight limit if the market info has been cached.
+    weight_limit = candle_puller.DEFAULT_WEIGHT_LIMIT
+    market_info = cache_handler.read_cache_file('markets.json')
+    if market_info:
+        weight_limit = candle_puller.request_weight_limit(market_info['data'].get('rateLimits', []))
+
+    symbols = []
+    for market in settings['trading_markets']:
+        quote_asset, base_asset = market.split('-')
+        symbols.append(base_asset+quote_asset)
+
+    puller = candle_puller.CandlePuller(
+        '{0}candles/'.format(cache_handler.cache_dir), 
+        settings['trader_interval'], 
+        rest_url=rest_url, 
+        weight_limit=weight_limit)
+
+    start_time = int((time.time()-(days*86400))*1000)
+    return(puller.pull(symbols, start_time))
+
+
 def start(settings, order_log_path, cache_handler):
     '''
     Intilize the bot core object and also the flask object
@@ -0,0 +1,235 @@
+#! /usr/bin/env python3
+
+'''
+candle_archive
+
+'''
+import os
+import logging
+import threading
+import numpy as np
+
+
+## Candles are stored as fixed 48 byte records of 6 little endian float64 values
+## (open time in ms, open, high, low, close, volume) so a file maps straight to an (n, 6) array.
+CANDLE_COLUMNS = ['time', 'open', 'high', 'low', 'close', 'volume']
+RECORD_DTYPE = np.dtype('<f8')
+RECORD_SIZE = RECORD_DTYPE.itemsize*len(CANDLE_COLUMNS)
+
+## Header written to the start of the index file, followed by the sparse time index.
+INDEX_MAGIC = b'SBTCNDL1'
+INDEX_HEADER = np.dtype([
+    ('magic', 'S8'),
+    ('interval_ms', '<i8'),
+    ('count', '<i8'),
+    ('first_time', '<f8'),
+    ('last_time', '<f8'),
+    ('stride', '<i8')])
+
+## Number of records between sparse index entries.
+DEFAULT_INDEX_STRIDE = 4096
+
+
+def archive_path(archive_dir, symbol, interval):
+    return('{0}{1}_{2}.bin'.format(archive_dir, symbol, interval))
+
+
+class CandleArchive(object):
+
+    def __init__(self, data_path, interval_ms=0, index_stride=DEFAULT_INDEX_STRIDE):
+        '''
+        Append only candle archive for one symbol/interval.
+
+        -> Data file (.bin).
+            Fixed size records that are memory mapped with numpy.memmap, slices are views of the file.
+
+        -> Index file (.idx).
+            Small header (count, first/last time) and the open time of every stride'th record,
+            time lookups search the index then one stride of the data so they cost O(log n).
+
+        A partly written last record left by a crash is truncated when the archive is opened.
+        '''
+        self.data_path = data_path
+        self.index_path = data_path[:-4]+'.idx' if data_path.endswith('.bin') else data_path+'.idx'
+        self.interval_ms = interval_ms
+        self.stride = index_stride
+
+        self.count = 0
+        self.first_time = None
+        self.last_time = None
+        self.sparse_index = np.empty(0, dtype=np.float64)
+
+        self.mapped = None
+        self.mapped_count = 0
+
+        self.lock = threading.Lock()
+
+        if os.path.exists(self.data_path):
+            self._load_index()
+
+
+    def __len__(self):
+        return(self.count)
+
+
+    def _file_count(self):
+        return(os.path.getsize(self.data_path)//RECORD_SIZE if os.path.exists(self.data_path) else 0)
+
+
+    def _trim_partial_record(self):
+        ''' Cut off a partly written last record (a crash mid append) so new records are appended on a record boundary. '''
+        size = os.path.getsize(self.data_path)
+        if size % RECORD_SIZE:
+            logging.warning('[CandleArchive] Dropping partial record at the end of {0}.'.format(self.data_path))
+            with open(self.data_path, 'r+b') as file:
+                file.truncate(size-size % RECORD_SIZE)
+
+
+    def _load_index(self):
+        self._trim_partial_record()
+        count = self._file_count()
+
+        if os.path.exists(self.index_path):
+            header = np.fromfile(self.index_path, dtype=INDEX_HEADER, count=1)
+
+            if len(header) and header['magic'][0] == INDEX_MAGIC:
+                self.interval_ms = int(header['interval_ms'][0]) or self.interval_ms
+                self.stride = int(header['stride'][0])
+
+                ## If the header count does not match the data (e.g. a crash between writes) the index is rebuilt.
+                if int(header['count'][0]) == count:
+                    self.count = count
+                    self.first_time = float(header['first_time'][0]) if count else None
+                    self.last_time = float(header['last_time'][0]) if count else None
+                    self.sparse_index = np.fromfile(self.index_path, dtype=np.float64, offset=INDEX_HEADER.itemsize)
+                    return
+
+        self._rebuild_index(count)
+
+
+    def _rebuild_index(self, count):
+        self.count = count
+        candles = self._map()
+
+        if count:
+            self.first_time = float(candles[0][0])
+            self.last_time = float(candles[-1][0])
+            self.sparse_index = np.array(candles[::self.stride, 0])
+        else:
+            self.first_time = None
+            self.last_time = None
+            self.sparse_index = np.empty(0, dtype=np.float64)
+
+        self._save_index()
+
+
+    def _save_index(self):
+        header = np.zeros(1, dtype=INDEX_HEADER)
+        header['magic'] = INDEX_MAGIC
+        header['interval_ms'] = self.interval_ms
+        header['count'] = self.count
+        header['first_time'] = self.first_time or 0
+        header['last_time'] = self.last_time or 0
+        header['stride'] = self.stride
+
+        ## Written to a temp file and swapped in so a crash never leaves a half written index.
+        temp_path = self.index_path+'.tmp'
+        with open(temp_path, 'wb') as file:
+            file.write(header.tobytes())
+            file.write(self.sparse_index.astype(np.float64).tobytes())
+        os.replace(temp_path, self.index_path)
+
+
+    def _map(self):
+        ''' Memory map the data file (re-mapped only when the record count has changed). '''
+        if self.count == 0:
+            return(np.empty((0, len(CANDLE_COLUMNS)), dtype=RECORD_DTYPE))
+
+        if self.mapped is None or self.mapped_count != self.count:
+            self.mapped = np.memmap(self.data_path, dtype=RECORD_DTYPE, mode='r', shape=(self.count, len(CANDLE_COLUMNS)))
+            self.mapped_count = self.count
+
+        return(self.mapped)
+
+
+    def find(self, open_time, side='left'):
+        ''' Index of the first record with time >= open_time (side='right' for > open_time). '''
+        if self.count == 0:
+            return(0)
+
+        block = max(int(np.searchsorted(self.sparse_index, open_time, side=side))-1, 0)
+        start = block*self.stride
+        end = min(start+self.stride+1, self.count)
+
+        return(start+int(np.searchsorted(self._map()[start:end, 0], open_time, side=side)))
+
+
+    def candles(self, start_time=None, end_time=None):
+        '''
+        Oldest first (n, 6) view of the candles with start_time <= open time < end_time.
+        This is a read only view of the mapped file, nothing is parsed or copied.
+        '''
+        start = 0 if start_time == None else self.find(start_time)
+        end = self.count if end_time == None else self.find(end_time)
+        return(self._map()[start:end])
+
+
+    def latest(self, count):
+        ''' The last count candles (oldest first). '''
+        return(self._map()[max(self.count-count, 0):])
+
+
+    def append(self, candles):
+        '''
+        Append oldest first candles ([open time, open, high, low, close, volume, ...]).
+        Candles that are not newer than the last stored candle are skipped, returns the number added.
+        '''
+        with self.lock:
+            if not len(candles):
+                return(0)
+
+            records = np.asarray([candle[:len(CANDLE_COLUMNS)] for candle in candles], dtype=RECORD_DTYPE)
+
+            if self.last_time != None:
+                records = records[records[:, 0] > self.last_time]
+
+            if not len(records):
+                return(0)
+
+            with open(self.data_path, 'ab') as file:
+                file.write(records.tobytes())
+
+            old_count = self.count
+            self.count += len(records)
+            self.first_time = float(records[0][0]) if self.first_time == None else self.first_time
+            self.last_time = float(records[-1][0])
+
+            ## Add any new sparse index entries.
+            first_new = -(-old_count//self.stride)*self.stride
+            positions = np.arange(first_new, self.count, self.stride)
+            if len(positions):
+                self.sparse_index = np.concatenate((self.sparse_index, records[positions-old_count, 0]))
+
+            self._save_index()
+            return(len(records))
+
+
+def resample(candles, factor):
+    '''
+    Combine every factor candles of an oldest first (n, 6) array into one (e.g. 1m -> 15m with factor 15).
+    Groups start at the first candle, any trailing partial group is dropped.
+    '''
+    count = (len(candles)//factor)*factor
+    if not count:
+        return(np.empty((0, len(CANDLE_COLUMNS))))
+
+    candles = np.asarray(candles[:count])
+    starts = np.arange(0, count, factor)
+
+    return(np.column_stack([
+        candles[starts, 0],
+        candles[starts, 1],
+        np.maximum.reduceat(candles[:, 2], starts),
+        np.minimum.reduceat(candles[:, 3], starts),
+        candles[starts+factor-1, 4],
+        np.add.reduceat(candles[:, 5], starts)]))
@@ -0,0 +1,184 @@
+#! /usr/bin/env python3
+
+'''
+candle_puller
+
+'''
+import os
+import time
+import logging
+import threading
+import requests
+from concurrent.futures import ThreadPoolExecutor
+
+from . import candle_archive
+
+
+## Binance REST endpoint used for historic klines (can be pointed at a local server).
+REST_URL = 'https://api.binance.com'
+KLINES_PATH = '/api/v3/klines'
+
+## Max klines per request and the request weight for that size.
+KLINES_LIMIT = 1000
+KLINES_WEIGHT = 2
+
+## Default request weight allowed per minute (the exchange info rate limits are used when available).
+DEFAULT_WEIGHT_LIMIT = 1200
+
+## Interval lengths in ms.
+INTERVAL_MS = {
+    '1m':60000, '3m':180000, '5m':300000, '15m':900000, '30m':1800000,
+    '1h':3600000, '2h':7200000, '4h':14400000, '6h':21600000, '8h':28800000, '12h':43200000,
+    '1d':86400000, '3d':259200000, '1w':604800000
+}
+
+
+def request_weight_limit(rate_limits, default=DEFAULT_WEIGHT_LIMIT):
+    ''' Request weight allowed per minute from the exchange info rateLimits. '''
+    for rate_limit in rate_limits:
+        if rate_limit['rateLimitType'] == 'REQUEST_WEIGHT' and rate_limit['interval'] == 'MINUTE' and rate_limit.get('intervalNum', 1) == 1:
+            return(rate_limit['limit'])
+    return(default)
+
+
+class WeightLimiter(object):
+
+    def __init__(self, weight_limit=DEFAULT_WEIGHT_LIMIT, safety=0.9, interval=60):
+        '''
+        Shared request weight budget for all the download threads.
+        The budget resets each interval seconds (a minute like the exchange by default) and is synced from the X-MBX-USED-WEIGHT-1M header.
+        '''
+        self.safety = safety
+        self.budget = max(int(weight_limit*safety), 1)
+        self.interval = interval
+        self.used = 0
+        self.window = int(time.time()//interval)
+        self.blocked_until = 0
+
+        self.lock = threading.Lock()
+
+
+    def acquire(self, weight):
+        ''' Block until the weight can be used without going over the budget. '''
+        while True:
+            with self.lock:
+                now = time.time()
+                window = int(now//self.interval)
+
+                if window != self.window:
+                    self.window = window
+                    self.used = 0
+
+                if now >= self.blocked_until and (self.used+weight) <= self.budget:
+                    self.used += weight
+                    return
+
+                wait_time = max(self.blocked_until, (self.window+1)*self.interval)-now
+
+            time.sleep(max(wait_time, 0.05))
+
+
+    def set_limit(self, weight_limit):
+        ''' Change the limit in place so everything sharing the limiter uses the new budget. '''
+        with self.lock:
+            self.budget = max(int(weight_limit*self.safety), 1)
+
+
+    def sync(self, used_weight):
+        with self.lock:
+            self.used = max(self.used, used_weight)
+
+
+    def back_off(self, seconds):
+        with self.lock:
+            self.blocked_until = max(self.blocked_until, time.time()+seconds)
+
+
+class CandlePuller(object):
+
+    def __init__(self, candles_dir, interval, rest_url=REST_URL, weight_limit=DEFAULT_WEIGHT_LIMIT, workers=8, weight_limiter=None):
+        '''
+        Bulk downloader for historic klines.
+
+        Each market is paged from its last stored candle (or the start time) up to now and only
+        closed candles are appended to its candle archive, so an interrupted pull can be resumed.
+        weight_limiter is a WeightLimiter shared with other REST users (one is made from weight_limit if None).
+        '''
+        self.candles_dir = candles_dir
+        self.interval = interval
+        self.interval_ms = INTERVAL_MS[interval]
+        self.rest_url = rest_url
+        self.workers = workers
+
+        self.limiter = weight_limiter if weight_limiter != None else WeightLimiter(weight_limit)
+        self.local = threading.local()
+
+        os.makedirs(candles_dir, exist_ok=True)
+
+
+    def _session(self):
+        ''' Keep-alive session per download thread. '''
+        if not hasattr(self.local, 'session'):
+            self.local.session = requests.Session()
+        return(self.local.session)
+
+
+    def _get_klines(self, symbol, start_time):
+        params = {'symbol':symbol, 'interval':self.interval, 'startTime':start_time, 'limit':KLINES_LIMIT}
+
+        while True:
+            self.limiter.acquire(KLINES_WEIGHT)
+            response = self._session().get(self.rest_url+KLINES_PATH, params=params, timeout=30)
+
+            if 'X-MBX-USED-WEIGHT-1M' in response.headers:
+                self.limiter.sync(int(response.headers['X-MBX-USED-WEIGHT-1M']))
+
+            ## Rate limited (429) or IP banned (418), wait for as long as the exchange asks.
+            if response.status_code in (418, 429):
+                retry_after = int(response.headers.get('Retry-After', 60))
+                logging.warning('[CandlePuller] Rate limited, backing off for {0}s.'.format(retry_after))
+                self.limiter.back_off(retry_after)
+                continue
+
+            response.raise_for_status()
+            return(response.json())
+
+
+    def pull_symbol(self, symbol, start_time):
+        '''
+        Download all closed candles for the symbol from its last stored candle (or start_time).
+        Returns the number of candles added.
+        '''
+        archive = candle_archive.CandleArchive(
+            candle_archive.archive_path(self.candles_dir, symbol, self.interval), 
+            interval_ms=self.interval_ms)
+        next_time = start_time if archive.last_time == None else int(archive.last_time)+self.interval_ms
+        added = 0
+
+        while True:
+            now = int(time.time()*1000)
+            klines = self._get_klines(symbol, next_time)
+
+            ## Only store closed candles so the open one is pulled again on resume.
+            klines = [kline for kline in klines if kline[6] < now and kline[0] >= next_time]
+
+            if not klines:
+                break
+
+            added += archive.append(klines)
+            next_time = klines[-1][0]+self.interval_ms
+
+        logging.info('[CandlePuller] {0}: added {1} candles.'.format(symbol, added))
+        return(added)
+
+
+    def pull(self, symbols, start_time):
+        ''' Pull all the symbols concurrently, returns {symbol:candles added}. '''
+        logging.info('[CandlePuller] Pulling {0} candles for {1} markets.'.format(self.interval, len(symbols)))
+        start = time.time()
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            results = dict(zip(symbols, executor.map(lambda symbol: self.pull_symbol(symbol, start_time), symbols)))
+
+        logging.info('[CandlePuller] Finished pulling {0} candles in {1:.1f}s.'.format(sum(results.values()), time.time()-start))
+        return(results)
@@ -0,0 +1,227 @@
+#! /usr/bin/env python3
+
+'''
+candle_store
+
+'''
+import os
+import time
+import logging
+import threading
+import numpy as np
+from collections.abc import Sequence
+
+
+## Column layout used by the candle store.
+CANDLE_COLUMNS = ['time', 'open', 'high', 'low', 'close', 'volume']
+TIME, OPEN, HIGH, LOW, CLOSE, VOLUME = range(len(CANDLE_COLUMNS))
+
+
+## Encodings for candles sent over the REST api.
+DATA_FORMATS = ['json', 'columnar', 'binary']
+
+## Live candle checkpoint kept in the cache dir (one per interval) so a restart only fetches the candles since it.
+CHECKPOINT_FILE = 'live_candles_{0}.npz'
+
+
+def encode_candles(candles, data_format='json'):
+    '''
+    Encode a newest first (n, 6) candle array:
+        json - list of rows, columnar - {column:[values]}, binary - raw little endian float64 rows.
+    '''
+    if data_format == 'columnar':
+        return({name:candles[:, index].tolist() for index, name in enumerate(CANDLE_COLUMNS)})
+    if data_format == 'binary':
+        return(np.ascontiguousarray(candles, dtype='<f8').tobytes())
+    return(candles.tolist())
+
+
+def slice_newest(data, count):
+    ''' The newest count values (all if None) of newest first indicator data (nested dicts of lists/arrays/sequences) as lists. '''
+    if isinstance(data, dict):
+        return({key:slice_newest(value, count) for key, value in data.items()})
+    if isinstance(data, (list, tuple, np.ndarray)) or (isinstance(data, Sequence) and not isinstance(data, str)):
+        return(list(data[:count]))
+    return(data)
+
+
+def merge_candles(recent, older):
+    ''' Newest first candles fetched since a checkpoint followed by the older checkpointed candles they do not overlap. '''
+    if not len(recent):
+        return(older)
+    recent = np.asarray(recent, dtype=np.float64)[:, :len(CANDLE_COLUMNS)]
+    older = older[older[:, TIME] < recent[-1][TIME]]
+    return(np.concatenate([recent, older]))
+
+
+def load_checkpoint(file_path, interval_ms):
+    ''' {symbol:newest first candles} from a checkpoint file, empty if there is none or it is for another interval. '''
+    if not os.path.exists(file_path):
+        return({})
+
+    try:
+        with np.load(file_path) as checkpoint:
+            if int(checkpoint['interval_ms'][0]) != interval_ms:
+                return({})
+            return({symbol:checkpoint[symbol] for symbol in checkpoint.files if symbol != 'interval_ms'})
+    except Exception as e:
+        logging.warning('[CandleStore] Unable to read candle checkpoint {0}: {1}.'.format(file_path, e))
+        return({})
+
+
+def checkpoint_fetch_limit(checkpoint, symbols, capacity, interval_ms, now_ms=None):
+    '''
+    Number of candles to fetch for the symbols to be topped up from the checkpoint, the newest checkpointed candle
+    (which may have still been open) and every candle since. Returns capacity if any symbol needs its full history.
+    '''
+    now_ms = int(time.time()*1000) if now_ms == None else now_ms
+    limit = 1
+
+    for symbol in symbols:
+        candles = checkpoint.get(symbol)
+        if candles is None or not len(candles):
+            return(capacity)
+
+        missing = int((now_ms-candles[0][TIME])//interval_ms)+1
+        if missing+len(candles)-1 < capacity or missing >= capacity:
+            return(capacity)
+        limit = max(limit, missing+1)
+
+    return(limit)
+
+
+class CandleStore(object):
+
+    def __init__(self, capacity=500):
+        '''
+        Fixed capacity ring buffer of candles for one market.
+
+        Each row is written twice (slot and slot+length) and the head moves backwards, so the
+        newest first window is always one contiguous slice of the buffer. This allows view()
+        to return a zero-copy array where index 0 is the newest candle, like the socket lists.
+
+        One spare slot is kept so a view taken before a push stays valid after it.
+        '''
+        self.capacity = capacity
+        self.length = capacity+1
+
+        self.buffer = np.zeros((self.length*2, len(CANDLE_COLUMNS)), dtype=np.float64)
+        self.head = 0
+        self.size = 0
+
+        ## Goes up with every write so readers can tell when the open candle has changed.
+        self.version = 0
+
+        self.lock = threading.Lock()
+
+
+    def _write(self, slot, candle):
+        self.buffer[slot] = candle[:len(CANDLE_COLUMNS)]
+        self.buffer[slot+self.length] = self.buffer[slot]
+        self.version += 1
+
+
+    def push(self, candle):
+        ''' Add a new candle as the newest row. '''
+        with self.lock:
+            self.head = (self.head-1) % self.length
+            self._write(self.head, candle)
+            self.size = min(self.size+1, self.capacity)
+
+
+    def update(self, candle):
+        '''
+        Update the store with the latest socket candle.
+        Same open time patches the newest row, a newer open time pushes a new row and older candles are ignored.
+        '''
+        if self.size and candle[TIME] == self.buffer[self.head][TIME]:
+            with self.lock:
+                self._write(self.head, candle)
+        elif not(self.size) or candle[TIME] > self.buffer[self.head][TIME]:
+            self.push(candle)
+
+
+    def seed(self, candles):
+        ''' Load a newest first list of candles replacing anything already stored. '''
+        with self.lock:
+            self.head = 0
+            self.size = 0
+
+        for candle in list(candles[:self.capacity])[::-1]:
+            self.push(candle)
+
+
+    def view(self):
+        ''' Newest first (size, 6) array, this is a view of the buffer so it must not be modified. '''
+        return(self.buffer[self.head:self.head+self.size])
+
+
+    def column(self, name):
+        ''' Newest first view of a single column (e.g. close). '''
+        return(self.view()[:, CANDLE_COLUMNS.index(name)])
+
+
+    def snapshot(self):
+        ''' Copy of the current candles for use outside of the trader loop. '''
+        with self.lock:
+            return(self.view().copy())
+
+
+    def since(self, open_time=None):
+        '''
+        Copy of the newest first candles with an open time >= open_time (all candles if None).
+        The newest (open) candle is always included as it keeps changing until it closes (its changes also change the etag).
+        '''
+        with self.lock:
+            candles = self.view()
+            if open_time != None:
+                count = int(np.searchsorted(-candles[:, TIME], -float(open_time), side='right'))
+                candles = candles[:max(count, 1)]
+            return(candles.copy())
+
+
+    def last_time(self):
+        return(float(self.buffer[self.head][TIME]) if self.size else None)
+
+
+    def etag(self):
+        ''' Tag for the current candles, the last candle time and the write version (open candle updates change it). '''
+        return('{0:.0f}-{1}'.format(self.last_time() or 0, self.version))
+
+
+class CandleStoreSet(object):
+
+    def __init__(self, capacity=500):
+        ''' Holds a candle store per symbol, shared by the socket feed and the traders. '''
+        self.capacity = capacity
+        self.stores = {}
+
+
+    def get_store(self, symbol):
+        if not symbol in self.stores:
+            self.stores.update({symbol:CandleStore(self.capacity)})
+        return(self.stores[symbol])
+
+
+    def seed(self, symbol, candles):
+        self.get_store(symbol).seed(candles)
+        logging.debug('[CandleStoreSet] Seeded {0} with {1} candles.'.format(symbol, len(candles)))
+
+
+    def update(self, symbol, candle):
+        self.get_store(symbol).update(candle)
+
+
+    def get_candles(self, symbol):
+        ''' Newest first candle view, used by the traders in place of the socket candle endpoint. '''
+        return(self.get_store(symbol).view())
+
+
+    def save_checkpoint(self, file_path, interval_ms):
+        ''' Write every stores candles to the checkpoint (a temp file is renamed over it so it is never left half written). '''
+        candles = {symbol:store.snapshot() for symbol, store in list(self.stores.items())}
+        temp_path = file_path+'.tmp'
+
+        with open(temp_path, 'wb') as file:
+            np.savez(file, interval_ms=np.array([interval_ms], dtype=np.int64), **candles)
+        os.replace(temp_path, file_path)
@@ -0,0 +1,1006 @@
+#! /usr/bin/env python3
+
+'''
+fake_exchange
+
+Offline stand-in for the Binance REST and websocket endpoints used by the bot (for load testing).
+Usage: python3 -m core.fake_exchange [scenario json file]
+'''
+import sys
+import json
+import math
+import time
+import heapq
+import base64
+import socket
+import struct
+import random
+import hashlib
+import logging
+import itertools
+import threading
+from urllib.parse import urlparse, parse_qsl
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+
+## Scenario used for anything not set (rates are messages per second per market, times are in seconds, 0 turns a feature off).
+DEFAULT_SCENARIO = {
+    'markets':10,
+    'quote_asset':'BTC',
+    'interval':'1m',
+    'candle_seconds':60,
+    'candle_rate':1.0,
+    'depth_rate':10.0,
+    'depth_levels':100,
+    'burst_every':0,
+    'burst_size':100,
+    'disconnect_every':0,
+    'balance':1.0,
+    'seed':1,
+    'host':'127.0.0.1',
+    'rest_port':0,
+    'socket_port':0}
+
+## Price/quantity filters given to every fake market (same filter order as the exchange info botCore reads).
+TICK_SIZE = 0.000001
+MIN_QTY = 0.001
+MIN_NOTIONAL = 0.0001
+
+RATE_LIMITS = [
+    {'rateLimitType':'REQUEST_WEIGHT', 'interval':'MINUTE', 'intervalNum':1, 'limit':1200},
+    {'rateLimitType':'ORDERS', 'interval':'SECOND', 'intervalNum':10, 'limit':50},
+    {'rateLimitType':'ORDERS', 'interval':'DAY', 'intervalNum':1, 'limit':160000}]
+
+## Closed candles kept per market for the REST klines.
+HISTORY_CANDLES = 1000
+
+## Order ids used for the burst executionReports (well above any order placed by the bot).
+BURST_ORDER_ID = 1000000000
+
+WS_GUID = '258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+
+
+def load_scenario(file_path=None):
+    ''' The default scenario updated with a json scenario file. '''
+    scenario = dict(DEFAULT_SCENARIO)
+    if file_path:
+        with open(file_path, 'r') as file:
+            scenario.update(json.loads(file.read()))
+    return(scenario)
+
+
+def format_number(value):
+    return('{0:.8f}'.format(value))
+
+
+def percentiles(values, quantiles=(0.5, 0.9, 0.99)):
+    ''' {'count', 'p50', 'p90', 'p99', 'max'} of a list of values (None values if it is empty). '''
+    values = sorted(values)
+    summary = {'count':len(values), 'max':values[-1] if values else None}
+
+    for quantile in quantiles:
+        summary['p{0:g}'.format(quantile*100)] = values[min(int(quantile*len(values)), len(values)-1)] if values else None
+    return(summary)
+
+
+class FakeMarket(object):
+
+    def __init__(self, base_asset, quote_asset, price, random_, candle_ms, depth_levels):
+        '''
+        Simulated market, a random walk price with the current candle and a book of depth_levels per side
+        kept as {price in ticks:quantity} around it.
+        '''
+        self.base_asset = base_asset
+        self.quote_asset = quote_asset
+        self.symbol = base_asset+quote_asset
+        self.stream_symbol = self.symbol.lower()
+
+        self.price = price
+        self.random = random_
+        self.candle_ms = candle_ms
+        self.depth_levels = depth_levels
+
+        now_ms = int(time.time()*1000)
+        self.candle = self._new_candle((now_ms//candle_ms)*candle_ms, price)
+        self.history = None
+
+        self.bids = {}
+        self.asks = {}
+        self.update_id = 1
+        self._fill_book()
+
+
+    def _new_candle(self, open_time, price):
+        ## [open_time, open, high, low, close, volume, trades]
+        return([open_time, price, price, price, price, 0.0, 0])
+
+
+    def step(self):
+        ''' Move the price on (and trade some volume at it). '''
+        self.price = max(self.price*(1+self.random.gauss(0, 0.0005)), TICK_SIZE*10)
+        candle = self.candle
+        candle[2] = max(candle[2], self.price)
+        candle[3] = min(candle[3], self.price)
+        candle[4] = self.price
+        candle[5] += self.random.uniform(0.1, 10)
+        candle[6] += 1
+
+
+    def kline_events(self, now_ms, interval):
+        ''' Kline events for a price step, the closing event of the last candle comes first if a new candle has started. '''
+        events = []
+        open_time = (now_ms//self.candle_ms)*self.candle_ms
+
+        if open_time != self.candle[0]:
+            events.append(self._kline_event(now_ms, interval, True))
+            if self.history != None:
+                self.history.append(self.candle)
+                del self.history[:-HISTORY_CANDLES]
+            self.candle = self._new_candle(open_time, self.price)
+
+        self.step()
+        events.append(self._kline_event(now_ms, interval, False))
+        return(events)
+
+
+    def _kline_event(self, now_ms, interval, closed):
+        open_time, open_, high, low, close, volume, trades = self.candle
+        return({
+            'e':'kline',
+            'E':now_ms,
+            's':self.symbol,
+            'k':{
+                't':open_time,
+                'T':open_time+self.candle_ms-1,
+                's':self.symbol,
+                'i':interval,
+                'f':0,
+                'L':trades,
+                'o':format_number(open_),
+                'c':format_number(close),
+                'h':format_number(high),
+                'l':format_number(low),
+                'v':format_number(volume),
+                'n':trades,
+                'x':closed,
+                'q':format_number(volume*close),
+                'V':format_number(volume/2),
+                'Q':format_number(volume*close/2),
+                'B':'0'}})
+
+
+    def _fill_book(self):
+        ''' Put the book back around the price, returns the changed levels ({tick:qty} per side, 0 removes a level). '''
+        mid = int(round(self.price/TICK_SIZE))
+        changes = {'b':{}, 'a':{}}
+
+        for side, book, start, direction in [('b', self.bids, mid-1, -1), ('a', self.asks, mid+1, 1)]:
+            crossed = [tick for tick in book if (tick >= mid if side == 'b' else tick <= mid)]
+            far = start+(direction*self.depth_levels)
+            crossed += [tick for tick in book if (tick <= far if side == 'b' else tick >= far)]
+
+            for tick in crossed:
+                if tick in book:
+                    del book[tick]
+                    changes[side][tick] = 0.0
+
+            for offset in range(self.depth_levels):
+                tick = start+(direction*offset)
+                if not tick in book:
+                    book[tick] = changes[side][tick] = round(self.random.uniform(0.1, 50), 3)
+
+        return(changes)
+
+
+    def depth_event(self, now_ms):
+        ''' Diff depth event for the book moving with the price and a few levels changing size. '''
+        changes = self._fill_book()
+
+        for side, book in [('b', self.bids), ('a', self.asks)]:
+            ticks = list(book)
+            for _ in range(3):
+                tick = self.random.choice(ticks)
+                book[tick] = changes[side][tick] = round(self.random.uniform(0.1, 50), 3)
+
+        first_id = self.update_id+1
+        self.update_id += 1+self.random.randint(0, 3)
+
+        return({
+            'e':'depthUpdate',
+            'E':now_ms,
+            's':self.symbol,
+            'U':first_id,
+            'u':self.update_id,
+            'b':[[format_number(tick*TICK_SIZE), format_number(qty)] for tick, qty in changes['b'].items()],
+            'a':[[format_number(tick*TICK_SIZE), format_number(qty)] for tick, qty in changes['a'].items()]})
+
+
+    def depth_snapshot(self, limit):
+        bids = sorted(self.bids.items(), reverse=True)[:limit]
+        asks = sorted(self.asks.items())[:limit]
+        return({
+            'lastUpdateId':self.update_id,
+            'bids':[[format_number(tick*TICK_SIZE), format_number(qty)] for tick, qty in bids],
+            'asks':[[format_number(tick*TICK_SIZE), format_number(qty)] for tick, qty in asks]})
+
+
+    def klines(self, limit, end_time=None):
+        '''
+        REST klines (oldest first), a seeded walk back from the current candle is made the first time they
+        are asked for, candles that close after that are added to it.
+        '''
+        if self.history == None:
+            self.history = []
+            close = self.candle[1]
+            for index in range(1, HISTORY_CANDLES+1):
+                open_ = close*(1+self.random.gauss(0, 0.002))
+                high = max(open_, close)*(1+self.random.uniform(0, 0.001))
+                low = min(open_, close)*(1-self.random.uniform(0, 0.001))
+                self.history.append([self.candle[0]-(index*self.candle_ms), open_, high, low, close, self.random.uniform(10, 1000), 100])
+                close = open_
+            self.history.reverse()
+
+        candles = self.history+[self.candle]
+        if end_time != None:
+            candles = [candle for candle in candles if candle[0] <= end_time]
+
+        return([[
+            candle[0],
+            format_number(candle[1]),
+            format_number(candle[2]),
+            format_number(candle[3]),
+            format_number(candle[4]),
+            format_number(candle[5]),
+            candle[0]+self.candle_ms-1,
+            format_number(candle[5]*candle[4]),
+            candle[6],
+            format_number(candle[5]/2),
+            format_number(candle[5]*candle[4]/2),
+            '0'] for candle in candles[-limit:]])
+
+
+class SocketClient(object):
+
+    def __init__(self, connection, streams, combined):
+        ''' A websocket connection and the streams it is subscribed to (combined connections get {'stream', 'data'} messages). '''
+        self.connection = connection
+        self.combined = combined
+        self.streams = set()
+        self.kline_symbols = set()
+        self.depth_symbols = set()
+        self.listen_keys = set()
+        self.lock = threading.Lock()
+        self.subscribe(streams)
+
+
+    def subscribe(self, streams):
+        for stream in streams:
+            self.streams.add(stream)
+            if '@kline' in stream:
+                self.kline_symbols.add(stream.split('@')[0])
+            elif '@depth' in stream:
+                self.depth_symbols.add(stream.split('@')[0])
+            elif not '@' in stream:
+                self.listen_keys.add(stream)
+
+
+    def stream_name(self, symbol, kind):
+        for stream in self.streams:
+            if stream.startswith(symbol+'@'+kind):
+                return(stream)
+        return(symbol+'@'+kind)
+
+
+    def send(self, payload, opcode=0x1):
+        ''' Send one unmasked frame (server frames are never masked). '''
+        length = len(payload)
+        if length < 126:
+            header = struct.pack('!BB', 0x80|opcode, length)
+        elif length < 65536:
+            header = struct.pack('!BBH', 0x80|opcode, 126, length)
+        else:
+            header = struct.pack('!BBQ', 0x80|opcode, 127, length)
+
+        with self.lock:
+            self.connection.sendall(header+payload)
+
+
+    def close(self):
+        try:
+            self.connection.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.connection.close()
+
+
+class FakeExchange(object):
+
+    def __init__(self, scenario=None):
+        '''
+        Local stand-in for the Binance endpoints used by rest_master/socket_master, the order books and the order gateway.
+
+        -> REST.
+            Exchange info, klines, depth snapshots, account/margin account, order place/cancel/query/cancel-replace,
+            margin loan/repay and user data stream listen keys, plus /fake/stats and /fake/reset for the driver.
+
+        -> Websocket.
+            Combined (/stream?streams=...) and raw (/ws/...) connections, kline and diff depth streams are sent at the
+            scenario rates per market and listen keys get executionReport/outboundAccountPosition events.
+
+        -> Orders.
+            MARKET orders fill at once, LIMIT/STOP_LOSS_LIMIT orders fill when the simulated price reaches them.
+            The time from the last market message sent for a symbol to an order for it arriving is recorded
+            as the exchange side tick to order latency.
+
+        -> Scripted load.
+            executionReport bursts for orders that are not the bot's (burst_every/burst_size) and dropping every
+            websocket connection (disconnect_every) to test reconnects.
+        '''
+        self.scenario = dict(DEFAULT_SCENARIO)
+        self.scenario.update(scenario or {})
+
+        self.random = random.Random(self.scenario['seed'])
+        self.interval = self.scenario['interval']
+        candle_ms = int(self.scenario['candle_seconds']*1000)
+        quote_asset = self.scenario['quote_asset']
+
+        self.markets = {}
+        for index in range(self.scenario['markets']):
+            market = FakeMarket(
+                'M{0:04d}'.format(index),
+                quote_asset,
+                self.random.uniform(0.001, 0.1),
+                random.Random(self.scenario['seed']*100000+index),
+                candle_ms,
+                self.scenario['depth_levels'])
+            self.markets.update({market.symbol:market})
+        self.stream_markets = {market.stream_symbol:market for market in self.markets.values()}
+
+        ## Account and orders.
+        self.balances = {quote_asset:[float(self.scenario['balance']), 0.0]}
+        self.loans = {}
+        self.orders = {}
+        self.order_ids = itertools.count(1)
+        self.tran_ids = itertools.count(1)
+        self.listen_keys = set()
+
+        self.clients = []
+        self.last_sent = {}
+        self.disconnect_time = None
+
+        self.stats = {}
+        self.order_latencies = []
+        self.reset_stats()
+
+        self.lock = threading.Lock()
+        self.running = False
+        self.threads = []
+        self.rest_server = None
+        self.socket_server = None
+
+
+    def reset_stats(self):
+        ''' Zero the message/order counts and latencies (the driver does this once the bot has warmed up). '''
+        self.stats = {
+            'start_time':time.time(),
+            'kline':0,
+            'depth':0,
+            'execution':0,
+            'account':0,
+            'bursts':0,
+            'orders':0,
+            'cancels':0,
+            'rest_requests':0,
+            'connections':0,
+            'disconnects':0,
+            'reconnect_seconds':[],
+            'max_lag':0.0}
+        self.order_latencies = []
+
+
+    def get_stats(self):
+        stats = dict(self.stats)
+        elapsed = time.time()-stats['start_time']
+        stats.update({
+            'elapsed':elapsed,
+            'market_messages_per_second':(stats['kline']+stats['depth'])/elapsed if elapsed else 0.0,
+            'tick_to_order':percentiles(self.order_latencies)})
+        return(stats)
+
+
+    @property
+    def rest_url(self):
+        return('http://{0}:{1}'.format(self.scenario['host'], self.rest_server.server_address[1]))
+
+
+    @property
+    def socket_url(self):
+        return('ws://{0}:{1}'.format(self.scenario['host'], self.socket_server.getsockname()[1]))
+
+
+    def start(self):
+        self.running = True
+
+        self.rest_server = ThreadingHTTPServer((self.scenario['host'], self.scenario['rest_port']), RestHandler)
+        self.rest_server.daemon_threads = True
+        self.rest_server.exchange = self
+
+        self.socket_server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.socket_server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.socket_server.bind((self.scenario['host'], self.scenario['socket_port']))
+        self.socket_server.listen(128)
+
+        for target, name in [(self.rest_server.serve_forever, 'fake-rest'), (self._accept, 'fake-socket'), (self._generate, 'fake-market-data')]:
+            thread = threading.Thread(target=target, name=name)
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+
+        logging.info('[FakeExchange] {0} markets, REST at {1}, websocket at {2}.'.format(len(self.markets), self.rest_url, self.socket_url))
+
+
+    def stop(self):
+        self.running = False
+        self.rest_server.shutdown()
+        self.socket_server.close()
+        self.disconnect_all(count=False)
+
+
+    ## Websocket.
+    def _accept(self):
+        while self.running:
+            try:
+                connection, address = self.socket_server.accept()
+            except OSError:
+                return
+            thread = threading.Thread(target=self._serve_client, args=(connection,), name='fake-socket-client')
+            thread.daemon = True
+            thread.start()
+
+
+    def _serve_client(self, connection):
+        connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        request = b''
+        while not b'\r\n\r\n' in request:
+            data = connection.recv(4096)
+            if not data:
+                connection.close()
+                return
+            request += data
+
+        lines = request.split(b'\r\n\r\n')[0].decode('utf-8').split('\r\n')
+        path = lines[0].split(' ')[1]
+        headers = dict((line.split(':', 1)[0].strip().lower(), line.split(':', 1)[1].strip()) for line in lines[1:] if ':' in line)
+
+        accept = base64.b64encode(hashlib.sha1((headers.get('sec-websocket-key', '')+WS_GUID).encode('utf-8')).digest()).decode('utf-8')
+        connection.sendall((
+            'HTTP/1.1 101 Switching Protocols\r\n'
+            'Upgrade: websocket\r\n'
+            'Connection: Upgrade\r\n'
+            'Sec-WebSocket-Accept: {0}\r\n\r\n').format(accept).encode('utf-8'))
+
+        parsed = urlparse(path)
+        if parsed.path.startswith('/stream'):
+            streams = dict(parse_qsl(parsed.query)).get('streams', '')
+            streams = [stream for stream in streams.split('/') if stream]
+        else:
+            streams = [stream for stream in parsed.path.split('/ws/', 1)[-1].split('/') if stream]
+
+        client = SocketClient(connection, streams, parsed.path.startswith('/stream'))
+
+        with self.lock:
+            self.clients.append(client)
+            self.stats['connections'] += 1
+            if self.disconnect_time != None:
+                self.stats['reconnect_seconds'].append(time.time()-self.disconnect_time)
+                self.disconnect_time = None
+
+        try:
+            self._read_frames(client)
+        except (OSError, ValueError):
+            pass
+
+        with self.lock:
+            if client in self.clients:
+                self.clients.remove(client)
+        client.close()
+
+
+    def _read_frames(self, client):
+        ''' Handle the client frames (pings, closes and SUBSCRIBE requests) until the connection ends. '''
+        reader = client.connection.makefile('rb')
+
+        while self.running:
+            header = reader.read(2)
+            if len(header) < 2:
+                return
+
+            opcode = header[0] & 0x0f
+            length = header[1] & 0x7f
+            if length == 126:
+                length = struct.unpack('!H', reader.read(2))[0]
+            elif length == 127:
+                length = struct.unpack('!Q', reader.read(8))[0]
+
+            mask = reader.read(4) if header[1] & 0x80 else b'\x00\x00\x00\x00'
+            payload = bytes(byte ^ mask[index % 4] for index, byte in enumerate(reader.read(length)))
+
+            if opcode == 0x8:
+                client.send(payload[:2], opcode=0x8)
+                return
+            elif opcode == 0x9:
+                client.send(payload, opcode=0xA)
+            elif opcode == 0x1:
+                message = json.loads(payload)
+                if message.get('method') == 'SUBSCRIBE':
+                    client.subscribe(message.get('params', []))
+                client.send(json.dumps({'result':None, 'id':message.get('id')}).encode('utf-8'))
+
+
+    def disconnect_all(self, count=True):
+        ''' Drop every websocket connection without a close frame (as a network failure would). '''
+        with self.lock:
+            clients = self.clients
+            self.clients = []
+            if count:
+                self.stats['disconnects'] += 1
+                self.disconnect_time = time.time()
+
+        for client in clients:
+            client.close()
+        logging.info('[FakeExchange] Dropped {0} websocket connections.'.format(len(clients)))
+
+
+    def _publish(self, kind, symbol, events):
+        ''' Send market events to the clients subscribed to the symbols kline/depth stream. '''
+        sent = False
+
+        for client in list(self.clients):
+            if not symbol in (client.kline_symbols if kind == 'kline' else client.depth_symbols):
+                continue
+            try:
+                for event in events:
+                    if client.combined:
+                        event = {'stream':client.stream_name(symbol, kind), 'data':event}
+                    client.send(json.dumps(event).encode('utf-8'))
+                sent = True
+            except OSError:
+                pass
+
+        if sent:
+            self.stats[kind] += len(events)
+            self.last_sent[symbol.upper()] = time.perf_counter()
+
+
+    def _publish_user(self, events, kind='execution'):
+        ''' Send user data events to every client listening on a listen key. '''
+        for client in list(self.clients):
+            if not client.listen_keys:
+                continue
+            listen_key = next(iter(client.listen_keys))
+            try:
+                for event in events:
+                    if client.combined:
+                        event = {'stream':listen_key, 'data':event}
+                    client.send(json.dumps(event).encode('utf-8'))
+            except OSError:
+                continue
+            self.stats[kind] += len(events)
+
+
+    def _generate(self):
+        ''' Send the market data for every market at the scenario rates (with the bursts and disconnects on their timers). '''
+        schedule = []
+        sequence = itertools.count()
+        now = time.perf_counter()
+
+        for kind, rate in [('kline', self.scenario['candle_rate']), ('depth', self.scenario['depth_rate'])]:
+            if rate <= 0:
+                continue
+            for symbol in self.stream_markets:
+                ## Markets are spread over the first period so they do not all send at once.
+                heapq.heappush(schedule, (now+self.random.uniform(0, 1.0/rate), next(sequence), kind, symbol, 1.0/rate))
+
+        burst_every = self.scenario['burst_every']
+        disconnect_every = self.scenario['disconnect_every']
+        next_burst = now+burst_every if burst_every else math.inf
+        next_disconnect = now+disconnect_every if disconnect_every else math.inf
+
+        while self.running:
+            now = time.perf_counter()
+
+            if now >= next_burst:
+                self._burst()
+                next_burst += burst_every
+            if now >= next_disconnect:
+                self.disconnect_all()
+                next_disconnect += disconnect_every
+
+            if not schedule or schedule[0][0] > now:
+                time.sleep(min((schedule[0][0]-now) if schedule else 0.05, 0.05))
+                continue
+
+            due, _, kind, symbol, period = heapq.heappop(schedule)
+            self.stats['max_lag'] = max(self.stats['max_lag'], now-due)
+            market = self.stream_markets[symbol]
+            now_ms = int(time.time()*1000)
+
+            with self.lock:
+                if kind == 'kline':
+                    events = market.kline_events(now_ms, self.interval)
+                    fills = self._match_orders(market)
+                else:
+                    events = [market.depth_event(now_ms)]
+                    fills = []
+
+            self._publish(kind, symbol, events)
+            if fills:
+                self._publish_user(fills)
+
+            heapq.heappush(schedule, (due+period, next(sequence), kind, symbol, period))
+
+
+    def _burst(self):
+        ''' A burst of executionReports (new then cancelled) for orders the bot did not place. '''
+        events = []
+        symbols = list(self.markets)
+
+        with self.lock:
+            for index in range(self.scenario['burst_size']):
+                market = self.markets[self.random.choice(symbols)]
+                order = {
+                    'symbol':market.symbol,
+                    'orderId':BURST_ORDER_ID+self.random.randint(0, BURST_ORDER_ID),
+                    'clientOrderId':'burst{0}'.format(index),
+                    'side':self.random.choice(['BUY', 'SELL']),
+                    'type':'LIMIT',
+                    'timeInForce':'GTC',
+                    'price':market.price,
+                    'stopPrice':0.0,
+                    'origQty':1.0,
+                    'executedQty':0.0,
+                    'cummulativeQuoteQty':0.0,
+                    'status':'NEW'}
+                events.append(self._execution_report(order, 'NEW'))
+                order['status'] = 'CANCELED'
+                events.append(self._execution_report(order, 'CANCELED'))
+            self.stats['bursts'] += 1
+
+        self._publish_user(events)
+
+
+    ## Orders.
+    def _execution_report(self, order, execution_type, last_qty=0.0, last_price=0.0):
+        now_ms = int(time.time()*1000)
+        return({
+            'e':'executionReport',
+            'E':now_ms,
+            's':order['symbol'],
+            'c':order['clientOrderId'],
+            'S':order['side'],
+            'o':order['type'],
+            'f':order['timeInForce'],
+            'q':format_number(order['origQty']),
+            'p':format_number(order['price']),
+            'P':format_number(order['stopPrice']),
+            'F':'0.00000000',
+            'g':-1,
+            'C':'',
+            'x':execution_type,
+            'X':order['status'],
+            'r':'NONE',
+            'i':order['orderId'],
+            'l':format_number(last_qty),
+            'z':format_number(order['executedQty']),
+            'L':format_number(last_price),
+            'n':'0',
+            'N':None,
+            'T':now_ms,
+            't':-1,
+            'w':order['status'] == 'NEW',
+            'm':False,
+            'M':False,
+            'O':now_ms,
+            'Z':format_number(order['cummulativeQuoteQty']),
+            'Y':format_number(last_qty*last_price),
+            'Q':'0.00000000'})
+
+
+    def _account_event(self, assets):
+        return({
+            'e':'outboundAccountPosition',
+            'E':int(time.time()*1000),
+            'u':int(time.time()*1000),
+            'B':[{'a':asset, 'f':format_number(self.balances.get(asset, [0.0, 0.0])[0]), 'l':format_number(self.balances.get(asset, [0.0, 0.0])[1])} for asset in assets]})
+
+
+    def _fill(self, order, price):
+        ''' Fill what is left of an order at a price, returns the user data events for it. '''
+        market = self.markets[order['symbol']]
+        quantity = order['origQty']-order['executedQty']
+
+        order['executedQty'] = order['origQty']
+        order['cummulativeQuoteQty'] += quantity*price
+        order['status'] = 'FILLED'
+        self.orders.pop(order['orderId'], None)
+
+        base = self.balances.setdefault(market.base_asset, [0.0, 0.0])
+        quote = self.balances.setdefault(market.quote_asset, [0.0, 0.0])
+        if order['side'] == 'BUY':
+            base[0] += quantity
+            quote[0] -= quantity*price
+        else:
+            base[0] -= quantity
+            quote[0] += quantity*price
+
+        return([self._execution_report(order, 'TRADE', quantity, price), self._account_event([market.base_asset, market.quote_asset])])
+
+
+    def _match_orders(self, market):
+        ''' Fill the open orders of a market that the price has reached (called with the lock held). '''
+        events = []
+
+        for order in [order for order in self.orders.values() if order['symbol'] == market.symbol]:
+            if order['type'] == 'STOP_LOSS_LIMIT' and not order.get('triggered'):
+                if (order['side'] == 'SELL' and market.price <= order['stopPrice']) or (order['side'] == 'BUY' and market.price >= order['stopPrice']):
+                    order['triggered'] = True
+                else:
+                    continue
+
+            if (order['side'] == 'BUY' and market.price <= order['price']) or (order['side'] == 'SELL' and market.price >= order['price']):
+                events += self._fill(order, order['price'])
+
+        return(events)
+
+
+    def place_order(self, params):
+        ''' New order (as POST /api/v3/order), returns (status code, response). '''
+        symbol = params.get('symbol')
+        market = self.markets.get(symbol)
+        if market == None:
+            return(400, {'code':-1121, 'msg':'Invalid symbol.'})
+
+        receive_time = time.perf_counter()
+        if symbol in self.last_sent:
+            self.order_latencies.append(receive_time-self.last_sent[symbol])
+
+        order_type = params.get('type', 'LIMIT')
+        order = {
+            'symbol':symbol,
+            'orderId':next(self.order_ids),
+            'clientOrderId':params.get('newClientOrderId', 'fake{0}'.format(self.stats['orders'])),
+            'side':params.get('side', 'BUY'),
+            'type':order_type,
+            'timeInForce':params.get('timeInForce', 'GTC'),
+            'price':float(params.get('price', 0) or 0),
+            'stopPrice':float(params.get('stopPrice', 0) or 0),
+            'origQty':float(params.get('quantity', 0) or 0),
+            'executedQty':0.0,
+            'cummulativeQuoteQty':0.0,
+            'status':'NEW',
+            'transactTime':int(time.time()*1000)}
+
+        events = [self._execution_report(order, 'NEW')]
+        fills = []
+
+        with self.lock:
+            self.stats['orders'] += 1
+            if order_type == 'MARKET':
+                events += self._fill(order, market.price)
+                fills.append({'price':format_number(market.price), 'qty':format_number(order['origQty']), 'commission':'0', 'commissionAsset':market.quote_asset})
+            else:
+                self.orders.update({order['orderId']:order})
+
+        self._publish_user(events)
+        return(200, self._order_response(order, fills))
+
+
+    def _order_response(self, order, fills=None):
+        response = {
+            'symbol':order['symbol'],
+            'orderId':order['orderId'],
+            'orderListId':-1,
+            'clientOrderId':order['clientOrderId'],
+            'transactTime':int(time.time()*1000),
+            'price':format_number(order['price']),
+            'origQty':format_number(order['origQty']),
+            'executedQty':format_number(order['executedQty']),
+            'cummulativeQuoteQty':format_number(order['cummulativeQuoteQty']),
+            'status':order['status'],
+            'timeInForce':order['timeInForce'],
+            'type':order['type'],
+            'side':order['side'],
+            'stopPrice':format_number(order['stopPrice'])}
+        if fills != None:
+            response['fills'] = fills
+        return(response)
+
+
+    def cancel_order(self, params):
+        ''' Cancel an open order (as DELETE /api/v3/order), returns (status code, response). '''
+        order_id = int(params.get('orderId', 0) or params.get('cancelOrderId', 0))
+
+        with self.lock:
+            order = self.orders.pop(order_id, None)
+            if order == None:
+                return(400, {'code':-2011, 'msg':'Unknown order sent.'})
+            order['status'] = 'CANCELED'
+            self.stats['cancels'] += 1
+
+        self._publish_user([self._execution_report(order, 'CANCELED')])
+        return(200, self._order_response(order))
+
+
+    def cancel_replace(self, params):
+        status, cancel_response = self.cancel_order({'orderId':params.get('cancelOrderId')})
+        if status != 200:
+            return(400, {'code':-2022, 'msg':'Order cancel-replace failed.', 'data':{
+                'cancelResult':'FAILURE', 'newOrderResult':'NOT_ATTEMPTED', 'cancelResponse':cancel_response, 'newOrderResponse':None}})
+
+        params = dict((name, value) for name, value in params.items() if not name in ['cancelOrderId', 'cancelReplaceMode'])
+        status, new_response = self.place_order(params)
+        return(status, {'cancelResult':'SUCCESS', 'newOrderResult':'SUCCESS' if status == 200 else 'FAILURE', 'cancelResponse':cancel_response, 'newOrderResponse':new_response})
+
+
+    ## REST.
+    def exchange_info(self):
+        symbols = []
+        for market in self.markets.values():
+            symbols.append({
+                'symbol':market.symbol,
+                'status':'TRADING',
+                'baseAsset':market.base_asset,
+                'baseAssetPrecision':8,
+                'quoteAsset':market.quote_asset,
+                'quotePrecision':8,
+                'orderTypes':['LIMIT', 'MARKET', 'STOP_LOSS_LIMIT'],
+                'isSpotTradingAllowed':True,
+                'isMarginTradingAllowed':True,
+                'filters':[
+                    {'filterType':'PRICE_FILTER', 'minPrice':format_number(TICK_SIZE), 'maxPrice':'1000.00000000', 'tickSize':format_number(TICK_SIZE)},
+                    {'filterType':'PERCENT_PRICE', 'multiplierUp':'5', 'multiplierDown':'0.2', 'avgPriceMins':5},
+                    {'filterType':'LOT_SIZE', 'minQty':format_number(MIN_QTY), 'maxQty':'900000.00000000', 'stepSize':format_number(MIN_QTY)},
+                    {'filterType':'MIN_NOTIONAL', 'minNotional':format_number(MIN_NOTIONAL), 'applyToMarket':True, 'avgPriceMins':5}]})
+
+        return({'timezone':'UTC', 'serverTime':int(time.time()*1000), 'rateLimits':RATE_LIMITS, 'exchangeFilters':[], 'symbols':symbols})
+
+
+    def account(self, margin=False):
+        with self.lock:
+            balances = dict((asset, list(wallet)) for asset, wallet in self.balances.items())
+
+        if margin:
+            return({'borrowEnabled':True, 'tradeEnabled':True, 'transferEnabled':True, 'marginLevel':'999.00000000', 'userAssets':[{
+                'asset':asset,
+                'free':format_number(free),
+                'locked':format_number(locked),
+                'borrowed':format_number(self.loans.get(asset, 0.0)),
+                'interest':'0.00000000',
+                'netAsset':format_number(free+locked-self.loans.get(asset, 0.0))} for asset, (free, locked) in balances.items()]})
+
+        return({'makerCommission':10, 'takerCommission':10, 'canTrade':True, 'canWithdraw':True, 'canDeposit':True, 'accountType':'SPOT', 'balances':[
+            {'asset':asset, 'free':format_number(free), 'locked':format_number(locked)} for asset, (free, locked) in balances.items()]})
+
+
+    def loan(self, params, repay=False):
+        asset = params.get('asset')
+        amount = float(params.get('amount', 0))
+        direction = -1 if repay else 1
+
+        with self.lock:
+            self.balances.setdefault(asset, [0.0, 0.0])[0] += direction*amount
+            self.loans[asset] = max(self.loans.get(asset, 0.0)+(direction*amount), 0.0)
+
+        self._publish_user([self._account_event([asset])], kind='account')
+        return(200, {'tranId':next(self.tran_ids)})
+
+
+    def handle_rest(self, method, path, params):
+        ''' Route a REST request, returns (status code, json response). '''
+        self.stats['rest_requests'] += 1
+
+        if path in ['/api/v3/ping', '/sapi/v1/system/status']:
+            return(200, {})
+        elif path == '/api/v3/time':
+            return(200, {'serverTime':int(time.time()*1000)})
+        elif path == '/api/v3/exchangeInfo':
+            return(200, self.exchange_info())
+
+        elif path in ['/api/v3/klines', '/api/v3/depth']:
+            market = self.markets.get(params.get('symbol'))
+            if market == None:
+                return(400, {'code':-1121, 'msg':'Invalid symbol.'})
+            with self.lock:
+                if path == '/api/v3/klines':
+                    end_time = int(params['endTime']) if 'endTime' in params else None
+                    return(200, market.klines(min(int(params.get('limit', 500)), 1000), end_time))
+                return(200, market.depth_snapshot(int(params.get('limit', 100))))
+
+        elif path in ['/api/v3/account', '/sapi/v1/margin/account']:
+            return(200, self.account(margin=path.startswith('/sapi')))
+
+        elif path in ['/api/v3/order', '/sapi/v1/margin/order']:
+            if method == 'POST':
+                return(self.place_order(params))
+            elif method == 'DELETE':
+                return(self.cancel_order(params))
+            order = self.orders.get(int(params.get('orderId', 0)))
+            if order == None:
+                return(400, {'code':-2013, 'msg':'Order does not exist.'})
+            return(200, self._order_response(order))
+
+        elif path == '/api/v3/order/cancelReplace':
+            return(self.cancel_replace(params))
+
+        elif path in ['/api/v3/openOrders', '/sapi/v1/margin/openOrders']:
+            symbol = params.get('symbol')
+            return(200, [self._order_response(order) for order in list(self.orders.values()) if symbol == None or order['symbol'] == symbol])
+
+        elif path in ['/sapi/v1/margin/loan', '/sapi/v1/margin/repay']:
+            return(self.loan(params, repay=path.endswith('repay')))
+
+        elif path in ['/api/v3/userDataStream', '/sapi/v1/userDataStream']:
+            if method == 'POST':
+                listen_key = 'fakeListenKey{0}'.format(len(self.listen_keys))
+                self.listen_keys.add(listen_key)
+                return(200, {'listenKey':listen_key})
+            return(200, {})
+
+        elif path == '/fake/stats':
+            return(200, self.get_stats())
+        elif path == '/fake/reset':
+            self.reset_stats()
+            return(200, {})
+        elif path == '/fake/disconnect':
+            self.disconnect_all()
+            return(200, {})
+
+        return(404, {'code':-1000, 'msg':'Unknown endpoint {0} {1}.'.format(method, path)})
+
+
+class RestHandler(BaseHTTPRequestHandler):
+    ''' Keep-alive JSON request handler for the fake exchange REST endpoints. '''
+    protocol_version = 'HTTP/1.1'
+
+    def _handle(self):
+        parsed = urlparse(self.path)
+        params = dict(parse_qsl(parsed.query))
+
+        length = int(self.headers.get('Content-Length', 0) or 0)
+        if length:
+            params.update(dict(parse_qsl(self.rfile.read(length).decode('utf-8'))))
+
+        exchange = self.server.exchange
+        status, response = exchange.handle_rest(self.command, parsed.path, params)
+        body = json.dumps(response).encode('utf-8')
+
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('X-MBX-USED-WEIGHT-1M', '1')
+        self.send_header('X-MBX-ORDER-COUNT-10S', '0')
+        self.end_headers()
+        self.wfile.write(body)
+
+    do_GET = do_POST = do_PUT = do_DELETE = _handle
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(scenario):
+    ''' Run a fake exchange until interrupted, the first line printed is 'READY <rest url> <websocket url>'. '''
+    exchange = FakeExchange(scenario)
+    exchange.start()
+    print('READY {0} {1}'.format(exchange.rest_url, exchange.socket_url), flush=True)
+
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        exchange.stop()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(format='%(asctime)s:%(name)s:%(message)s', level=logging.INFO)
+    serve(load_scenario(sys.argv[1] if len(sys.argv) > 1 else None))
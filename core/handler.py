@@ -96,6 +96,51 @@ def settings_reader():
                     default_depth_range = 50
                     data = default_depth_range if data == '' else int(data)
 
+                elif key == 'NOTIFY_UPDATES':
+                    data = False if data.upper() == 'FALSE' else True
+
+                elif key == 'ARCHIVE_CANDLES':
+                    data = True if data.upper() == 'TRUE' else False
+
+                elif key == 'CHECKPOINT_CANDLES':
+                    data = False if data.upper() == 'FALSE' else True
+
+                elif key == 'RUNTIME_MODE':
+                    data = 'THREAD' if data == '' else data.upper()
+
+                elif key == 'SCHEDULER_WORKERS':
+                    default_workers = 4
+                    data = default_workers if data == '' else int(data)
+
+                elif key == 'UI_PUSH_INTERVAL':
+                    default_interval = 0.25
+                    data = default_interval if data == '' else float(data)
+
+                elif key == 'MAX_TRADE_HISTORY':
+                    default_history = 100
+                    data = default_history if data == '' else int(data)
+
+                elif key == 'LOCAL_ORDER_BOOKS':
+                    data = True if data.upper() == 'TRUE' else False
+
+                elif key == 'DEPTH_UPDATE_SPEED':
+                    data = '100ms' if data == '' else data
+
+                elif key == 'PAPER_MATCHING':
+                    data = False if data.upper() == 'FALSE' else True
+
+                elif key == 'PAPER_LATENCY':
+                    data = 100 if data == '' else float(data)
+
+                elif key == 'ORDER_GATEWAY':
+                    data = True if data.upper() == 'TRUE' else False
+
+                elif key == 'STAGE_METRICS':
+                    data = False if data.upper() == 'FALSE' else True
+
+                elif key == 'REST_URL' or key == 'SOCKET_URL':
+                    data = None if data == '' else data
+
                 settings_file_data.update({key.lower():data})
 
     return(settings_file_data)
\ No newline at end of file
@@ -0,0 +1,430 @@
+#! /usr/bin/env python3
+
+'''
+indicator_engine
+
+'''
+import logging
+from collections import deque
+from collections.abc import Sequence
+
+
+class StreamSMA(object):
+    ''' Simple moving average kept as a running window. '''
+
+    def __init__(self, period=50):
+        self.period = period
+        self.window = deque()
+        self.total = 0.0
+
+
+    def commit(self, candle):
+        price = float(candle[4])
+        self.window.append(price)
+        self.total += price
+
+        if len(self.window) > self.period:
+            self.total -= self.window.popleft()
+
+        if len(self.window) < self.period:
+            return(None)
+
+        return(self.total/self.period)
+
+
+    def peek(self, candle):
+        if len(self.window)+1 < self.period:
+            return(None)
+
+        total = self.total+float(candle[4])
+        if len(self.window) == self.period:
+            total -= self.window[0]
+
+        return(total/self.period)
+
+
+class StreamEMA(object):
+    ''' Exponential moving average seeded with the SMA of the first period values. '''
+
+    def __init__(self, period=14):
+        self.period = period
+        self.weight = 2/(period+1)
+        self.seed = []
+        self.value = None
+
+
+    def commit_value(self, price):
+        if self.value != None:
+            self.value = self.value+self.weight*(price-self.value)
+            return(self.value)
+
+        self.seed.append(price)
+        if len(self.seed) == self.period:
+            self.value = sum(self.seed)/self.period
+            self.seed = []
+        return(self.value)
+
+
+    def peek_value(self, price):
+        if self.value != None:
+            return(self.value+self.weight*(price-self.value))
+
+        if len(self.seed)+1 == self.period:
+            return((sum(self.seed)+price)/self.period)
+        return(None)
+
+
+    def commit(self, candle):
+        return(self.commit_value(float(candle[4])))
+
+
+    def peek(self, candle):
+        return(self.peek_value(float(candle[4])))
+
+
+class StreamMACD(object):
+    ''' MACD line, signal line and histogram built from three running EMAs. '''
+
+    def __init__(self, fast=12, slow=26, signal=9):
+        self.fast = StreamEMA(fast)
+        self.slow = StreamEMA(slow)
+        self.signal = StreamEMA(signal)
+
+
+    def commit(self, candle):
+        price = float(candle[4])
+        fast = self.fast.commit_value(price)
+        slow = self.slow.commit_value(price)
+
+        if slow == None:
+            return(None)
+
+        macd = fast-slow
+        signal = self.signal.commit_value(macd)
+
+        if signal == None:
+            return(None)
+        return({'macd':macd, 'signal':signal, 'hist':macd-signal})
+
+
+    def peek(self, candle):
+        price = float(candle[4])
+        fast = self.fast.peek_value(price)
+        slow = self.slow.peek_value(price)
+
+        if slow == None:
+            return(None)
+
+        macd = fast-slow
+        signal = self.signal.peek_value(macd)
+
+        if signal == None:
+            return(None)
+        return({'macd':macd, 'signal':signal, 'hist':macd-signal})
+
+
+class StreamMFI(object):
+    ''' Money flow index over a running window of positive/negative money flow. '''
+
+    def __init__(self, period=14):
+        self.period = period
+        self.last_typical = None
+        self.positive = deque(maxlen=period)
+        self.negative = deque(maxlen=period)
+
+
+    def _flows(self, candle):
+        typical = (float(candle[2])+float(candle[3])+float(candle[4]))/3
+        flow = typical*float(candle[5])
+
+        if self.last_typical == None:
+            return(typical, None, None)
+
+        if typical > self.last_typical:
+            return(typical, flow, 0.0)
+        elif typical < self.last_typical:
+            return(typical, 0.0, flow)
+        return(typical, 0.0, 0.0)
+
+
+    def _mfi(self, positive, negative):
+        if negative == 0:
+            return(100.0)
+        return(100-(100/(1+(positive/negative))))
+
+
+    def commit(self, candle):
+        typical, positive, negative = self._flows(candle)
+        self.last_typical = typical
+
+        if positive == None:
+            return(None)
+
+        self.positive.append(positive)
+        self.negative.append(negative)
+
+        if len(self.positive) < self.period:
+            return(None)
+        return(self._mfi(sum(self.positive), sum(self.negative)))
+
+
+    def peek(self, candle):
+        typical, positive, negative = self._flows(candle)
+
+        if positive == None or len(self.positive)+1 < self.period:
+            return(None)
+
+        drop = 1 if len(self.positive) == self.period else 0
+        return(self._mfi(
+            sum(list(self.positive)[drop:])+positive,
+            sum(list(self.negative)[drop:])+negative))
+
+
+class StreamADX(object):
+    ''' Wilder smoothed ADX with the +DI/-DI lines. '''
+
+    def __init__(self, period=14):
+        self.period = period
+        self.last_candle = None
+        self.count = 0
+        self.tr = 0.0
+        self.plus_dm = 0.0
+        self.minus_dm = 0.0
+        self.dx_seed = []
+        self.adx = None
+
+
+    def _movement(self, candle):
+        high, low = float(candle[2]), float(candle[3])
+        last_high, last_low, last_close = self.last_candle
+
+        up_move = high-last_high
+        down_move = last_low-low
+
+        tr = max(high-low, abs(high-last_close), abs(low-last_close))
+        plus_dm = up_move if (up_move > down_move and up_move > 0) else 0.0
+        minus_dm = down_move if (down_move > up_move and down_move > 0) else 0.0
+        return(tr, plus_dm, minus_dm)
+
+
+    def _smooth(self, count, tr, plus_dm, minus_dm):
+        ''' Returns the smoothed values after adding a movement (count is the number of movements before it). '''
+        if count < self.period:
+            return(self.tr+tr, self.plus_dm+plus_dm, self.minus_dm+minus_dm)
+
+        return(
+            self.tr-(self.tr/self.period)+tr,
+            self.plus_dm-(self.plus_dm/self.period)+plus_dm,
+            self.minus_dm-(self.minus_dm/self.period)+minus_dm)
+
+
+    def _lines(self, tr, plus_dm, minus_dm):
+        plus_di = (100*plus_dm/tr) if tr else 0.0
+        minus_di = (100*minus_dm/tr) if tr else 0.0
+        di_total = plus_di+minus_di
+        dx = (100*abs(plus_di-minus_di)/di_total) if di_total else 0.0
+        return(plus_di, minus_di, dx)
+
+
+    def _adx(self, dx, dx_seed, adx):
+        if adx != None:
+            return(((adx*(self.period-1))+dx)/self.period)
+        if len(dx_seed)+1 == self.period:
+            return((sum(dx_seed)+dx)/self.period)
+        return(None)
+
+
+    def commit(self, candle):
+        if self.last_candle == None:
+            self.last_candle = (float(candle[2]), float(candle[3]), float(candle[4]))
+            return(None)
+
+        movement = self._movement(candle)
+        self.tr, self.plus_dm, self.minus_dm = self._smooth(self.count, *movement)
+        self.last_candle = (float(candle[2]), float(candle[3]), float(candle[4]))
+        self.count += 1
+
+        if self.count < self.period:
+            return(None)
+
+        plus_di, minus_di, dx = self._lines(self.tr, self.plus_dm, self.minus_dm)
+        adx = self._adx(dx, self.dx_seed, self.adx)
+
+        if adx == None:
+            self.dx_seed.append(dx)
+            return(None)
+
+        self.adx = adx
+        self.dx_seed = []
+        return({'ADX':adx, '+DI':plus_di, '-DI':minus_di})
+
+
+    def peek(self, candle):
+        if self.last_candle == None or self.count+1 < self.period:
+            return(None)
+
+        smoothed = self._smooth(self.count, *self._movement(candle))
+        plus_di, minus_di, dx = self._lines(*smoothed)
+        adx = self._adx(dx, self.dx_seed, self.adx)
+
+        if adx == None:
+            return(None)
+        return({'ADX':adx, '+DI':plus_di, '-DI':minus_di})
+
+
+## Indicators that can be streamed by the engine.
+STREAM_TYPES = {
+    'SMA':StreamSMA,
+    'EMA':StreamEMA,
+    'MACD':StreamMACD,
+    'MFI':StreamMFI,
+    'ADX':StreamADX
+}
+
+
+class NewestFirst(Sequence):
+
+    def __init__(self, values):
+        '''
+        Newest first read only view of an oldest first deque (index 0 is the newest value).
+        Values are appended to the deque so updates are O(1), reads only look up the items asked for.
+        '''
+        self.values = values
+
+
+    def __len__(self):
+        return(len(self.values))
+
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return([self.values[-1-position] for position in range(*index.indices(len(self.values)))])
+
+        if index < 0:
+            index += len(self.values)
+        if not 0 <= index < len(self.values):
+            raise IndexError('indicator index out of range')
+        return(self.values[-1-index])
+
+
+    def __iter__(self):
+        return(reversed(self.values))
+
+
+    def tolist(self):
+        return(list(reversed(self.values)))
+
+
+class IndicatorEngine(object):
+
+    def __init__(self, indicator_setup):
+        '''
+        Keeps running indicator state for one market so that each pass only costs O(1).
+
+        indicator_setup maps the output name to [indicator type, params] e.g. {'MA_50':['SMA', {'period':50}]}.
+        Outputs are newest first sequences (index 0 is the in progress candle) so they can be used in the same
+        way as the lists returned by technical_indicators, each is kept oldest first in a deque and read
+        through a NewestFirst view.
+        '''
+        self.indicator_setup = indicator_setup
+
+        self.streams = {}
+        self.series = {}
+        self.indicators = {}
+        self.live_slots = {}
+
+        ## Open time of the newest (in progress) candle that has been seen.
+        self.last_time = None
+        self.max_length = 0
+
+
+    def _reset(self):
+        self.streams = {}
+        self.series = {}
+        self.indicators = {}
+        self.live_slots = {}
+
+        for name, (indicator_type, params) in self.indicator_setup.items():
+            self.streams.update({name:STREAM_TYPES[indicator_type](**params)})
+            self.series.update({name:deque(maxlen=self.max_length or None)})
+            self.indicators.update({name:NewestFirst(self.series[name])})
+            self.live_slots.update({name:False})
+
+
+    def rebuild(self, candles):
+        ''' Rebuild the full state from a newest first list of candles. '''
+        logging.debug('[IndicatorEngine] Rebuilding indicator state from {0} candles.'.format(len(candles)))
+        self.max_length = len(candles)
+        self._reset()
+
+        for index in range(len(candles)-1, 0, -1):
+            self._close_candle(candles[index])
+
+        self._patch_candle(candles[0])
+        self.last_time = candles[0][0]
+        return(self.indicators)
+
+
+    def update(self, candles):
+        '''
+        Update the indicators from a newest first list of candles.
+
+        -> Same open time as the last pass.
+            Only the in progress candle changed so its values are patched.
+
+        -> Newer open time.
+            Any candles that have closed since the last pass are committed then the new candle is patched.
+        '''
+        if not len(candles):
+            return(self.indicators)
+
+        newest_time = candles[0][0]
+
+        if self.last_time == None or newest_time < self.last_time:
+            return(self.rebuild(candles))
+
+        if newest_time != self.last_time:
+            ## Find the candle that was in progress last pass, it and all after it have now closed.
+            closed = None
+            for index in range(1, len(candles)):
+                if candles[index][0] == self.last_time:
+                    closed = index
+                    break
+
+            if closed == None:
+                return(self.rebuild(candles))
+
+            for index in range(closed, 0, -1):
+                self._close_candle(candles[index])
+
+            self.last_time = newest_time
+
+        self._patch_candle(candles[0])
+        return(self.indicators)
+
+
+    def _close_candle(self, candle):
+        for name, stream in self.streams.items():
+            value = stream.commit(candle)
+            values = self.series[name]
+
+            if self.live_slots[name]:
+                values[-1] = value
+                self.live_slots[name] = False
+            elif value != None:
+                values.append(value)
+
+
+    def _patch_candle(self, candle):
+        for name, stream in self.streams.items():
+            value = stream.peek(candle)
+            values = self.series[name]
+
+            if value == None:
+                continue
+
+            if self.live_slots[name]:
+                values[-1] = value
+            else:
+                values.append(value)
+                self.live_slots[name] = True
@@ -0,0 +1,7 @@
+'''
+indicators
+
+NumPy vectorised indicator kernels, these use the same names and newest first output
+format as the technical_indicators module so they can be used in its place.
+'''
+from .kernels import get_SMA, get_EMA, get_MACD, get_MFI, get_ADX_DI, get_RSI, get_BOLL, linear_filter
@@ -0,0 +1,101 @@
+#! /usr/bin/env python3
+
+'''
+bench
+
+Compare the vectorised kernels with the technical_indicators module.
+Usage: python3 -m core.indicators.bench [candle counts...]
+'''
+import sys
+import time
+import numpy as np
+
+from . import kernels
+
+try:
+    import technical_indicators as TI
+except ImportError:
+    TI = None
+
+
+## Default candle counts to benchmark.
+BENCH_SIZES = [500, 5000, 50000]
+
+
+def make_candles(count, seed=1):
+    ''' Seeded random walk candles in the newest first socket format. '''
+    random = np.random.default_rng(seed)
+    close = 0.02*np.exp(np.cumsum(random.normal(0, 0.01, count)))
+    open_ = np.concatenate(([close[0]], close[:-1]))
+    high = np.maximum(open_, close)*(1+random.uniform(0, 0.005, count))
+    low = np.minimum(open_, close)*(1-random.uniform(0, 0.005, count))
+    volume = random.uniform(1, 100, count)
+    open_time = 1600000000000.0+(np.arange(count)*60000.0)
+
+    return(np.column_stack([open_time, open_, high, low, close, volume])[::-1].tolist())
+
+
+def time_call(function, *args, repeats=5):
+    ''' Best of a few runs in milliseconds (the first run is a warm up). '''
+    function(*args)
+    best = None
+
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function(*args)
+        taken = (time.perf_counter()-start)*1000
+        best = taken if best == None else min(best, taken)
+
+    return(best)
+
+
+def run(sizes=BENCH_SIZES):
+    results = []
+
+    for size in sizes:
+        candles = make_candles(size)
+        close_prices = [candle[4] for candle in candles]
+        repeats = 5 if size <= 5000 else 2
+
+        cases = [
+            ['SMA_50', kernels.get_SMA, (close_prices, 50), 'get_SMA', (close_prices, 50)],
+            ['EMA_20', kernels.get_EMA, (close_prices, 20), 'get_EMA', (close_prices, 20)],
+            ['MACD', kernels.get_MACD, (close_prices,), 'get_MACD', (close_prices,)],
+            ['MFI', kernels.get_MFI, (candles,), 'get_MFI', (candles,)],
+            ['ADX_DI', kernels.get_ADX_DI, (candles,), 'get_ADX_DI', (candles,)],
+            ['RSI', kernels.get_RSI, (close_prices,), 'get_RSI', (close_prices,)],
+            ['BOLL', kernels.get_BOLL, (close_prices,), 'get_BOLL', (close_prices,)]]
+
+        for name, kernel, kernel_args, ti_name, ti_args in cases:
+            kernel_time = time_call(kernel, *kernel_args, repeats=repeats)
+            raw_time = time_call(lambda *args: kernel(*args, raw=True), *kernel_args, repeats=repeats)
+
+            ti_time = None
+            if TI and hasattr(TI, ti_name):
+                ti_time = time_call(getattr(TI, ti_name), *ti_args, repeats=1 if size > 5000 else repeats)
+
+            results.append({'indicator':name, 'candles':size, 'kernel_ms':kernel_time, 'raw_ms':raw_time, 'technical_indicators_ms':ti_time})
+
+    return(results)
+
+
+def print_results(results):
+    print('{0:<8} {1:>8} {2:>12} {3:>12} {4:>12} {5:>9}'.format('name', 'candles', 'kernel ms', 'raw ms', 'TI ms', 'speedup'))
+
+    for result in results:
+        ti_time = result['technical_indicators_ms']
+        print('{0:<8} {1:>8} {2:>12.3f} {3:>12.3f} {4:>12} {5:>9}'.format(
+            result['indicator'],
+            result['candles'],
+            result['kernel_ms'],
+            result['raw_ms'],
+            '{0:.3f}'.format(ti_time) if ti_time != None else '-',
+            '{0:.1f}x'.format(ti_time/result['kernel_ms']) if ti_time != None else '-'))
+
+    if TI == None:
+        print('technical_indicators module not found, only the kernels were timed.')
+
+
+if __name__ == '__main__':
+    sizes = [int(size) for size in sys.argv[1:]] if len(sys.argv) > 1 else BENCH_SIZES
+    print_results(run(sizes))
@@ -0,0 +1,226 @@
+#! /usr/bin/env python3
+
+'''
+kernels
+
+All kernels take newest first prices/candles (the same ordering as the socket and candle store)
+and return newest first results. With raw=True NumPy arrays are returned, otherwise the results
+are built into the list/list of dicts format used by trader_configuration.py.
+'''
+import numpy as np
+
+
+## Largest growth allowed inside one block of the linear filter before rescaling.
+MAX_FILTER_GROWTH = 1e150
+
+
+def _oldest_first(values):
+    ''' Turn newest first input into an oldest first float array (a view when given a float array). '''
+    return(np.asarray(values, dtype=np.float64)[::-1])
+
+
+def _newest_first(values):
+    return(values[::-1])
+
+
+def _to_list(values):
+    return(_newest_first(values).tolist())
+
+
+def _to_dict_list(keys, columns):
+    ''' Zip newest first columns into a list of dicts, i.e. [{'macd':.., 'signal':.., 'hist':..}, ...]. '''
+    columns = [_newest_first(column).tolist() for column in columns]
+    return([dict(zip(keys, row)) for row in zip(*columns)])
+
+
+def linear_filter(values, decay, gain, initial):
+    '''
+    Vectorised form of the recurrence y[t] = decay*y[t-1] + gain*x[t] with y[-1] = initial.
+
+    Inside a block y[t] = decay^t * (initial + gain*sum(x[k]*decay^-k)), which is a cumulative sum.
+    Blocks are kept short enough that decay^-t does not overflow and each block starts from the last value of the previous one.
+    '''
+    values = np.asarray(values, dtype=np.float64)
+    result = np.empty(len(values), dtype=np.float64)
+
+    if decay == 0:
+        result[:] = gain*values
+        return(result)
+
+    block_size = max(1, min(len(values), int(np.log(MAX_FILTER_GROWTH)/-np.log(decay))))
+    powers = decay**np.arange(1, block_size+1)
+    inverse_powers = 1/powers
+
+    last = initial
+    for start in range(0, len(values), block_size):
+        block = values[start:start+block_size]
+        size = len(block)
+        sums = np.cumsum(block*inverse_powers[:size])
+        result[start:start+size] = powers[:size]*(last+gain*sums)
+        last = result[start+size-1]
+
+    return(result)
+
+
+def _sma(prices, period):
+    ''' Oldest first SMA (length n-period+1). '''
+    if len(prices) < period:
+        return(np.empty(0))
+
+    sums = np.cumsum(np.concatenate(([0.0], prices)))
+    return((sums[period:]-sums[:-period])/period)
+
+
+def _ema(prices, period):
+    ''' Oldest first EMA seeded with the SMA of the first period values (length n-period+1). '''
+    if len(prices) < period:
+        return(np.empty(0))
+
+    weight = 2/(period+1)
+    seed = prices[:period].mean()
+    tail = linear_filter(prices[period:], 1-weight, weight, seed)
+    return(np.concatenate(([seed], tail)))
+
+
+def _wilder(values, period):
+    ''' Oldest first Wilder average seeded with the mean of the first period values. '''
+    if len(values) < period:
+        return(np.empty(0))
+
+    seed = values[:period].mean()
+    tail = linear_filter(values[period:], (period-1)/period, 1/period, seed)
+    return(np.concatenate(([seed], tail)))
+
+
+def get_SMA(prices, period, raw=False):
+    values = _sma(_oldest_first(prices), period)
+    return(_newest_first(values) if raw else _to_list(values))
+
+
+def get_EMA(prices, period, raw=False):
+    values = _ema(_oldest_first(prices), period)
+    return(_newest_first(values) if raw else _to_list(values))
+
+
+def get_MACD(prices, fast=12, slow=26, signal=9, raw=False):
+    '''
+    MACD line (fast EMA - slow EMA), signal line (EMA of the MACD line) and histogram.
+    Returns [{'macd':.., 'signal':.., 'hist':..}, ...] or a dict of arrays when raw.
+    '''
+    prices = _oldest_first(prices)
+    slow_ema = _ema(prices, slow)
+    fast_ema = _ema(prices, fast)[slow-fast:] if len(slow_ema) else np.empty(0)
+
+    macd_line = fast_ema-slow_ema
+    signal_line = _ema(macd_line, signal)
+    macd_line = macd_line[len(macd_line)-len(signal_line):]
+    hist = macd_line-signal_line
+
+    if raw:
+        return({'macd':_newest_first(macd_line), 'signal':_newest_first(signal_line), 'hist':_newest_first(hist)})
+    return(_to_dict_list(['macd', 'signal', 'hist'], [macd_line, signal_line, hist]))
+
+
+def get_MFI(candles, period=14, raw=False):
+    ''' Money flow index from the candles typical price and volume. '''
+    candles = _oldest_first(candles)
+
+    if len(candles) <= period:
+        return(np.empty(0) if raw else [])
+
+    typical = (candles[:, 2]+candles[:, 3]+candles[:, 4])/3
+    flow = (typical*candles[:, 5])[1:]
+    change = np.diff(typical)
+
+    positive = np.cumsum(np.concatenate(([0.0], np.where(change > 0, flow, 0.0))))
+    negative = np.cumsum(np.concatenate(([0.0], np.where(change < 0, flow, 0.0))))
+
+    positive = positive[period:]-positive[:-period]
+    negative = negative[period:]-negative[:-period]
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        values = np.where(negative == 0, 100.0, 100-(100/(1+(positive/negative))))
+
+    return(_newest_first(values) if raw else _to_list(values))
+
+
+def get_ADX_DI(candles, period=14, raw=False):
+    '''
+    Wilder ADX with the +DI and -DI lines.
+    Returns [{'ADX':.., '+DI':.., '-DI':..}, ...] or a dict of arrays when raw.
+    '''
+    candles = _oldest_first(candles)
+    keys = ['ADX', '+DI', '-DI']
+
+    if len(candles) < (period*2):
+        return({key:np.empty(0) for key in keys} if raw else [])
+
+    high, low, close = candles[:, 2], candles[:, 3], candles[:, 4]
+
+    up_move = high[1:]-high[:-1]
+    down_move = low[:-1]-low[1:]
+
+    true_range = np.maximum.reduce([high[1:]-low[1:], np.abs(high[1:]-close[:-1]), np.abs(low[1:]-close[:-1])])
+    plus_dm = np.where((up_move > down_move) & (up_move > 0), up_move, 0.0)
+    minus_dm = np.where((down_move > up_move) & (down_move > 0), down_move, 0.0)
+
+    ## Wilder sums (first value is the plain sum of the first period movements).
+    decay = (period-1)/period
+    smoothed = []
+    for movement in [true_range, plus_dm, minus_dm]:
+        seed = movement[:period].sum()
+        smoothed.append(np.concatenate(([seed], linear_filter(movement[period:], decay, 1, seed))))
+    true_range, plus_dm, minus_dm = smoothed
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        plus_di = np.where(true_range != 0, 100*plus_dm/true_range, 0.0)
+        minus_di = np.where(true_range != 0, 100*minus_dm/true_range, 0.0)
+        di_total = plus_di+minus_di
+        dx = np.where(di_total != 0, 100*np.abs(plus_di-minus_di)/di_total, 0.0)
+
+    adx = _wilder(dx, period)
+    plus_di = plus_di[period-1:]
+    minus_di = minus_di[period-1:]
+
+    if raw:
+        return({'ADX':_newest_first(adx), '+DI':_newest_first(plus_di), '-DI':_newest_first(minus_di)})
+    return(_to_dict_list(keys, [adx, plus_di, minus_di]))
+
+
+def get_RSI(prices, period=14, raw=False):
+    ''' Wilder RSI. '''
+    prices = _oldest_first(prices)
+
+    if len(prices) <= period:
+        return(np.empty(0) if raw else [])
+
+    change = np.diff(prices)
+    gains = _wilder(np.where(change > 0, change, 0.0), period)
+    losses = _wilder(np.where(change < 0, -change, 0.0), period)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        values = np.where(losses == 0, 100.0, 100-(100/(1+(gains/losses))))
+
+    return(_newest_first(values) if raw else _to_list(values))
+
+
+def get_BOLL(prices, period=20, deviations=2, raw=False):
+    '''
+    Bollinger bands using the population standard deviation.
+    Returns [{'T':upper, 'M':middle, 'B':lower}, ...] or a dict of arrays when raw.
+    '''
+    prices = _oldest_first(prices)
+    keys = ['T', 'M', 'B']
+
+    if len(prices) < period:
+        return({key:np.empty(0) for key in keys} if raw else [])
+
+    windows = np.lib.stride_tricks.sliding_window_view(prices, period)
+    middle = windows.mean(axis=1)
+    spread = windows.std(axis=1)*deviations
+    upper = middle+spread
+    lower = middle-spread
+
+    if raw:
+        return({'T':_newest_first(upper), 'M':_newest_first(middle), 'B':_newest_first(lower)})
+    return(_to_dict_list(keys, [upper, middle, lower]))
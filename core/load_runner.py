@@ -0,0 +1,255 @@
+#! /usr/bin/env python3
+
+'''
+load_runner
+
+Run BotCore against the fake exchange and report latency percentiles, CPU and memory.
+Usage: python3 -m core.load_runner [scenario json file] [results file]
+'''
+import os
+import sys
+import json
+import time
+import logging
+import tempfile
+import threading
+import subprocess
+import requests
+
+from . import handler
+from . import botCore
+from . import fake_exchange
+
+
+## Load test settings added to the fake exchange scenario (seconds), markets can also be a list of counts to ramp through.
+DEFAULT_LOAD_TEST = {
+    'run_type':'REAL',
+    'warmup':15,
+    'duration':60,
+    'sample_interval':1.0}
+
+## Trader stages reported from the bots own stage timers.
+REPORT_STAGES = ['tick_to_order', 'order_request', 'iteration', 'indicators']
+
+## Seconds to wait for the fake exchange process to start.
+EXCHANGE_START_TIMEOUT = 30
+
+
+def load_scenario(file_path=None):
+    ''' The fake exchange scenario (with the load test settings) updated with a json scenario file. '''
+    scenario = dict(DEFAULT_LOAD_TEST)
+    scenario.update(fake_exchange.load_scenario(file_path))
+    return(scenario)
+
+
+class ResourceSampler(object):
+
+    def __init__(self, interval=1.0):
+        ''' Samples the CPU use (all threads of this process) and resident memory every interval seconds. '''
+        self.interval = interval
+        self.samples = []
+        self.stop_event = threading.Event()
+        self.thread = None
+
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, name='resource-sampler')
+        self.thread.daemon = True
+        self.thread.start()
+
+
+    def stop(self):
+        self.stop_event.set()
+        self.thread.join()
+
+
+    def _run(self):
+        last_times = os.times()
+        last_wall = time.monotonic()
+
+        while not self.stop_event.wait(self.interval):
+            times = os.times()
+            wall = time.monotonic()
+            cpu = ((times.user-last_times.user)+(times.system-last_times.system))/(wall-last_wall)
+            self.samples.append({'cpu_percent':cpu*100, 'rss_mb':self.rss_mb(), 'threads':threading.active_count()})
+            last_times, last_wall = times, wall
+
+
+    def rss_mb(self):
+        with open('/proc/self/statm', 'r') as file:
+            resident_pages = int(file.read().split()[1])
+        return(resident_pages*os.sysconf('SC_PAGE_SIZE')/(1024*1024))
+
+
+    def summary(self):
+        if not self.samples:
+            return({})
+        cpu = [sample['cpu_percent'] for sample in self.samples]
+        rss = [sample['rss_mb'] for sample in self.samples]
+        return({
+            'cpu_percent':{'mean':sum(cpu)/len(cpu), 'max':max(cpu)},
+            'rss_mb':{'start':rss[0], 'end':rss[-1], 'max':max(rss)},
+            'threads':max(sample['threads'] for sample in self.samples)})
+
+
+def stage_percentiles(registry, stages=REPORT_STAGES):
+    ''' Percentiles of each stage over every market, from the recent samples kept by the stage timers. '''
+    values = {stage:[] for stage in stages}
+
+    for (market, stage), stats in list(registry.stats.items()):
+        if stage in values:
+            values[stage] += stats.recent[:min(stats.index, stats.window)]
+
+    return({stage:fake_exchange.percentiles(stage_values) for stage, stage_values in values.items()})
+
+
+def start_exchange(scenario_path):
+    ''' Start the fake exchange in its own process (so its load is not counted), returns (process, rest url, websocket url). '''
+    process = subprocess.Popen([sys.executable, '-m', 'core.fake_exchange', scenario_path], stdout=subprocess.PIPE, universal_newlines=True)
+    start_time = time.time()
+
+    while time.time()-start_time < EXCHANGE_START_TIMEOUT:
+        line = process.stdout.readline()
+        if line.startswith('READY'):
+            ready, rest_url, socket_url = line.split()
+            return(process, rest_url, socket_url)
+        if line == '' and process.poll() != None:
+            break
+
+    process.kill()
+    raise RuntimeError('Fake exchange failed to start.')
+
+
+def run_load_test(scenario):
+    '''
+    Start the fake exchange and a BotCore trading every fake market against it, let it warm up then measure for
+    the scenario duration. Returns the report (exchange message/order counts and tick to order latency as seen by
+    the exchange, the bots stage percentiles, start up time and CPU/memory).
+
+    The BotCore is not stopped afterwards (open positions would block its traders stopping), run this in a
+    process that exits once the report is saved.
+    '''
+    work_dir = tempfile.mkdtemp(prefix='load_test_')
+    scenario_path = '{0}/scenario.json'.format(work_dir)
+    with open(scenario_path, 'w') as file:
+        file.write(json.dumps(scenario))
+
+    process, rest_url, socket_url = start_exchange(scenario_path)
+    try:
+        settings = handler.settings_reader()
+        settings.update({
+            'public_key':'fake',
+            'private_key':'fake',
+            'run_type':scenario['run_type'],
+            'market_type':'SPOT',
+            'trader_interval':scenario['interval'],
+            'trading_markets':['{0}-M{1:04d}'.format(scenario['quote_asset'], index) for index in range(scenario['markets'])],
+            'rest_url':rest_url,
+            'socket_url':socket_url,
+            'stage_metrics':True,
+            'archive_candles':False})
+
+        cache_dir = '{0}/cache/'.format(work_dir)
+        logs_dir = '{0}/logs/'.format(work_dir)
+        os.makedirs(cache_dir)
+        os.makedirs(logs_dir)
+
+        logging.info('[LoadTest] Starting BotCore with {0} markets against {1}.'.format(scenario['markets'], rest_url))
+        start_time = time.time()
+        bot_core = botCore.BotCore(settings, logs_dir, handler.cache_handler(cache_dir, None))
+        bot_core.start()
+        startup_seconds = time.time()-start_time
+
+        time.sleep(scenario['warmup'])
+        requests.post(rest_url+'/fake/reset')
+
+        sampler = ResourceSampler(scenario['sample_interval'])
+        sampler.start()
+        time.sleep(scenario['duration'])
+        sampler.stop()
+
+        exchange_stats = requests.get(rest_url+'/fake/stats').json()
+    finally:
+        process.terminate()
+
+    return({
+        'markets':scenario['markets'],
+        'scenario':scenario,
+        'startup_seconds':startup_seconds,
+        'exchange':exchange_stats,
+        'bot':stage_percentiles(bot_core.metrics_registry),
+        'resources':sampler.summary()})
+
+
+def run_ramp(scenario):
+    ''' Run a load test per market count (each in a new process), returns a report per step. '''
+    reports = []
+
+    for markets in scenario['markets']:
+        work_dir = tempfile.mkdtemp(prefix='load_test_step_')
+        step_path = '{0}/scenario.json'.format(work_dir)
+        results_path = '{0}/results.json'.format(work_dir)
+
+        with open(step_path, 'w') as file:
+            file.write(json.dumps(dict(scenario, markets=markets)))
+
+        subprocess.call([sys.executable, '-m', 'core.load_runner', step_path, results_path])
+
+        if os.path.exists(results_path):
+            with open(results_path, 'r') as file:
+                reports += json.loads(file.read())['steps']
+        else:
+            logging.warning('[LoadTest] Step with {0} markets failed.'.format(markets))
+
+    return(reports)
+
+
+def print_reports(reports):
+    ms = lambda value: '{0:.1f}'.format(value*1000) if value != None else '-'
+
+    print('{0:>8} {1:>10} {2:>8} {3:>10} {4:>10} {5:>10} {6:>10} {7:>8} {8:>8} {9:>9}'.format(
+        'markets', 'msgs/s', 'orders', 'ex p50 ms', 'ex p99 ms', 'bot p50 ms', 'bot p99 ms', 'cpu %', 'rss MB', 'lag ms'))
+
+    for report in reports:
+        exchange = report['exchange']
+        bot = report['bot']['tick_to_order']
+        resources = report['resources']
+        print('{0:>8} {1:>10.0f} {2:>8} {3:>10} {4:>10} {5:>10} {6:>10} {7:>8.0f} {8:>8.0f} {9:>9.1f}'.format(
+            report['markets'],
+            exchange['market_messages_per_second'],
+            exchange['orders'],
+            ms(exchange['tick_to_order']['p50']),
+            ms(exchange['tick_to_order']['p99']),
+            ms(bot['p50']),
+            ms(bot['p99']),
+            resources.get('cpu_percent', {}).get('mean', 0),
+            resources.get('rss_mb', {}).get('max', 0),
+            exchange['max_lag']*1000))
+
+
+def main(args):
+    ''' Returns the exit code, the caller should exit the process afterwards (the BotCore threads are left running). '''
+    scenario_path = args[0] if args else None
+    results_path = args[1] if len(args) > 1 else None
+    scenario = load_scenario(scenario_path)
+
+    if type(scenario['markets']) == list:
+        reports = run_ramp(scenario)
+    else:
+        reports = [run_load_test(scenario)]
+
+    print_reports(reports)
+
+    if results_path:
+        with open(results_path, 'w') as file:
+            file.write(json.dumps({'time':int(time.time()), 'steps':reports}, indent=2))
+        print('Results saved to {0}'.format(results_path))
+
+    return(0 if reports else 1)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(format='%(asctime)s:%(name)s:%(message)s', level=logging.WARNING)
+    exit_code = main(sys.argv[1:])
+    sys.stdout.flush()
+    os._exit(exit_code)
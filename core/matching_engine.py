@@ -0,0 +1,263 @@
+#! /usr/bin/env python3
+
+'''
+matching_engine
+
+'''
+import logging
+import itertools
+import threading
+
+
+## Default commission (same as the trader's COMMISION_FEE).
+DEFAULT_FEE = 0.00075
+
+## Default seconds between an order being placed and it reaching the (simulated) exchange.
+DEFAULT_LATENCY = 0.1
+
+## Relative tolerance used when comparing traded prices with order prices.
+PRICE_TOLERANCE = 1e-9
+
+
+class PaperMatchingEngine(object):
+
+    def __init__(self, fee=DEFAULT_FEE, latency=DEFAULT_LATENCY):
+        '''
+        Simulated exchange used for TEST run types (and the backtester) to fill paper orders.
+
+        -> Market data.
+            update() is called with the depth and the current candle of a symbol on each trader pass, the candle
+            is turned into the trade flow (volume and price range traded) since the last update.
+
+        -> Taker fills.
+            MARKET orders and limit orders that cross the book when they arrive walk the opposite side of the depth,
+            filling level by level (limit orders only up to their price), anything left over waits for the next update.
+
+        -> Maker fills (queue position).
+            A resting limit order starts behind the quantity shown at its price. Trades at its price use up the queue
+            ahead before filling the order, the queue also shrinks if the shown quantity drops (orders cancelled ahead),
+            trades through its price fill it in full.
+
+        -> Latency/fees.
+            Orders only become active latency seconds after they are placed. The fee is charged on each fill and
+            folded into the average price (BUY fills cost more, SELL fills return less) so outcomes are net of fees.
+
+        Orders are kept per symbol, update() for a symbol with no open orders only tracks the candle.
+        '''
+        self.fee = fee
+        self.latency = latency
+
+        self.order_ids = itertools.count(1)
+        self.orders = {}
+        self.open_orders = {}
+        self.last_candles = {}
+
+        self.lock = threading.Lock()
+
+
+    def submit(self, symbol, side, order_type, quantity, price=None, stop_price=None, now=0):
+        '''
+        Place a paper order, side is the exchange side (BUY/SELL) and order_type one of MARKET, LIMIT or STOP_LOSS_LIMIT.
+        Returns the order id.
+        '''
+        order_id = next(self.order_ids)
+
+        order = {
+            'orderId':order_id,
+            'symbol':symbol,
+            'side':side,
+            'type':order_type,
+            'price':float(price) if price != None else None,
+            'stopPrice':float(stop_price) if stop_price != None else None,
+            'origQty':float(quantity),
+            'executedQty':0.0,
+            'quoteQty':0.0,
+            'fee':0.0,
+            'status':'NEW',
+            'active_time':now+self.latency,
+            'triggered':order_type != 'STOP_LOSS_LIMIT',
+            'resting':False,
+            'queue_ahead':0.0}
+
+        with self.lock:
+            self.orders.update({order_id:order})
+            self.open_orders.setdefault(symbol, []).append(order)
+
+        logging.debug('[PaperMatchingEngine] {0} {1} {2} order {3} for {4} @ {5}.'.format(symbol, side, order_type, order_id, quantity, price))
+        return(order_id)
+
+
+    def cancel(self, order_id):
+        ''' Cancel an open order (any quantity already filled stays filled), returns False if it was not open. '''
+        with self.lock:
+            order = self.orders.pop(order_id, None)
+            if order == None or order['status'] in ['FILLED', 'CANCELED']:
+                return(False)
+
+            order['status'] = 'CANCELED'
+            self.open_orders[order['symbol']].remove(order)
+        return(True)
+
+
+    def get_order(self, order_id):
+        '''
+        Order status {'status', 'executedQty', 'avgPrice', 'fee', ...}, None if the order is not known.
+        A FILLED order is only returned once (it is dropped after being seen).
+        '''
+        with self.lock:
+            order = self.orders.get(order_id)
+            if order == None:
+                return(None)
+
+            if order['status'] == 'FILLED':
+                del self.orders[order_id]
+
+            result = dict(order)
+
+        executed = result['executedQty']
+        result['avgPrice'] = (result['quoteQty']/executed) if executed else None
+        return(result)
+
+
+    def _trade_flow(self, symbol, candle):
+        '''
+        Volume and price range traded since the last update, worked out from the current candle
+        [open_time, open, high, low, close, volume] and the one seen last time.
+        '''
+        open_time, high, low, close, volume = candle[0], float(candle[2]), float(candle[3]), float(candle[4]), float(candle[5])
+        last = self.last_candles.get(symbol)
+        self.last_candles[symbol] = (open_time, high, low, close, volume)
+
+        if last == None:
+            ## Nothing is known about trades before the first update.
+            return(0.0, close, close)
+
+        last_time, last_high, last_low, last_close, last_volume = last
+
+        if last_time == open_time:
+            ## Same candle, only new highs/lows tell us more than the move from the last close.
+            flow_high = high if high > last_high else max(close, last_close)
+            flow_low = low if low < last_low else min(close, last_close)
+            return(max(volume-last_volume, 0.0), flow_high, flow_low)
+
+        return(volume, max(high, last_close), min(low, last_close))
+
+
+    def update(self, symbol, depth, candle, now):
+        ''' Match the open orders of a symbol against its latest depth {'a':[[price, qty], ...], 'b':[...]} and candle. '''
+        traded, flow_high, flow_low = self._trade_flow(symbol, candle)
+
+        orders = self.open_orders.get(symbol)
+        if not orders:
+            return
+
+        last_price = float(candle[4])
+
+        with self.lock:
+            for order in list(orders):
+                if order['active_time'] > now:
+                    continue
+
+                if not order['triggered']:
+                    ## Stop limit orders become limit orders once the stop price trades.
+                    if (order['side'] == 'SELL' and flow_low <= order['stopPrice']) or (order['side'] == 'BUY' and flow_high >= order['stopPrice']):
+                        order['triggered'] = True
+                    else:
+                        continue
+
+                if order['resting']:
+                    self._match_resting(order, depth, traded, flow_high, flow_low)
+                else:
+                    self._match_taker(order, depth, last_price)
+
+                if order['status'] == 'FILLED':
+                    orders.remove(order)
+
+
+    def _match_taker(self, order, depth, last_price):
+        ''' Fill an arriving order against the opposite side of the book (up to its limit price). '''
+        levels = depth['a'] if order['side'] == 'BUY' else depth['b']
+        limit = order['price'] if order['type'] != 'MARKET' else None
+
+        for price, quantity in levels:
+            price, quantity = float(price), float(quantity)
+            remaining = order['origQty']-order['executedQty']
+
+            if remaining <= 0:
+                break
+            if limit != None and ((order['side'] == 'BUY' and price > limit) or (order['side'] == 'SELL' and price < limit)):
+                break
+
+            self._fill(order, min(remaining, quantity), price)
+
+        if order['status'] == 'FILLED' or order['type'] == 'MARKET':
+            return
+
+        ## What is left of a limit order rests on the book behind the quantity already shown at its price
+        ## (nothing is ahead of it at a price past the shown levels).
+        shown = self._shown_quantity(order, depth)
+        order['resting'] = True
+        order['queue_ahead'] = shown if shown != None else 0.0
+
+
+    def _match_resting(self, order, depth, traded, flow_high, flow_low):
+        ''' Fill a resting limit order from the trades at/through its price. '''
+        price = order['price']
+        tolerance = price*PRICE_TOLERANCE
+
+        shown = self._shown_quantity(order, depth)
+        if shown != None and shown < order['queue_ahead']:
+            order['queue_ahead'] = shown
+
+        if order['side'] == 'BUY':
+            through = flow_low < price-tolerance
+            touched = flow_low <= price+tolerance
+        else:
+            through = flow_high > price+tolerance
+            touched = flow_high >= price-tolerance
+
+        remaining = order['origQty']-order['executedQty']
+
+        if through:
+            self._fill(order, remaining, price)
+        elif touched and traded > 0:
+            ## Trades at the price go to the orders ahead in the queue first.
+            filled = min(remaining, max(traded-order['queue_ahead'], 0.0))
+            order['queue_ahead'] = max(order['queue_ahead']-traded, 0.0)
+            if filled > 0:
+                self._fill(order, filled, price)
+
+
+    def _shown_quantity(self, order, depth):
+        '''
+        Quantity shown at the order's price on its own side of the book, 0 if the price is inside the shown levels
+        but has no quantity and None if it is past the shown levels (nothing known).
+        '''
+        levels = depth['b'] if order['side'] == 'BUY' else depth['a']
+        price = order['price']
+        tolerance = price*PRICE_TOLERANCE
+
+        for level_price, quantity in levels:
+            level_price = float(level_price)
+            if abs(level_price-price) <= tolerance:
+                return(float(quantity))
+            if (order['side'] == 'BUY' and level_price < price) or (order['side'] == 'SELL' and level_price > price):
+                return(0.0)
+        return(None)
+
+
+    def _fill(self, order, quantity, price):
+        if quantity <= 0:
+            return
+
+        value = quantity*price
+        fee = value*self.fee
+
+        order['executedQty'] += quantity
+        order['fee'] += fee
+        order['quoteQty'] += (value+fee) if order['side'] == 'BUY' else (value-fee)
+
+        if order['executedQty'] >= order['origQty']*(1-PRICE_TOLERANCE):
+            order['status'] = 'FILLED'
+        else:
+            order['status'] = 'PARTIALLY_FILLED'
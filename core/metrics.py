@@ -0,0 +1,185 @@
+#! /usr/bin/env python3
+
+'''
+metrics
+
+'''
+import time
+import threading
+import numpy as np
+
+
+## Histogram bucket upper bounds in seconds (Prometheus le labels).
+BUCKETS = [0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0]
+
+## Number of recent samples kept per stage for the rolling p50/p99/max.
+DEFAULT_WINDOW = 1024
+
+## Trader passes are timed 1 in this many (tick to order is always timed), keeps the timers well under 1% of the loop time.
+DEFAULT_SAMPLE_EVERY = 10
+
+## Quantiles worked out from the recent samples.
+QUANTILES = [0.5, 0.99]
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+class StageStats(object):
+
+    def __init__(self, window=DEFAULT_WINDOW):
+        '''
+        Timings for one trader stage, a ring of the last window samples (used for the rolling p50/p99/max) that is
+        folded into the cumulative histogram (count/sum/buckets) each time it wraps, so observe is just a store.
+        Each stage is only written by its own trader so there is no lock, a scrape may miss the newest sample.
+        '''
+        self.window = window
+        self.recent = [0.0]*window
+        self.index = 0
+
+        self.bucket_counts = np.zeros(len(BUCKETS)+1, dtype=np.int64)
+        self.total = 0.0
+
+
+    def observe(self, value):
+        position = self.index % self.window
+        self.recent[position] = value
+        self.index += 1
+
+        if position == self.window-1:
+            self._fold(self.recent)
+
+
+    def _fold(self, samples):
+        samples = np.asarray(samples)
+        self.bucket_counts += np.bincount(np.searchsorted(BUCKETS, samples), minlength=len(BUCKETS)+1)
+        self.total += float(samples.sum())
+
+
+    def histogram(self):
+        ''' (bucket counts, sum) including the samples not folded in yet. '''
+        index = self.index
+        unfolded = np.asarray(self.recent[:index % self.window])
+
+        bucket_counts = self.bucket_counts+np.bincount(np.searchsorted(BUCKETS, unfolded), minlength=len(BUCKETS)+1)
+        return(bucket_counts, self.total+float(unfolded.sum()))
+
+
+    def recent_summary(self):
+        ''' ({quantile:value}, max) over the recent samples. '''
+        samples = sorted(self.recent[:min(self.index, self.window)])
+        if not samples:
+            return({quantile:0.0 for quantile in QUANTILES}, 0.0)
+
+        quantiles = {quantile:samples[min(int(quantile*len(samples)), len(samples)-1)] for quantile in QUANTILES}
+        return(quantiles, samples[-1])
+
+
+class MetricsRegistry(object):
+
+    def __init__(self, tick_times=None, window=DEFAULT_WINDOW, sample_every=DEFAULT_SAMPLE_EVERY):
+        '''
+        Per trader stage timings, rendered in the Prometheus text format for /metrics.
+        tick_times is the {symbol:perf_counter time} of the last socket message (kept by the notifier) used
+        for the tick to order latency. Stage counts are of the sampled passes (1 in sample_every).
+        '''
+        self.tick_times = tick_times if tick_times != None else {}
+        self.window = window
+        self.sample_every = sample_every
+
+        self.stats = {}
+        self.lock = threading.Lock()
+
+
+    def get_stats(self, market, stage):
+        key = (market, stage)
+        if not key in self.stats:
+            with self.lock:
+                if not key in self.stats:
+                    self.stats.update({key:StageStats(self.window)})
+        return(self.stats[key])
+
+
+    def render(self):
+        ''' All the stage timings in the Prometheus text exposition format. '''
+        lines = [
+            '# HELP trader_stage_seconds Time taken by each trader stage.',
+            '# TYPE trader_stage_seconds histogram']
+        recent_lines = [
+            '# HELP trader_stage_recent_seconds Quantiles of the most recent trader stage timings.',
+            '# TYPE trader_stage_recent_seconds gauge']
+        max_lines = [
+            '# HELP trader_stage_recent_max_seconds Slowest of the most recent trader stage timings.',
+            '# TYPE trader_stage_recent_max_seconds gauge']
+
+        for (market, stage), stats in sorted(list(self.stats.items())):
+            labels = 'market="{0}",stage="{1}"'.format(market, stage)
+
+            bucket_counts, total = stats.histogram()
+            cumulative = 0
+            for bound, bucket_count in zip(BUCKETS+['+Inf'], bucket_counts):
+                cumulative += int(bucket_count)
+                lines.append('trader_stage_seconds_bucket{{{0},le="{1}"}} {2}'.format(labels, bound, cumulative))
+            lines.append('trader_stage_seconds_sum{{{0}}} {1}'.format(labels, total))
+            lines.append('trader_stage_seconds_count{{{0}}} {1}'.format(labels, cumulative))
+
+            quantiles, maximum = stats.recent_summary()
+            for quantile, value in quantiles.items():
+                recent_lines.append('trader_stage_recent_seconds{{{0},quantile="{1}"}} {2}'.format(labels, quantile, value))
+            max_lines.append('trader_stage_recent_max_seconds{{{0}}} {1}'.format(labels, maximum))
+
+        return('\n'.join(lines+recent_lines+max_lines)+'\n')
+
+
+class StageTimer(object):
+
+    def __init__(self, registry, market, symbol):
+        '''
+        Used by a trader to time its stages, with no registry every call is a no-op.
+
+        begin() at the start of a pass decides if the pass is sampled, then start = timer.now() ...
+        start = timer.observe('stage', start) chains one stage into the next so each stage costs a single
+        perf_counter call. now() gives None on passes that are not sampled and observe ignores a None start.
+        '''
+        self.registry = registry
+        self.market = market
+        self.symbol = symbol
+        self.stats = {}
+
+        self.passes = 0
+        self.sampling = False
+
+
+    def begin(self):
+        ''' Start a pass, returns its start time (None if it is not sampled). '''
+        if self.registry == None:
+            return(None)
+
+        self.passes += 1
+        self.sampling = (self.passes % self.registry.sample_every) == 0
+        return(self.now())
+
+
+    def now(self):
+        if not self.sampling:
+            return(None)
+        return(time.perf_counter())
+
+
+    def observe(self, stage, start):
+        ''' Record the time since start for the stage, returns the current time. '''
+        if start == None:
+            return(None)
+
+        now = time.perf_counter()
+        stats = self.stats.get(stage)
+        if stats == None:
+            stats = self.stats[stage] = self.registry.get_stats(self.market, stage)
+        stats.observe(now-start)
+        return(now)
+
+
+    def tick_time(self):
+        ''' When the last socket message for the market was received (None if not known). '''
+        if self.registry == None:
+            return(None)
+        return(self.registry.tick_times.get(self.symbol))
@@ -0,0 +1,226 @@
+#! /usr/bin/env python3
+
+'''
+notifier
+
+'''
+import json
+import time
+import logging
+import threading
+
+
+## Default window (in seconds) over which trader wakeups are spread.
+DEFAULT_STAGGER_WINDOW = 0.25
+
+## Max time a trader will block without new data before running a pass anyway.
+DEFAULT_WAIT_TIMEOUT = 5
+
+## Account wide user data stream events (these wake every trader).
+ACCOUNT_EVENTS = ['outboundAccountInfo', 'outboundAccountPosition', 'balanceUpdate']
+
+
+class DataNotifier(object):
+
+    def __init__(self, stagger_window=DEFAULT_STAGGER_WINDOW):
+        '''
+        Used to signal traders when the socket has new data for their market.
+
+        Each registered symbol gets an event and a set of pending change types
+        (candle, depth, order, account, control) which the trader collects on wake.
+        '''
+        self.stagger_window = stagger_window
+
+        self.events = {}
+        self.pending = {}
+        self.offsets = {}
+        self.listeners = []
+        self.wake_listeners = []
+
+        ## perf_counter time the last market data message (candle/depth) was received per symbol, used for tick to order latency.
+        self.tick_times = {}
+
+        ## Set once a symbol has the market data a trader needs to start (traders block on it while warming up).
+        self.ready_events = {}
+
+        ## Kinds that only go to the data listeners and do not wake traders (e.g. raw depth diffs handled by the order books).
+        self.quiet_kinds = set()
+
+        self.lock = threading.Lock()
+
+
+    def register(self, symbol):
+        '''
+        Register a symbol and give it a stagger offset.
+        Offsets follow the golden ratio sequence so any number of markets are evenly spread over the window.
+        '''
+        with self.lock:
+            if symbol in self.events:
+                return
+
+            position = len(self.events)
+            self.events.update({symbol:threading.Event()})
+            self.ready_events.update({symbol:threading.Event()})
+            self.pending.update({symbol:set()})
+            self.offsets.update({symbol:((position*0.6180339887) % 1)*self.stagger_window})
+
+        logging.debug('[DataNotifier] Registered {0} with stagger offset {1:.3f}s.'.format(symbol, self.offsets[symbol]))
+
+
+    def set_ready(self, symbol):
+        ''' Mark the symbol as having its market data (wakes any trader waiting to start). '''
+        event = self.ready_events.get(symbol)
+        if event != None:
+            event.set()
+
+
+    def is_ready(self, symbol):
+        event = self.ready_events.get(symbol)
+        return(event != None and event.is_set())
+
+
+    def add_listener(self, callback, wakes=False):
+        '''
+        Add a callback(symbol, kind, data) that is called on every notification.
+        wakes marks callbacks that run traders (scheduler/async runtime), these are skipped for quiet kinds.
+        '''
+        if wakes:
+            self.wake_listeners.append(callback)
+        else:
+            self.listeners.append(callback)
+
+
+    def notify(self, symbol, kind, data=None):
+        ''' Signal that data of the given kind has changed for the symbol (data is the raw event if there is one). '''
+        if not symbol in self.events:
+            return
+
+        ## Listeners run first so anything they update is ready before the trader wakes.
+        for callback in self.listeners:
+            callback(symbol, kind, data)
+
+        if kind in self.quiet_kinds:
+            return
+
+        self._wake(symbol, kind, data)
+
+
+    def _wake(self, symbol, kind, data):
+        for callback in self.wake_listeners:
+            callback(symbol, kind, data)
+
+        with self.lock:
+            self.pending[symbol].add(kind)
+        self.events[symbol].set()
+
+
+    def notify_all(self, kind, data=None):
+        ''' Signal every registered symbol (data listeners are only called once, with the symbol as None). '''
+        for callback in self.listeners:
+            callback(None, kind, data)
+
+        if kind in self.quiet_kinds:
+            return
+
+        for symbol in list(self.events):
+            self._wake(symbol, kind, data)
+
+
+    def wait(self, symbol, timeout=DEFAULT_WAIT_TIMEOUT):
+        '''
+        Block until new data is available for the symbol or the timeout passes.
+        Returns the set of change types seen (empty on timeout).
+        '''
+        event = self.events[symbol]
+
+        if not event.wait(timeout):
+            return(set())
+
+        ## Hold off by the markets offset to coalesce bursts and spread the wakeups.
+        if self.offsets[symbol]:
+            time.sleep(self.offsets[symbol])
+
+        with self.lock:
+            event.clear()
+            changes = self.pending[symbol]
+            self.pending[symbol] = set()
+
+        return(changes)
+
+
+    def hook_socket(self, socket_api):
+        '''
+        Wrap the socket start so that every (re)created websocket app has its message callback hooked.
+        '''
+        original_start = socket_api.start
+
+        def hooked_start(*args, **kwargs):
+            result = original_start(*args, **kwargs)
+            self._hook_websocket(socket_api)
+            return(result)
+
+        socket_api.start = hooked_start
+
+
+    def _hook_websocket(self, socket_api):
+        ws = getattr(socket_api, 'ws', None)
+
+        if ws == None or not hasattr(ws, 'on_message'):
+            logging.warning('[DataNotifier] Unable to hook socket messages, traders will fall back to timed updates.')
+            return
+
+        original_on_message = ws.on_message
+
+        if getattr(original_on_message, 'notifier_hooked', False):
+            return
+
+        def on_message(*args):
+            receive_time = time.perf_counter()
+
+            ## Let the socket handle the message first so the data is live before traders wake.
+            if original_on_message:
+                original_on_message(*args)
+            self.handle_message(args[-1], receive_time)
+
+        on_message.notifier_hooked = True
+        ws.on_message = on_message
+
+
+    def handle_message(self, message, receive_time=None):
+        ''' Work out which symbol and data type a raw socket message relates to. '''
+        try:
+            message = json.loads(message) if type(message) in (str, bytes) else message
+        except ValueError:
+            return
+
+        if not type(message) == dict:
+            return
+
+        stream = message.get('stream', '')
+        data = message.get('data', message)
+
+        if not type(data) == dict:
+            return
+
+        event_type = data.get('e', None)
+
+        if event_type in ACCOUNT_EVENTS:
+            self.notify_all('account', data)
+            return
+
+        symbol = data.get('s', None)
+        if symbol == None and '@' in stream:
+            symbol = stream.split('@')[0].upper()
+
+        if symbol == None:
+            return
+
+        if event_type == 'kline' or event_type == 'depthUpdate' or 'lastUpdateId' in data:
+            self.tick_times[symbol] = receive_time if receive_time != None else time.perf_counter()
+
+        if event_type == 'kline':
+            self.notify(symbol, 'candle', data)
+        elif event_type == 'executionReport':
+            self.notify(symbol, 'order', data)
+        elif event_type == 'depthUpdate' or 'lastUpdateId' in data:
+            self.notify(symbol, 'depth', data)
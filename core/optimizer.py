@@ -0,0 +1,254 @@
+#! /usr/bin/env python3
+
+'''
+optimizer
+
+'''
+import os
+import sys
+import json
+import time
+import random
+import logging
+import tempfile
+import itertools
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+
+import trader_configuration as TC
+
+from . import backtester
+
+
+## Candles opened by each worker process (market:oldest first candle array), filled by the worker initializer.
+_WORKER_CANDLES = {}
+
+## Backtest settings shared by each worker process.
+_WORKER_SETTINGS = {}
+
+
+def grid_space(space):
+    ''' Every combination of a {parameter:[values]} grid. '''
+    names = list(space)
+    return([dict(zip(names, values)) for values in itertools.product(*[space[name] for name in names])])
+
+
+def random_space(space, samples, seed=1):
+    '''
+    Random samples from a {parameter:values} space, values are either a list to choose from or
+    a {'low':.., 'high':..} range (ints give an int range, floats a uniform range).
+    '''
+    generator = random.Random(seed)
+    parameter_sets = []
+
+    for _ in range(samples):
+        parameters = {}
+        for name, values in space.items():
+            if type(values) == dict:
+                low, high = values['low'], values['high']
+                if type(low) == int and type(high) == int:
+                    parameters.update({name:generator.randint(low, high)})
+                else:
+                    parameters.update({name:generator.uniform(low, high)})
+            else:
+                parameters.update({name:generator.choice(values)})
+        parameter_sets.append(parameters)
+
+    return(parameter_sets)
+
+
+def walk_forward_windows(candle_count, train, test, step=None, warmup=500):
+    '''
+    Split a candle range into walk forward (train, test) windows of (start, end) candle positions.
+    Each window starts after warmup candles so the indicators are seeded, the test window directly follows its train window.
+    '''
+    step = step or test
+    windows = []
+    start = warmup
+
+    while start+train+test <= candle_count:
+        windows.append(((start, start+train), (start+train, start+train+test)))
+        start += step
+
+    return(windows)
+
+
+def trade_stats(trade_ledger):
+    ''' PnL, max drawdown and trade counts for a trade ledger. '''
+    outcomes = np.array([trade[4] for trade in trade_ledger], dtype=np.float64)
+
+    if not len(outcomes):
+        return({'pnl':0.0, 'drawdown':0.0, 'trades':0, 'wins':0})
+
+    equity = np.cumsum(outcomes)
+    drawdown = float(np.max(np.maximum.accumulate(np.concatenate(([0.0], equity)))[1:]-equity))
+
+    return({'pnl':float(equity[-1]), 'drawdown':drawdown, 'trades':len(outcomes), 'wins':int(np.sum(outcomes > 0))})
+
+
+def rank_results(results):
+    ''' Sort results by PnL (highest), then drawdown (lowest), then trade count (highest). '''
+    return(sorted(results, key=lambda result: (-result['pnl'], result['drawdown'], -result['trades'])))
+
+
+def _init_worker(candle_paths, settings):
+    '''
+    Open the candle files in the worker, they are memory mapped so every process shares the same
+    read only pages instead of being sent a pickled copy with each task.
+    '''
+    for market, path in candle_paths.items():
+        _WORKER_CANDLES.update({market:backtester.load_candles(path)})
+
+    _WORKER_SETTINGS.update(settings)
+    _WORKER_SETTINGS.update({'default_parameters':dict(TC.PARAMETERS)})
+
+    ## Keep the workers quiet, the trader logs/prints every order.
+    logging.getLogger().setLevel(logging.WARNING)
+    sys.stdout = open(os.devnull, 'w')
+
+
+def _run_task(task):
+    ''' Backtest one parameter set on one market over a (start, end) candle range. '''
+    parameters, market, (start, end) = task
+    window = _WORKER_SETTINGS['window']
+
+    ## Start from the default parameters each task so nothing carries over from the last one.
+    TC.setup_parameters(dict(_WORKER_SETTINGS['default_parameters'], **parameters))
+
+    candles = _WORKER_CANDLES[market]
+    candles = candles[max(start-window+1, 0):end]
+
+    trade_ledger = backtester.run_backtest(
+        market,
+        candles,
+        market_type=_WORKER_SETTINGS['market_type'],
+        MAC=_WORKER_SETTINGS['MAC'],
+        window=window)
+
+    return(trade_stats(trade_ledger))
+
+
+class Optimizer(object):
+
+    def __init__(self, candle_paths, market_type='SPOT', MAC=0.0015, window=500, workers=None):
+        '''
+        Fans backtests for a set of parameter sets out over a process pool.
+
+        candle_paths maps each market to a candle archive (.bin) or .npy file, if arrays are given
+        instead they are saved to .npy files first so the workers can still memory map them.
+        Those files are in a temporary directory owned by the optimizer that is removed by close()
+        (or when the optimizer is garbage collected).
+        '''
+        self.candle_paths = {}
+        self.window = window
+        self.settings = {'market_type':market_type, 'MAC':MAC, 'window':window}
+        self.workers = workers or os.cpu_count()
+        self.temp_dir = None
+
+        for market, candles in candle_paths.items():
+            if type(candles) != str:
+                if self.temp_dir == None:
+                    self.temp_dir = tempfile.TemporaryDirectory(prefix='optimizer_')
+                path = '{0}/{1}.npy'.format(self.temp_dir.name, market)
+                np.save(path, np.ascontiguousarray(candles, dtype=np.float64))
+                candles = path
+            self.candle_paths.update({market:candles})
+
+        self.candle_counts = {market:len(backtester.load_candles(path)) for market, path in self.candle_paths.items()}
+
+
+    def close(self):
+        ''' Remove the .npy copies of any candle arrays passed in. '''
+        if self.temp_dir != None:
+            self.temp_dir.cleanup()
+            self.temp_dir = None
+
+
+    def _evaluate(self, executor, parameter_sets, ranges):
+        '''
+        Run every parameter set over every market/range and sum the stats per parameter set.
+        ranges maps market to a (start, end) candle range.
+        '''
+        tasks = [(parameters, market, ranges[market]) for parameters in parameter_sets for market in ranges]
+        chunk_size = max(1, len(tasks)//(self.workers*4))
+
+        results = [{'parameters':parameters, 'pnl':0.0, 'drawdown':0.0, 'trades':0, 'wins':0} for parameters in parameter_sets]
+        for index, stats in enumerate(executor.map(_run_task, tasks, chunksize=chunk_size)):
+            result = results[index//len(ranges)]
+            result['pnl'] += stats['pnl']
+            result['drawdown'] = max(result['drawdown'], stats['drawdown'])
+            result['trades'] += stats['trades']
+            result['wins'] += stats['wins']
+
+        return(rank_results(results))
+
+
+    def _executor(self):
+        return(ProcessPoolExecutor(
+            max_workers=self.workers,
+            initializer=_init_worker,
+            initargs=(self.candle_paths, self.settings)))
+
+
+    def sweep(self, parameter_sets):
+        ''' Backtest every parameter set over all the candles of every market, returns the ranked results. '''
+        logging.info('[Optimizer] Sweeping {0} parameter sets over {1} markets with {2} workers.'.format(
+            len(parameter_sets), len(self.candle_paths), self.workers))
+        start_time = time.time()
+
+        ranges = {market:(min(self.window-1, count), count) for market, count in self.candle_counts.items()}
+
+        with self._executor() as executor:
+            results = self._evaluate(executor, parameter_sets, ranges)
+
+        logging.info('[Optimizer] Sweep finished in {0:.1f}s.'.format(time.time()-start_time))
+        return(results)
+
+
+    def walk_forward(self, parameter_sets, train, test, step=None):
+        '''
+        Walk forward optimisation, for each window the best parameter set on the train range is
+        backtested on the following (unseen) test range. Returns a result per window.
+        '''
+        candle_count = min(self.candle_counts.values())
+        windows = walk_forward_windows(candle_count, train, test, step=step, warmup=self.window)
+        logging.info('[Optimizer] Walk forward over {0} windows with {1} parameter sets.'.format(len(windows), len(parameter_sets)))
+
+        window_results = []
+        with self._executor() as executor:
+            for train_range, test_range in windows:
+                train_results = self._evaluate(executor, parameter_sets, {market:train_range for market in self.candle_paths})
+                best = train_results[0]
+
+                test_result = self._evaluate(executor, [best['parameters']], {market:test_range for market in self.candle_paths})[0]
+                window_results.append({'train_range':train_range, 'test_range':test_range, 'train':best, 'test':test_result})
+
+                logging.info('[Optimizer] Window {0}: train pnl {1:.8f}, test pnl {2:.8f} with {3}'.format(
+                    train_range, best['pnl'], test_result['pnl'], best['parameters']))
+
+        return(window_results)
+
+
+def run_from_file(space_file, candle_paths, **kwargs):
+    '''
+    Run the optimizer from a json space file:
+        {"grid":{parameter:[values]}} or {"random":{parameter:values}, "samples":100, "seed":1}
+    with an optional "walk_forward":{"train":candles, "test":candles, "step":candles}.
+    '''
+    with open(space_file, 'r') as file:
+        space = json.loads(file.read())
+
+    if 'grid' in space:
+        parameter_sets = grid_space(space['grid'])
+    else:
+        parameter_sets = random_space(space['random'], space.get('samples', 100), seed=space.get('seed', 1))
+
+    optimizer_ = Optimizer(candle_paths, **kwargs)
+
+    try:
+        if 'walk_forward' in space:
+            walk_forward = space['walk_forward']
+            return(optimizer_.walk_forward(parameter_sets, walk_forward['train'], walk_forward['test'], step=walk_forward.get('step', None)))
+        return(optimizer_.sweep(parameter_sets))
+    finally:
+        optimizer_.close()
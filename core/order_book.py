@@ -0,0 +1,326 @@
+#! /usr/bin/env python3
+
+'''
+order_book
+
+'''
+import time
+import logging
+import threading
+import requests
+from bisect import bisect_left, insort
+from concurrent.futures import ThreadPoolExecutor
+
+from . import candle_puller
+
+
+## REST depth snapshot used to (re)sync a book, only as many levels as are used are asked for up to the largest
+## limit that still costs the lowest weight (levels past the snapshot are filled in by the diffs as they change).
+DEPTH_PATH = '/api/v3/depth'
+MAX_SNAPSHOT_LIMIT = 100
+
+## Request weight of a depth snapshot, (largest limit, weight) for each limit range.
+DEPTH_WEIGHTS = [(100, 5), (500, 25), (1000, 50), (5000, 250)]
+
+## Levels each side used for the imbalance metric.
+IMBALANCE_LEVELS = 10
+
+## Max diffs buffered while waiting for a snapshot (older ones are dropped, which just forces another snapshot).
+MAX_BUFFERED = 1000
+
+## Seconds to wait before retrying a snapshot that did not line up with the buffered diffs.
+RESYNC_DELAY = 1
+
+
+def depth_weight(limit):
+    for max_limit, weight in DEPTH_WEIGHTS:
+        if limit <= max_limit:
+            return(weight)
+    return(DEPTH_WEIGHTS[-1][1])
+
+
+class OrderBook(object):
+
+    def __init__(self, symbol, fill_size=0.0):
+        '''
+        Local order book for one symbol kept up to date from diff depth events.
+
+        -> Levels.
+            Each side is a {price:quantity} dict and a sorted price list (bids are stored negated) so the best
+            price is always index 0 (O(1)). A level is found with a binary search (O(log n)) but adding or removing
+            one shifts the rest of the list (O(n) per level update, n being the levels held, kept small by the snapshot limit).
+
+        -> Sequencing.
+            Diffs seen before the snapshot are buffered, after it an event is only applied if its first update id
+            follows on from the last applied one (U <= last+1 <= u), otherwise the book is marked out of sync
+            and its levels are cleared so nothing stale is read until it has been resynced.
+
+        -> Metrics.
+            Spread, mid price, imbalance and the VWAP to buy/sell fill_size (in the quote asset) are recalculated
+            after each update so readers never walk the book.
+        '''
+        self.symbol = symbol
+        self.fill_size = fill_size
+
+        self.bids = {}
+        self.asks = {}
+        self.bid_prices = []
+        self.ask_prices = []
+
+        self.last_update_id = None
+        self.synced = False
+        self.buffer = []
+
+        self.metrics = {}
+        self.lock = threading.Lock()
+
+
+    def _set_level(self, levels, prices, price, quantity, negate):
+        key = -price if negate else price
+
+        if quantity == 0:
+            if price in levels:
+                del levels[price]
+                del prices[bisect_left(prices, key)]
+        else:
+            if not price in levels:
+                insort(prices, key)
+            levels[price] = quantity
+
+
+    def _apply_levels(self, bids, asks):
+        for price, quantity in bids:
+            self._set_level(self.bids, self.bid_prices, float(price), float(quantity), True)
+        for price, quantity in asks:
+            self._set_level(self.asks, self.ask_prices, float(price), float(quantity), False)
+
+
+    def load_snapshot(self, snapshot):
+        ''' Replace the book with a REST/partial depth snapshot ({'lastUpdateId', 'bids', 'asks'}) and apply any buffered diffs. '''
+        with self.lock:
+            self.bids, self.asks = {}, {}
+            self.bid_prices, self.ask_prices = [], []
+
+            self._apply_levels(snapshot['bids'], snapshot['asks'])
+            self.last_update_id = snapshot['lastUpdateId']
+            self.synced = True
+
+            buffered = self.buffer
+            self.buffer = []
+
+            for index, event in enumerate(buffered):
+                if not self._apply_diff(event):
+                    self.buffer = buffered[index:]
+                    break
+
+            self._update_metrics()
+            return(self.synced)
+
+
+    def apply(self, event):
+        ''' Apply a diff depth event, returns False if an update was missed and a new snapshot is needed. '''
+        with self.lock:
+            if not self.synced:
+                self.buffer.append(event)
+                if len(self.buffer) > MAX_BUFFERED:
+                    del self.buffer[0]
+                return(False)
+
+            synced = self._apply_diff(event)
+            if synced:
+                self._update_metrics()
+            return(synced)
+
+
+    def _apply_diff(self, event):
+        ## Already covered by the snapshot/earlier events.
+        if event['u'] <= self.last_update_id:
+            return(True)
+
+        if not (event['U'] <= self.last_update_id+1 <= event['u']):
+            logging.warning('[OrderBook] {0} missed updates ({1} -> {2}), resyncing.'.format(self.symbol, self.last_update_id, event['U']))
+            self.synced = False
+            self.buffer = [event]
+            self.bids, self.asks = {}, {}
+            self.bid_prices, self.ask_prices = [], []
+            self.metrics = {}
+            return(False)
+
+        self._apply_levels(event['b'], event['a'])
+        self.last_update_id = event['u']
+        return(True)
+
+
+    def vwap(self, side, quote_amount):
+        '''
+        Average price to fill quote_amount (in the quote asset) against the book, BUY walks the asks and SELL the bids.
+        Returns None if the book is not deep enough.
+        '''
+        if side == 'BUY':
+            levels, prices, sign = self.asks, self.ask_prices, 1
+        else:
+            levels, prices, sign = self.bids, self.bid_prices, -1
+
+        remaining = quote_amount
+        quantity = 0.0
+
+        for key in prices:
+            price = key*sign
+            level_value = price*levels[price]
+
+            if level_value >= remaining:
+                quantity += remaining/price
+                return(quote_amount/quantity)
+
+            remaining -= level_value
+            quantity += levels[price]
+
+        return(None)
+
+
+    def _update_metrics(self):
+        if not self.bid_prices or not self.ask_prices:
+            self.metrics = {}
+            return
+
+        best_bid = -self.bid_prices[0]
+        best_ask = self.ask_prices[0]
+
+        bid_volume = sum(self.bids[-key] for key in self.bid_prices[:IMBALANCE_LEVELS])
+        ask_volume = sum(self.asks[key] for key in self.ask_prices[:IMBALANCE_LEVELS])
+
+        self.metrics = {
+            'bestBid':best_bid,
+            'bestAsk':best_ask,
+            'spread':best_ask-best_bid,
+            'midPrice':(best_ask+best_bid)/2,
+            'imbalance':(bid_volume-ask_volume)/(bid_volume+ask_volume) if (bid_volume+ask_volume) else 0.0,
+            'buyVWAP':self.vwap('BUY', self.fill_size) if self.fill_size else best_ask,
+            'sellVWAP':self.vwap('SELL', self.fill_size) if self.fill_size else best_bid}
+
+
+    def depth(self, levels):
+        ''' Top levels in the socket depth format {'a':[[price, quantity], ...], 'b':[...]}. '''
+        with self.lock:
+            return({
+                'a':[[key, self.asks[key]] for key in self.ask_prices[:levels]],
+                'b':[[-key, self.bids[-key]] for key in self.bid_prices[:levels]]})
+
+
+class OrderBookSet(object):
+
+    def __init__(self, notifier=None, levels=50, rest_url=candle_puller.REST_URL, snapshot_limit=None, fallback=None, weight_limiter=None):
+        '''
+        Local order books for all the traded symbols, fed by the notifier with the raw depth socket events.
+
+        Depth events are made quiet on the notifier (they only update the books), traders are only woken
+        with a 'book' notification when the best bid/ask changes so fast depth streams do not flood them.
+        fallback is a depth endpoint used for a symbol while its book is not synced.
+        Snapshots are for the levels used (snapshot_limit, default levels up to MAX_SNAPSHOT_LIMIT) and use the
+        request weight budget of weight_limiter (shared with the other REST users).
+        '''
+        self.notifier = notifier
+        self.levels = levels
+        self.rest_url = rest_url
+        self.snapshot_limit = snapshot_limit if snapshot_limit != None else min(levels, MAX_SNAPSHOT_LIMIT)
+        self.fallback = fallback
+        self.weight_limiter = weight_limiter if weight_limiter != None else candle_puller.WeightLimiter()
+
+        self.books = {}
+        self.fetching = set()
+        self.fetch_lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix='book-snapshot')
+
+        if notifier:
+            notifier.quiet_kinds.add('depth')
+            notifier.add_listener(self.on_update)
+
+
+    def get_book(self, symbol):
+        if not symbol in self.books:
+            self.books.update({symbol:OrderBook(symbol)})
+        return(self.books[symbol])
+
+
+    def set_fill_size(self, symbol, quote_amount):
+        ''' Order size (in the quote asset) the VWAP metrics are worked out for. '''
+        book = self.get_book(symbol)
+        with book.lock:
+            book.fill_size = quote_amount
+            book._update_metrics()
+
+
+    def on_update(self, symbol, kind, data):
+        ''' Notifier listener, applies raw depth events to the books. '''
+        if kind != 'depth' or not data:
+            return
+
+        book = self.get_book(symbol)
+        top = (book.metrics.get('bestBid'), book.metrics.get('bestAsk'))
+
+        if 'lastUpdateId' in data and 'bids' in data:
+            ## Partial book stream, each message is a full snapshot.
+            book.load_snapshot(data)
+        elif not book.apply(data):
+            self.request_snapshot(symbol)
+
+        if self.notifier and top != (book.metrics.get('bestBid'), book.metrics.get('bestAsk')):
+            self.notifier.notify(symbol, 'book')
+
+
+    def request_snapshot(self, symbol):
+        with self.fetch_lock:
+            if symbol in self.fetching:
+                return
+            self.fetching.add(symbol)
+
+        self.executor.submit(self._fetch_snapshot, symbol)
+
+
+    def _fetch_snapshot(self, symbol):
+        try:
+            if self.get_book(symbol).load_snapshot(self._get_depth(symbol)):
+                logging.info('[OrderBookSet] {0} book synced.'.format(symbol))
+            else:
+                ## Snapshot is older than the buffered diffs (or a gap), try again.
+                time.sleep(RESYNC_DELAY)
+                with self.fetch_lock:
+                    self.fetching.discard(symbol)
+                self.request_snapshot(symbol)
+                return
+        except Exception as error:
+            logging.warning('[OrderBookSet] Failed to get {0} depth snapshot: {1}'.format(symbol, error))
+
+        with self.fetch_lock:
+            self.fetching.discard(symbol)
+
+
+    def _get_depth(self, symbol):
+        ''' REST depth snapshot, waits for request weight and backs off for as long as the exchange asks when rate limited. '''
+        while True:
+            self.weight_limiter.acquire(depth_weight(self.snapshot_limit))
+            response = requests.get(self.rest_url+DEPTH_PATH, params={'symbol':symbol, 'limit':self.snapshot_limit}, timeout=10)
+
+            if 'X-MBX-USED-WEIGHT-1M' in response.headers:
+                self.weight_limiter.sync(int(response.headers['X-MBX-USED-WEIGHT-1M']))
+
+            if response.status_code in (418, 429):
+                retry_after = int(response.headers.get('Retry-After', 60))
+                logging.warning('[OrderBookSet] Rate limited, backing off for {0}s.'.format(retry_after))
+                self.weight_limiter.back_off(retry_after)
+                continue
+
+            response.raise_for_status()
+            return(response.json())
+
+
+    def get_depth_data(self, symbol):
+        ''' Depth endpoint for the traders (same format as the socket depths). '''
+        book = self.get_book(symbol)
+        if not book.synced and self.fallback:
+            return(self.fallback(symbol))
+        return(book.depth(self.levels))
+
+
+    def get_metrics(self, symbol):
+        return(self.get_book(symbol).metrics)
@@ -0,0 +1,299 @@
+#! /usr/bin/env python3
+
+'''
+order_gateway
+
+'''
+import time
+import hmac
+import hashlib
+import logging
+import threading
+import requests
+from urllib.parse import urlencode
+from concurrent.futures import Future
+
+from . import candle_puller
+
+
+## Order endpoints per market type (margin has no cancel-replace so it is sent as a cancel then a place).
+ORDER_PATHS = {'SPOT':'/api/v3/order', 'MARGIN':'/sapi/v1/margin/order'}
+CANCEL_REPLACE_PATH = '/api/v3/order/cancelReplace'
+
+## Request weight of each order request.
+ORDER_WEIGHT = 1
+CANCEL_WEIGHT = 1
+
+## Default exchange order limits (replaced by the exchange info rate limits when set).
+DEFAULT_ORDER_LIMIT_10S = 50
+DEFAULT_ORDER_LIMIT_DAY = 160000
+
+## Default worker threads sending requests (each keeps its own keep-alive session).
+DEFAULT_WORKERS = 2
+
+RECV_WINDOW = 5000
+
+## Seconds in each exchange rate limit interval.
+INTERVAL_SECONDS = {'SECOND':1, 'MINUTE':60, 'HOUR':3600, 'DAY':86400}
+
+
+def format_param(value):
+    ''' Floats are sent in plain decimal form (the exchange rejects exponents). '''
+    if type(value) == float:
+        return('{0:.8f}'.format(value).rstrip('0').rstrip('.'))
+    return(value)
+
+
+class OrderGateway(object):
+
+    def __init__(self, public_key, private_key, rest_url=candle_puller.REST_URL, workers=DEFAULT_WORKERS,
+            weight_limit=candle_puller.DEFAULT_WEIGHT_LIMIT, order_limit_10s=DEFAULT_ORDER_LIMIT_10S, order_limit_day=DEFAULT_ORDER_LIMIT_DAY, weight_limiter=None):
+        '''
+        Single queue for the order requests of every trader.
+
+        -> Intents.
+            Traders submit place/cancel intents keyed by (market, position type, side) and get a Future for the
+            exchange response. Intents for a key are sent in order, one at a time.
+
+        -> Coalescing.
+            An intent that has not been sent yet is replaced by a newer one for the same key (only the latest price is
+            sent), a cancel drops an unsent place. Placing over an open order is sent as a single cancel-replace (SPOT).
+
+        -> Budgets.
+            Request weight (per minute) and order counts (per 10s/day) are held under the exchange limits and synced
+            from the X-MBX-USED-WEIGHT-1M/X-MBX-ORDER-COUNT-* headers, a 429/418 backs every budget off.
+            The request weight budget can be shared (weight_limiter) with the other REST users such as the order books.
+
+        -> Connections.
+            Each worker signs and sends its requests over its own keep-alive session.
+        '''
+        self.public_key = public_key
+        self.private_key = private_key
+        self.rest_url = rest_url
+        self.workers = workers
+
+        self.weight_limiter = weight_limiter if weight_limiter != None else candle_puller.WeightLimiter(weight_limit)
+        self.order_limiters = {
+            '10S':candle_puller.WeightLimiter(order_limit_10s, interval=10),
+            '1D':candle_puller.WeightLimiter(order_limit_day, interval=86400)}
+
+        ## Unsent intents in the order they were first queued, keys being sent and the last order placed per key.
+        self.pending = {}
+        self.in_flight = set()
+        self.open_orders = {}
+
+        self.condition = threading.Condition()
+        self.local = threading.local()
+        self.threads = []
+        self.running = False
+
+
+    def set_rate_limits(self, rate_limits):
+        ''' Use the exchange info rateLimits for the budgets. '''
+        for rate_limit in rate_limits:
+            seconds = INTERVAL_SECONDS[rate_limit['interval']]*rate_limit['intervalNum']
+
+            if rate_limit['rateLimitType'] == 'REQUEST_WEIGHT' and seconds == 60:
+                self.weight_limiter.set_limit(rate_limit['limit'])
+            elif rate_limit['rateLimitType'] == 'ORDERS' and seconds == 10:
+                self.order_limiters['10S'].set_limit(rate_limit['limit'])
+            elif rate_limit['rateLimitType'] == 'ORDERS' and seconds == 86400:
+                self.order_limiters['1D'].set_limit(rate_limit['limit'])
+
+
+    def start(self):
+        self.running = True
+        for index in range(self.workers):
+            thread = threading.Thread(target=self._worker, name='order-gateway-{0}'.format(index))
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+
+
+    def stop(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+
+
+    def submit(self, key, market_type, params, cancel_order_id=None, before_send=None):
+        '''
+        Queue an order (params are the exchange order params: symbol, side, type, quantity, ...).
+        cancel_order_id is the open order it replaces. before_send is called by the worker just before the order is
+        sent (e.g. to borrow for a short), it is not called for an intent that is replaced or dropped first and if it
+        raises the order is not sent. Returns a Future for the new order response.
+        '''
+        future = Future()
+
+        with self.condition:
+            last_intent = self.pending.get(key)
+
+            if last_intent != None:
+                ## Coalesce, the unsent intent is replaced but still has to cancel the order it was going to.
+                last_intent['future'].cancel()
+                if cancel_order_id == None:
+                    cancel_order_id = last_intent['cancel_order_id']
+
+            self.pending[key] = {
+                'action':'PLACE',
+                'market_type':market_type,
+                'params':params,
+                'cancel_order_id':cancel_order_id,
+                'follows_in_flight':key in self.in_flight,
+                'before_send':before_send,
+                'future':future}
+            self.condition.notify()
+
+        return(future)
+
+
+    def cancel(self, key, market_type, symbol, order_id):
+        ''' Queue a cancel, an unsent place for the key is dropped instead (cancelling what it would have replaced). '''
+        future = Future()
+
+        with self.condition:
+            last_intent = self.pending.get(key)
+            follows_in_flight = key in self.in_flight
+
+            if last_intent != None:
+                last_intent['future'].cancel()
+                if order_id == None:
+                    order_id = last_intent['cancel_order_id']
+                follows_in_flight = follows_in_flight or last_intent['follows_in_flight']
+
+            if order_id == None and not follows_in_flight:
+                self.pending.pop(key, None)
+                future.set_result(None)
+                return(future)
+
+            self.pending[key] = {
+                'action':'CANCEL',
+                'market_type':market_type,
+                'params':{'symbol':symbol},
+                'cancel_order_id':order_id,
+                'follows_in_flight':follows_in_flight,
+                'before_send':None,
+                'future':future}
+            self.condition.notify()
+
+        return(future)
+
+
+    def _worker(self):
+        while True:
+            with self.condition:
+                intent = None
+                while self.running:
+                    for key in self.pending:
+                        if not key in self.in_flight:
+                            intent = self.pending.pop(key)
+                            break
+                    if intent != None:
+                        break
+                    self.condition.wait()
+
+                if intent == None:
+                    return
+
+                self.in_flight.add(key)
+
+                ## The intent was queued behind one that has now been sent, replace whatever order that placed.
+                if intent['follows_in_flight']:
+                    intent['cancel_order_id'] = self.open_orders.get(key)
+
+            try:
+                if intent['before_send'] != None:
+                    intent['before_send']()
+                result = self._send(intent)
+            except Exception as error:
+                result = None
+                logging.warning('[OrderGateway] {0} {1} failed: {2}'.format(key, intent['action'], error))
+                intent['future'].set_exception(error)
+            else:
+                intent['future'].set_result(result)
+
+            with self.condition:
+                if intent['action'] == 'PLACE' and result:
+                    self.open_orders[key] = result['orderId']
+                elif intent['action'] == 'CANCEL' or intent['cancel_order_id'] != None:
+                    self.open_orders.pop(key, None)
+
+                self.in_flight.discard(key)
+                self.condition.notify_all()
+
+
+    def _send(self, intent):
+        market_type = intent['market_type']
+        order_path = ORDER_PATHS[market_type]
+        cancel_order_id = intent['cancel_order_id']
+
+        if intent['action'] == 'CANCEL':
+            if cancel_order_id == None:
+                return(None)
+            return(self._request('DELETE', order_path, dict(intent['params'], orderId=cancel_order_id), CANCEL_WEIGHT, False))
+
+        if cancel_order_id == None:
+            return(self._request('POST', order_path, intent['params'], ORDER_WEIGHT, True))
+
+        if market_type == 'SPOT':
+            params = dict(intent['params'], cancelOrderId=cancel_order_id, cancelReplaceMode='STOP_ON_FAILURE')
+            return(self._request('POST', CANCEL_REPLACE_PATH, params, ORDER_WEIGHT, True)['newOrderResponse'])
+
+        ## If the cancel fails (the order filled) nothing new is placed, the same as STOP_ON_FAILURE.
+        self._request('DELETE', order_path, {'symbol':intent['params']['symbol'], 'orderId':cancel_order_id}, CANCEL_WEIGHT, False)
+        return(self._request('POST', order_path, intent['params'], ORDER_WEIGHT, True))
+
+
+    def _session(self):
+        ''' Keep-alive session per worker thread. '''
+        if not hasattr(self.local, 'session'):
+            self.local.session = requests.Session()
+            self.local.session.headers.update({'X-MBX-APIKEY':self.public_key})
+        return(self.local.session)
+
+
+    def _request(self, method, path, params, weight, is_order):
+        while True:
+            self.weight_limiter.acquire(weight)
+            if is_order:
+                for limiter in self.order_limiters.values():
+                    limiter.acquire(1)
+
+            query = dict((name, format_param(value)) for name, value in params.items())
+            query.update({'recvWindow':RECV_WINDOW, 'timestamp':int(time.time()*1000)})
+            query_string = urlencode(query)
+            signature = hmac.new(self.private_key.encode('utf-8'), query_string.encode('utf-8'), hashlib.sha256).hexdigest()
+
+            response = self._session().request(method, '{0}{1}?{2}&signature={3}'.format(self.rest_url, path, query_string, signature), timeout=10)
+            self._sync_limits(response.headers)
+
+            if response.status_code in (418, 429):
+                retry_after = int(response.headers.get('Retry-After', 60))
+                logging.warning('[OrderGateway] Rate limited, backing off for {0}s.'.format(retry_after))
+                self.weight_limiter.back_off(retry_after)
+                for limiter in self.order_limiters.values():
+                    limiter.back_off(retry_after)
+                continue
+
+            if response.status_code >= 400:
+                try:
+                    error = response.json()
+                    message = '{0} {1}'.format(error.get('code'), error.get('msg'))
+                except ValueError:
+                    message = response.text
+                raise requests.HTTPError('{0} {1}: {2}'.format(response.status_code, path, message), response=response)
+
+            return(response.json())
+
+
+    def _sync_limits(self, headers):
+        if 'X-MBX-USED-WEIGHT-1M' in headers:
+            self.weight_limiter.sync(int(headers['X-MBX-USED-WEIGHT-1M']))
+        if 'X-MBX-ORDER-COUNT-10S' in headers:
+            self.order_limiters['10S'].sync(int(headers['X-MBX-ORDER-COUNT-10S']))
+        if 'X-MBX-ORDER-COUNT-1D' in headers:
+            self.order_limiters['1D'].sync(int(headers['X-MBX-ORDER-COUNT-1D']))
@@ -0,0 +1,174 @@
+#! /usr/bin/env python3
+
+'''
+profiler
+
+'''
+import os
+import sys
+import time
+import logging
+import threading
+
+from . import trader
+
+
+## Default and max profiling time in seconds.
+DEFAULT_DURATION = 30
+MAX_DURATION = 600
+
+## Default seconds between samples (100Hz) and the fastest allowed.
+DEFAULT_INTERVAL = 0.01
+MIN_INTERVAL = 0.001
+
+## Files whose functions only block (a thread with one of these as its leaf frame is idle).
+IDLE_FILES = ['threading.py', 'selectors.py', 'queue.py', 'socket.py', 'ssl.py']
+
+
+class SamplingProfiler(object):
+
+    def __init__(self):
+        '''
+        Sampling profiler that can be started/stopped while the bot is running.
+
+        -> Sampling.
+            A background thread reads the stack of every other thread (sys._current_frames) each interval, nothing
+            is hooked into the traders so they run as normal (and at full speed when it is not running).
+
+        -> Attribution.
+            Stacks that pass through BaseTrader.run_iteration are put under that trader's print_pair, so trader
+            threads, scheduler workers and async executor threads are all attributed to the market they are running.
+            Other stacks are put under their thread name.
+
+        -> Output.
+            Collapsed stacks ('root;frame;frame count' per line, root first) as used by flamegraph.pl/speedscope.
+        '''
+        self.trader_code = trader.BaseTrader.run_iteration.__code__
+
+        self.counts = {}
+        self.samples = 0
+        self.frame_names = {}
+
+        self.start_time = None
+        self.stop_time = None
+        self.duration = None
+        self.interval = None
+        self.include_idle = False
+
+        self.thread = None
+        self.stop_event = threading.Event()
+        self.lock = threading.Lock()
+
+
+    def start(self, duration=DEFAULT_DURATION, interval=DEFAULT_INTERVAL, include_idle=False):
+        ''' Start a new profile (clearing the last one), returns False if one is already running. '''
+        with self.lock:
+            if self.is_running():
+                return(False)
+
+            self.counts = {}
+            self.samples = 0
+            self.duration = min(float(duration), MAX_DURATION)
+            self.interval = max(float(interval), MIN_INTERVAL)
+            self.include_idle = include_idle
+            self.start_time = time.time()
+            self.stop_time = None
+
+            self.stop_event.clear()
+            self.thread = threading.Thread(target=self._run, name='sampling-profiler')
+            self.thread.daemon = True
+            self.thread.start()
+
+        logging.info('[SamplingProfiler] Profiling for {0}s every {1}s.'.format(self.duration, self.interval))
+        return(True)
+
+
+    def stop(self):
+        ''' Stop the running profile early (the samples so far are kept). '''
+        self.stop_event.set()
+        if self.thread != None:
+            self.thread.join()
+
+
+    def is_running(self):
+        return(self.thread != None and self.thread.is_alive())
+
+
+    def _run(self):
+        end_time = time.time()+self.duration
+
+        while time.time() < end_time and not self.stop_event.is_set():
+            self._sample()
+            self.stop_event.wait(self.interval)
+
+        self.stop_time = time.time()
+        logging.info('[SamplingProfiler] Finished after {0} samples.'.format(self.samples))
+
+
+    def _frame_name(self, code):
+        name = self.frame_names.get(code)
+        if name == None:
+            name = self.frame_names[code] = '{0}:{1}'.format(os.path.basename(code.co_filename), code.co_name)
+        return(name)
+
+
+    def _sample(self):
+        own_ident = threading.get_ident()
+        thread_names = {thread_.ident:thread_.name for thread_ in threading.enumerate()}
+
+        for ident, frame in sys._current_frames().items():
+            if ident == own_ident:
+                continue
+
+            if not self.include_idle and os.path.basename(frame.f_code.co_filename) in IDLE_FILES:
+                continue
+
+            stack = []
+            root = None
+
+            while frame != None:
+                code = frame.f_code
+                if code is self.trader_code and root == None:
+                    trader_ = frame.f_locals.get('self')
+                    if trader_ != None:
+                        root = trader_.print_pair
+                stack.append(self._frame_name(code))
+                frame = frame.f_back
+
+            stack.append(root if root != None else thread_names.get(ident, str(ident)))
+            stack.reverse()
+
+            key = ';'.join(stack)
+            self.counts[key] = self.counts.get(key, 0)+1
+
+        self.samples += 1
+
+
+    def collapsed(self, market=None):
+        ''' The samples as collapsed stacks, only those of one market if given. '''
+        counts = dict(self.counts)
+        lines = []
+
+        for stack, count in sorted(counts.items(), key=lambda item: -item[1]):
+            if market != None and stack.split(';', 1)[0] != market:
+                continue
+            lines.append('{0} {1}'.format(stack, count))
+
+        return('\n'.join(lines)+('\n' if lines else ''))
+
+
+    def get_status(self):
+        ''' Profile state and the sample count per root (market or thread). '''
+        roots = {}
+        for stack, count in list(self.counts.items()):
+            root = stack.split(';', 1)[0]
+            roots[root] = roots.get(root, 0)+count
+
+        return({
+            'running':self.is_running(),
+            'start_time':self.start_time,
+            'stop_time':self.stop_time,
+            'duration':self.duration,
+            'interval':self.interval,
+            'samples':self.samples,
+            'roots':roots})
@@ -0,0 +1,167 @@
+#! /usr/bin/env python3
+
+'''
+publisher
+
+'''
+import json
+import time
+import logging
+import threading
+
+
+## All dashboard clients are put in this room so each update is a single emit.
+DASHBOARD_ROOM = 'dashboard'
+
+## Default seconds between dashboard updates.
+DEFAULT_PUSH_INTERVAL = 0.25
+
+## Trader data fields that are only ever appended to (and trimmed from the front), only the new items are sent for these.
+APPEND_FIELDS = ['trade_record']
+
+
+def appended_items(items, last_items):
+    '''
+    Items added to an append only list since it was last seen as last_items (a copy), found by looking for the
+    last seen item from the end. Returns None if it can no longer be found (the list was replaced).
+    '''
+    if not last_items:
+        return(list(items))
+
+    last_item = last_items[-1]
+    for index in range(len(items)-1, -1, -1):
+        if items[index] is last_item:
+            return(items[index+1:])
+    return(None)
+
+
+class TraderPublisher(object):
+
+    def __init__(self, socket_io, get_traders, push_interval=DEFAULT_PUSH_INTERVAL, room=DASHBOARD_ROOM):
+        '''
+        Pushes trader data to the dashboard clients from a single publisher.
+
+        -> Each trader has a version that goes up by one every time one of its fields changes.
+        -> Updates are coalesced to one emit per push interval to the dashboard room holding only the
+            changed fields of the changed traders (and only the new items of append only fields).
+        -> New clients get a full snapshot, if a client sees a version gap it asks for a resync.
+
+        The cost of a push does not depend on how many clients are connected.
+        '''
+        self.socket_io = socket_io
+        self.get_traders = get_traders
+        self.push_interval = push_interval
+        self.room = room
+
+        ## Last published state per market {'version':n, 'fields':{name:json}, 'lists':{name:(list id, copy)}}.
+        self.traders_state = {}
+
+        self.lock = threading.Lock()
+        self.state = 'READY'
+
+
+    def start(self):
+        logging.info('[TraderPublisher] Pushing dashboard updates every {0}s.'.format(self.push_interval))
+        self.state = 'RUN'
+        threading.Thread(target=self._publisher, name='dashboard-publisher', daemon=True).start()
+
+
+    def stop(self):
+        self.state = 'STOP'
+
+
+    def _publisher(self):
+        while self.state != 'STOP':
+            time.sleep(self.push_interval)
+
+            try:
+                self.publish()
+            except Exception as error:
+                logging.exception('[TraderPublisher] Push failed: {0}'.format(error))
+
+
+    def publish(self):
+        ''' Emit the changes since the last publish to the dashboard room, returns the number of changed traders. '''
+        with self.lock:
+            deltas = self._collect()
+
+            if deltas:
+                self.socket_io.emit('traders_delta', {'traders':deltas}, room=self.room)
+
+        return(len(deltas))
+
+
+    def _collect(self):
+        ''' Diff every trader against its last published state, returns {market:delta} for the changed traders. '''
+        deltas = {}
+
+        for trader_ in self.get_traders():
+            data = trader_.get_trader_data()
+            market = data['market']
+
+            if not market in self.traders_state:
+                self.traders_state.update({market:{'version':0, 'fields':{}, 'lists':{}}})
+            state = self.traders_state[market]
+
+            changed = {}
+            appended = {}
+
+            for name, value in data.items():
+                if name in APPEND_FIELDS:
+                    last_id, last_items = state['lists'].get(name, (None, None))
+
+                    ## Unchanged (same list, same length and same last item).
+                    if id(value) == last_id and len(value) == len(last_items) and (not value or value[-1] is last_items[-1]):
+                        continue
+
+                    items = list(value)
+                    new_items = appended_items(items, last_items) if id(value) == last_id else None
+
+                    if new_items == None:
+                        ## Replaced list, send it in full.
+                        changed.update({name:items})
+                    elif new_items:
+                        appended.update({name:new_items})
+
+                    state['lists'].update({name:(id(value), items)})
+                    continue
+
+                serialised = json.dumps(value, sort_keys=True, default=str)
+                if state['fields'].get(name) != serialised:
+                    state['fields'].update({name:serialised})
+                    changed.update({name:json.loads(serialised)})
+
+            if changed or appended:
+                state['version'] += 1
+                deltas.update({market:{'version':state['version'], 'changed':changed, 'appended':appended}})
+
+        return(deltas)
+
+
+    def _snapshot(self):
+        ''' Full trader data matching the published versions. '''
+        traders = {}
+
+        for market, state in self.traders_state.items():
+            data = {name:json.loads(serialised) for name, serialised in state['fields'].items()}
+            for name, (list_id, items) in state['lists'].items():
+                data.update({name:items})
+            traders.update({market:{'version':state['version'], 'data':data}})
+
+        return(traders)
+
+
+    def send_snapshot(self, sid, join=True):
+        '''
+        Send a client the full trader data and (optionally) add it to the dashboard room.
+        Pending changes are published first and the lock is held throughout so the client is in step with the next delta.
+        '''
+        with self.lock:
+            deltas = self._collect()
+            if deltas:
+                self.socket_io.emit('traders_delta', {'traders':deltas}, room=self.room)
+
+            self.socket_io.emit('current_traders_data', {'traders':self._snapshot()}, room=sid)
+
+            if join:
+                self.socket_io.server.enter_room(sid, self.room, namespace='/')
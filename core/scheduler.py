@@ -0,0 +1,165 @@
+#! /usr/bin/env python3
+
+'''
+scheduler
+
+'''
+import time
+import logging
+import threading
+from collections import deque
+
+
+## Default number of worker threads evaluating traders.
+DEFAULT_WORKERS = 4
+
+## Traders are re-run after this many seconds without new data (for timed conditions).
+DEFAULT_IDLE_TIMEOUT = 5
+
+
+class TraderScheduler(object):
+
+    def __init__(self, workers=DEFAULT_WORKERS, idle_timeout=DEFAULT_IDLE_TIMEOUT):
+        '''
+        Runs trader passes (BaseTrader.run_iteration) on a small fixed pool of worker threads.
+
+        -> Markets are only queued when they have new data (or have been idle for idle_timeout).
+        -> The ready queue is FIFO and a market is never queued or running more than once, new data
+            for a running market re-queues it at the back, so a slow strategy can only ever hold one
+            worker and cannot starve the other markets.
+        '''
+        self.workers = workers
+        self.idle_timeout = idle_timeout
+
+        self.traders = {}
+        self.ready = deque()
+        self.queued = set()
+        self.running = set()
+        self.rerun = set()
+
+        self.stats = {}
+        self.queued_at = {}
+
+        self.condition = threading.Condition()
+        self.state = 'READY'
+
+
+    def add_trader(self, trader_):
+        symbol = trader_.base_asset+trader_.quote_asset
+
+        with self.condition:
+            self.traders.update({symbol:trader_})
+            self.stats.update({symbol:{
+                'market':trader_.print_pair,
+                'runs':0,
+                'total_ms':0.0,
+                'last_ms':0.0,
+                'max_ms':0.0,
+                'max_wait_ms':0.0,
+                'last_run':0,
+                'errors':0}})
+
+        self.schedule(symbol)
+
+
+    def on_update(self, symbol, kind, data):
+        ''' Notifier listener, queue the market for evaluation. '''
+        self.schedule(symbol)
+
+
+    def schedule(self, symbol):
+        with self.condition:
+            if not symbol in self.traders:
+                return
+
+            if symbol in self.running:
+                self.rerun.add(symbol)
+            elif not symbol in self.queued:
+                self.queued.add(symbol)
+                self.queued_at.update({symbol:time.time()})
+                self.ready.append(symbol)
+                self.condition.notify()
+
+
+    def start(self):
+        logging.info('[TraderScheduler] Starting {0} workers for {1} traders.'.format(self.workers, len(self.traders)))
+        self.state = 'RUN'
+
+        for index in range(self.workers):
+            threading.Thread(target=self._worker, name='trader-worker-{0}'.format(index), daemon=True).start()
+
+        threading.Thread(target=self._idle_checker, name='trader-idle-checker', daemon=True).start()
+
+
+    def stop(self):
+        with self.condition:
+            self.state = 'STOP'
+            self.condition.notify_all()
+
+
+    def _worker(self):
+        while True:
+            with self.condition:
+                while not self.ready and self.state != 'STOP':
+                    self.condition.wait()
+
+                if self.state == 'STOP':
+                    return
+
+                symbol = self.ready.popleft()
+                self.queued.discard(symbol)
+                self.running.add(symbol)
+                wait_time = time.time()-self.queued_at[symbol]
+
+            trader_ = self.traders[symbol]
+            start_time = time.perf_counter()
+
+            try:
+                if trader_.state_data['runtime_state'] != 'STOP':
+                    trader_.run_iteration()
+            except Exception as error:
+                self.stats[symbol]['errors'] += 1
+                logging.exception('[TraderScheduler] {0} pass failed: {1}'.format(trader_.print_pair, error))
+
+            run_time = (time.perf_counter()-start_time)*1000
+
+            with self.condition:
+                stats = self.stats[symbol]
+                stats['runs'] += 1
+                stats['total_ms'] += run_time
+                stats['last_ms'] = run_time
+                stats['max_ms'] = max(stats['max_ms'], run_time)
+                stats['max_wait_ms'] = max(stats['max_wait_ms'], wait_time*1000)
+                stats['last_run'] = time.time()
+
+                self.running.discard(symbol)
+
+                ## Data that came in while running is picked up on a new pass at the back of the queue.
+                if symbol in self.rerun:
+                    self.rerun.discard(symbol)
+                    self.queued.add(symbol)
+                    self.queued_at.update({symbol:time.time()})
+                    self.ready.append(symbol)
+                    self.condition.notify()
+
+
+    def _idle_checker(self):
+        while self.state != 'STOP':
+            time.sleep(1)
+            now = time.time()
+
+            for symbol, stats in list(self.stats.items()):
+                if (now-stats['last_run']) > self.idle_timeout:
+                    self.schedule(symbol)
+
+
+    def get_stats(self):
+        ''' Per market timing (run counts, last/avg/max pass time and max time spent queued). '''
+        with self.condition:
+            stats = []
+            for symbol, market_stats in self.stats.items():
+                market_stats = dict(market_stats)
+                market_stats.update({'avg_ms':(market_stats['total_ms']/market_stats['runs']) if market_stats['runs'] else 0.0})
+                stats.append(market_stats)
+
+            return({'workers':self.workers, 'queued':len(self.ready), 'running':len(self.running), 'markets':stats})
@@ -0,0 +1,244 @@
+#! /usr/bin/env python3
+
+'''
+state_journal
+
+'''
+import os
+import json
+import time
+import logging
+import threading
+
+from .publisher import appended_items
+
+
+## Files kept in the cache dir.
+SNAPSHOT_FILE = 'traders_snapshot.json'
+JOURNAL_FILE = 'traders_journal.log'
+
+## Trader data fields that are persisted (what BotCore restores on start up).
+PERSIST_FIELDS = ['market', 'configuration', 'custom_conditions', 'long_position', 'short_position', 'trade_record', 'trade_stats', 'state_data']
+
+## Trader data fields that are only ever appended to (and trimmed from the front), only the new items are journaled for these.
+APPEND_FIELDS = ['trade_record']
+
+## The journal is compacted into a new snapshot once it is this big or this old (in seconds).
+DEFAULT_COMPACT_SIZE = 4*1024*1024
+DEFAULT_COMPACT_INTERVAL = 3600
+
+
+def json_default(value):
+    ''' Values json can not write (e.g. NumPy numbers from the candle arrays or sets) as plain lists/numbers, anything else as its string. '''
+    if hasattr(value, 'tolist'):
+        return(value.tolist())
+    if isinstance(value, (set, frozenset)):
+        return(list(value))
+    return(str(value))
+
+
+class StateJournal(object):
+
+    def __init__(self, state_dir, compact_size=DEFAULT_COMPACT_SIZE, compact_interval=DEFAULT_COMPACT_INTERVAL):
+        '''
+        Write ahead journal of trader state changes with periodic snapshot compaction.
+
+        -> Journal (append only).
+            Each entry is one json line {'seq', 'market', 'set':{field:value}, 'append':{field:[items]}} holding only
+            the fields that changed for a trader whose state_version has moved on since it was last written.
+
+        -> Snapshot.
+            The full state of every trader and the seq of the last journal entry it includes, written to a temp file
+            and swapped in so it is never half written. The journal is truncated after a snapshot.
+
+        -> Recovery.
+            Load the snapshot then replay the journal entries after its seq, a torn last line (crash mid write) is ignored.
+        '''
+        self.snapshot_path = '{0}{1}'.format(state_dir, SNAPSHOT_FILE)
+        self.journal_path = '{0}{1}'.format(state_dir, JOURNAL_FILE)
+        self.compact_size = compact_size
+        self.compact_interval = compact_interval
+
+        self.seq = 0
+        self.last_compact_time = time.time()
+
+        ## Last written state per market {'version':n, 'fields':{name:json}, 'lists':{name:(list id, copy)}}.
+        self.written = {}
+
+        self.journal_file = None
+        self.lock = threading.Lock()
+
+
+    def recover(self):
+        '''
+        Rebuild the trader data from the snapshot and journal tail.
+        Returns a list of trader data (same layout as BotCore.get_trader_data) or None if there is nothing saved.
+        '''
+        traders = {}
+        snapshot_seq = 0
+
+        if os.path.exists(self.snapshot_path):
+            with open(self.snapshot_path, 'r') as file:
+                snapshot = json.loads(file.read())
+            snapshot_seq = snapshot['seq']
+            traders = snapshot['traders']
+
+        self.seq = snapshot_seq
+        replayed = 0
+
+        if os.path.exists(self.journal_path):
+            good_size = 0
+
+            with open(self.journal_path, 'rb') as file:
+                for line in file:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        entry = None
+
+                    if entry == None or not line.endswith(b'\n'):
+                        logging.warning('[StateJournal] Dropping torn journal entry after seq {0}.'.format(self.seq))
+                        break
+                    good_size += len(line)
+
+                    if entry['seq'] <= snapshot_seq:
+                        continue
+
+                    trader_data = traders.setdefault(entry['market'], {'market':entry['market']})
+                    trader_data.update(entry['set'])
+                    for name, items in entry['append'].items():
+                        trader_data.setdefault(name, []).extend(items)
+
+                    self.seq = entry['seq']
+                    replayed += 1
+
+            ## Cut off the torn entry so new entries are not appended to it.
+            if good_size != os.path.getsize(self.journal_path):
+                with open(self.journal_path, 'r+b') as file:
+                    file.truncate(good_size)
+
+        if not traders:
+            return(None)
+
+        logging.info('[StateJournal] Recovered {0} traders (snapshot seq {1} + {2} journal entries).'.format(len(traders), snapshot_seq, replayed))
+        return(list(traders.values()))
+
+
+    def _open_journal(self):
+        if self.journal_file == None:
+            self.journal_file = open(self.journal_path, 'a')
+        return(self.journal_file)
+
+
+    def write_changes(self, traders):
+        ''' Journal the changed fields of any trader that has been marked dirty, returns the number of entries written. '''
+        with self.lock:
+            return(self._write_changes(traders))
+
+
+    def _write_changes(self, traders):
+        lines = []
+
+        for trader_ in traders:
+            version = trader_.state_version
+            market = trader_.print_pair
+
+            if market in self.written and self.written[market]['version'] == version:
+                continue
+
+            try:
+                entry = self._diff(market, version, trader_.get_trader_data())
+            except (RuntimeError, TypeError, ValueError) as error:
+                ## State changed mid read (or could not be written), it is still dirty so it is tried again next time.
+                logging.warning('[StateJournal] Skipped {0}: {1}'.format(market, error))
+                continue
+
+            if entry:
+                lines.append(entry)
+
+        if not lines:
+            return(0)
+
+        journal_file = self._open_journal()
+        journal_file.write(''.join(lines))
+        journal_file.flush()
+        os.fsync(journal_file.fileno())
+
+        return(len(lines))
+
+
+    def _diff(self, market, version, trader_data):
+        written = self.written.get(market, {'version':None, 'fields':{}, 'lists':{}})
+        fields = dict(written['fields'])
+        lists = dict(written['lists'])
+        set_fields = {}
+        append_fields = {}
+
+        for name in PERSIST_FIELDS:
+            if not name in trader_data:
+                continue
+            value = trader_data[name]
+
+            if name in APPEND_FIELDS:
+                last_id, last_items = lists.get(name, (None, None))
+                items = list(value)
+                new_items = appended_items(items, last_items) if id(value) == last_id else None
+
+                if new_items == None:
+                    set_fields.update({name:items})
+                elif new_items:
+                    append_fields.update({name:new_items})
+
+                lists.update({name:(id(value), items)})
+                continue
+
+            serialised = json.dumps(value, sort_keys=True, default=json_default)
+            if fields.get(name) != serialised:
+                fields.update({name:serialised})
+                set_fields.update({name:json.loads(serialised)})
+
+        line = None
+        if set_fields or append_fields:
+            self.seq += 1
+            line = json.dumps({'seq':self.seq, 'market':market, 'set':set_fields, 'append':append_fields}, default=json_default)+'\n'
+
+        self.written.update({market:{'version':version, 'fields':fields, 'lists':lists}})
+        return(line)
+
+
+    def needs_compaction(self):
+        if (time.time()-self.last_compact_time) > self.compact_interval:
+            return(True)
+        return(os.path.exists(self.journal_path) and os.path.getsize(self.journal_path) > self.compact_size)
+
+
+    def compact(self, traders):
+        '''
+        Write a full snapshot of the traders then truncate the journal.
+        The snapshot is built from the last written state so it lines up exactly with the journal seq.
+        '''
+        with self.lock:
+            self._write_changes(traders)
+
+            snapshot = {}
+            for market, written in self.written.items():
+                trader_data = {name:json.loads(serialised) for name, serialised in written['fields'].items()}
+                for name, (list_id, items) in written['lists'].items():
+                    trader_data.update({name:items})
+                snapshot.update({market:trader_data})
+
+            ## Entries up to seq are in the snapshot (anything journaled after is replayed on top of it).
+            temp_path = self.snapshot_path+'.tmp'
+            with open(temp_path, 'w') as file:
+                file.write(json.dumps({'seq':self.seq, 'time':int(time.time()), 'traders':snapshot}, default=json_default))
+                file.flush()
+                os.fsync(file.fileno())
+            os.replace(temp_path, self.snapshot_path)
+
+            if self.journal_file != None:
+                self.journal_file.close()
+            self.journal_file = open(self.journal_path, 'w')
+
+            self.last_compact_time = time.time()
+
+        logging.info('[StateJournal] Compacted {0} traders into a snapshot at seq {1}.'.format(len(traders), self.seq))
@@ -25,24 +25,75 @@ calls
 
 var xmlhttp = new XMLHttpRequest();
 
+// Current trader data {market:{'version':n, 'data':{...}}} kept in step with the server publisher.
+var traders = {};
+
+// Max items kept for append only fields (the trader only keeps its most recent trades).
+var max_recent_items = 1000;
+
 $(document).ready(function() {
 
+    // Full trader data (sent on connect and on resync).
     socket.on('current_traders_data', function(data) {
-        build_results_table(data);
+        traders = data['traders'];
+        build_results_table(traders);
+    });
+
+    // Only the changed fields of changed traders.
+    socket.on('traders_delta', function(data) {
+        if (merge_traders_delta(data['traders'])) {
+            build_results_table(traders);
+        }
     });
 });
 
 
-function build_results_table(data) {
+function merge_traders_delta(deltas) {
+    // Merge a delta into the trader data, returns false (and asks for a resync) if an update was missed.
+    for (var market in deltas) {
+        var delta = deltas[market];
+        var current = traders[market];
+
+        if (current == null) {
+            if (delta['version'] != 1) {
+                socket.emit('resync');
+                return false;
+            }
+            current = {'version':0, 'data':{}};
+            traders[market] = current;
+        }
+
+        // Already seen (sent just before the snapshot this client was given).
+        if (delta['version'] <= current['version']) {
+            continue;
+        }
+
+        if (delta['version'] != current['version']+1) {
+            socket.emit('resync');
+            return false;
+        }
+
+        for (var name in delta['changed']) {
+            current['data'][name] = delta['changed'][name];
+        }
+
+        for (var name in delta['appended']) {
+            current['data'][name] = current['data'][name].concat(delta['appended'][name]).slice(-max_recent_items);
+        }
+
+        current['version'] = delta['version'];
+    }
+    return true;
+}
+
+
+function build_results_table(tradersData) {
 
     var list = document.querySelector('#results-list');
 
     list.innerHTML = "";
 
-    outcome = data['data']['topData'];
-
-    currentTraders = data['data'];
-    console.log(currentTraders);
+    currentTraders = Object.keys(tradersData).sort().map(function(market) { return tradersData[market]['data']; });
 
     for (i = 0; i < (currentTraders.length); i++){
         row = document.createElement('tr');
@@ -85,22 +136,11 @@ function build_results_table(data) {
         buttonPause     = `<a href=# class="small-button amber-button" onclick="pause_trader(event, '${market_pair}');">Pause</a>`;
         buttonRemove    = `<a href=# class="small-button red-button" onclick="delete_trader(event, '${market_pair}');">Remove</a>`;
 
-        long_total = 0;
-        short_total = 0;
-        long_trades = 0;
-        short_trades = 0;
-
-        tlist = current['trade_record'];
-
-        for (x=0;x<tlist.length;x++){
-            if (tlist[x][5] == 'LONG'){
-                long_total += tlist[x][4]
-                long_trades +=1
-            } else {
-                short_total += tlist[x][4]
-                short_trades += 1
-            }
-        }
+        // Running totals kept by the trader (trade_record only holds the most recent trades).
+        long_total = current['trade_stats']['LONG']['outcome'];
+        short_total = current['trade_stats']['SHORT']['outcome'];
+        long_trades = current['trade_stats']['LONG']['trades'];
+        short_trades = current['trade_stats']['SHORT']['trades'];
 
         row.innerHTML   = `
             <td id="market-pair">${market_pair}</td>
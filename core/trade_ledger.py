@@ -0,0 +1,178 @@
+#! /usr/bin/env python3
+
+'''
+trade_ledger
+
+'''
+import logging
+import sqlite3
+import threading
+
+
+## Default file name for the ledger (kept in the logs dir).
+LEDGER_FILE = 'trades.db'
+
+## Buffered trades are written once there are this many (or when flush is called).
+DEFAULT_FLUSH_SIZE = 50
+
+## Max trades returned per page.
+MAX_PAGE_SIZE = 1000
+
+TRADE_COLUMNS = [
+    'id', 'symbol', 'market', 'position_type', 'market_type', 'run_type',
+    'buy_price', 'buy_time', 'sell_price', 'sell_time', 'quantity', 'fee', 'outcome',
+    'buy_description', 'sell_description']
+
+SCHEMA = [
+    '''CREATE TABLE IF NOT EXISTS trades (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        symbol TEXT NOT NULL,
+        market TEXT NOT NULL,
+        position_type TEXT NOT NULL,
+        market_type TEXT,
+        run_type TEXT,
+        buy_price REAL,
+        buy_time REAL,
+        sell_price REAL,
+        sell_time REAL NOT NULL,
+        quantity REAL,
+        fee REAL,
+        outcome REAL NOT NULL,
+        buy_description TEXT,
+        sell_description TEXT)''',
+    'CREATE INDEX IF NOT EXISTS trades_symbol_type_time ON trades (symbol, position_type, sell_time)',
+    'CREATE INDEX IF NOT EXISTS trades_type_time ON trades (position_type, sell_time)',
+    'CREATE INDEX IF NOT EXISTS trades_time ON trades (sell_time)']
+
+
+class TradeLedger(object):
+
+    def __init__(self, db_path, flush_size=DEFAULT_FLUSH_SIZE):
+        '''
+        SQLite ledger of completed trades (one row per buy/sell round trip, position_type is its side LONG/SHORT).
+
+        -> Buffered writes.
+            Traders only append to an in memory buffer, rows are inserted in one transaction when the
+            buffer is full or flush is called (BotCore flushes with each state save).
+
+        -> Indexed queries.
+            Symbol/position type/time are indexed so filtered pages and PnL sums are single index queries.
+        '''
+        self.db_path = db_path
+        self.flush_size = flush_size
+
+        self.buffer = []
+        self.lock = threading.Lock()
+
+        self.connection = sqlite3.connect(db_path, check_same_thread=False)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        for statement in SCHEMA:
+            self.connection.execute(statement)
+        self.connection.commit()
+
+
+    def record(self, trade):
+        ''' Buffer a completed trade {column:value} (missing columns are left null). '''
+        row = tuple(trade.get(column, None) for column in TRADE_COLUMNS[1:])
+
+        with self.lock:
+            self.buffer.append(row)
+            if len(self.buffer) >= self.flush_size:
+                self._flush()
+
+
+    def flush(self):
+        with self.lock:
+            self._flush()
+
+
+    def _flush(self):
+        if not self.buffer:
+            return
+
+        rows = self.buffer
+        self.buffer = []
+
+        try:
+            with self.connection:
+                self.connection.executemany(
+                    'INSERT INTO trades ({0}) VALUES ({1})'.format(', '.join(TRADE_COLUMNS[1:]), ', '.join('?'*len(rows[0]))),
+                    rows)
+        except sqlite3.Error as error:
+            ## Keep the rows so they are retried on the next flush.
+            self.buffer = rows+self.buffer
+            logging.error('[TradeLedger] Failed to write {0} trades: {1}'.format(len(rows), error))
+
+
+    def close(self):
+        with self.lock:
+            self._flush()
+            self.connection.close()
+
+
+    def _filters(self, symbol=None, position_type=None, start_time=None, end_time=None):
+        conditions = []
+        values = []
+
+        if symbol != None:
+            conditions.append('symbol = ?')
+            values.append(symbol)
+        if position_type != None:
+            conditions.append('position_type = ?')
+            values.append(position_type)
+        if start_time != None:
+            conditions.append('sell_time >= ?')
+            values.append(float(start_time))
+        if end_time != None:
+            conditions.append('sell_time < ?')
+            values.append(float(end_time))
+
+        return(conditions, values)
+
+
+    def query(self, symbol=None, position_type=None, start_time=None, end_time=None, before_id=None, limit=100):
+        '''
+        A page of trades, newest first.
+        Pages are keyed on the trade id, pass the returned next_id as before_id to get the following (older) page.
+        '''
+        limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+        conditions, values = self._filters(symbol, position_type, start_time, end_time)
+
+        if before_id != None:
+            conditions.append('id < ?')
+            values.append(int(before_id))
+
+        sql = 'SELECT {0} FROM trades{1} ORDER BY id DESC LIMIT ?'.format(
+            ', '.join(TRADE_COLUMNS),
+            (' WHERE '+' AND '.join(conditions)) if conditions else '')
+
+        with self.lock:
+            self._flush()
+            rows = self.connection.execute(sql, values+[limit]).fetchall()
+
+        trades = [dict(zip(TRADE_COLUMNS, row)) for row in rows]
+        next_id = trades[-1]['id'] if len(trades) == limit else None
+
+        return({'trades':trades, 'next_id':next_id})
+
+
+    def pnl(self, symbol=None, position_type=None, start_time=None, end_time=None):
+        ''' Trade count, wins and total outcome grouped by symbol and position type. '''
+        conditions, values = self._filters(symbol, position_type, start_time, end_time)
+
+        sql = '''SELECT symbol, position_type, COUNT(*), SUM(outcome > 0), SUM(outcome), MIN(sell_time), MAX(sell_time)
+            FROM trades{0} GROUP BY symbol, position_type'''.format((' WHERE '+' AND '.join(conditions)) if conditions else '')
+
+        with self.lock:
+            self._flush()
+            rows = self.connection.execute(sql, values).fetchall()
+
+        return([{
+            'symbol':row[0],
+            'position_type':row[1],
+            'trades':row[2],
+            'wins':row[3],
+            'outcome':row[4],
+            'first_time':row[5],
+            'last_time':row[6]} for row in rows])
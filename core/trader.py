@@ -6,16 +6,29 @@ trader
 '''
 import os
 import sys
+import copy
+import functools
 import time
+from concurrent import futures
 import logging
 import datetime
 import threading
 import trader_configuration as TC
 
+from . import indicator_engine
+from . import metrics
+
 
 ## Base commission fee with binance.
 COMMISION_FEE = 0.00075
 
+## Seconds a trader waits on the order gateway before leaving an order queued and carrying on.
+ORDER_WAIT = 2
+
+## Seconds between market data checks when a trader is started without a ready event, and between warnings while it waits.
+READY_POLL_INTERVAL = 0.1
+READY_WARN_TIME = 30
+
 ## Supported market.
 SUPPORTED_MARKETS = ['SPOT', 'MARKET']
 
@@ -49,7 +62,7 @@ TYPE_MARKET_EXTRA = {
 
 class BaseTrader(object):
 
-    def __init__(self, quote_asset, base_asset, rest_api, socket_api=None, data_if=None, logs_dir=None):
+    def __init__(self, quote_asset, base_asset, rest_api, socket_api=None, data_if=None, trade_ledger=None, notifier=None, candle_stores=None, trade_history=None, order_books=None, paper_engine=None, account_state=None, order_gateway=None, metrics_registry=None):
         '''
         Initilize the trader object and setup all the dataobjects that will be used by the trader object.
         '''
@@ -80,9 +93,44 @@ class BaseTrader(object):
             self.candle_enpoint = data_if.get_candle_data
             self.depth_endpoint = data_if.get_depth_data
 
-        ## Setup the default path for the trader by market beeing traded.
-        if logs_dir != None:
-            self.orders_log_path = '{0}order_{1}_log.txt'.format(logs_dir, symbol)
+        ## Clock used for trade times (replayed data can supply its own time).
+        if self.data_if and hasattr(self.data_if, 'get_time'):
+            self.clock = self.data_if.get_time
+        else:
+            self.clock = time.time
+
+        ## Read candles from the shared ring buffer store rather than the socket lists.
+        if candle_stores:
+            self.candle_enpoint = candle_stores.get_candles
+
+        ## Local order books (depth data and spread/imbalance/VWAP metrics), None uses the plain depth endpoint.
+        self.order_books = order_books
+        if order_books:
+            self.depth_endpoint = order_books.get_depth_data
+
+        ## Matching engine used to fill TEST orders against the depth (None fills them as soon as the last price reaches them).
+        self.paper_engine = paper_engine
+
+        ## Per stage timings (a no-op without a metrics registry) and the socket receive time of the data used this pass.
+        self.timer = metrics.StageTimer(metrics_registry, self.print_pair, symbol)
+        self.tick_time = None
+
+        ## Gateway real orders are queued through (None sends them directly with the rest api).
+        self.order_gateway = order_gateway
+
+        ## Gateway orders still queued when they were placed {(ptype, side):(future, order, rData, action)}.
+        self.pending_orders = {}
+
+        ## Account balances shared by all traders (kept up to date from the user data stream by BotCore).
+        self.account_state = account_state
+
+        ## Notifier used to block the trader until there is new market data (None falls back to polling).
+        self.notifier = notifier
+        if self.notifier:
+            self.notifier.register(symbol)
+
+        ## Ledger completed trades are recorded to (None for no ledger).
+        self.trade_ledger = trade_ledger
 
         ## Configuration settings are held here:
         self.configuration = {}
@@ -99,14 +147,24 @@ class BaseTrader(object):
         # Here the indicators are stored.
         self.indicators = {}
 
+        ## Incremental indicator engine (used if the configuration sets streamed indicators).
+        if getattr(TC, 'STREAM_INDICATORS', None):
+            self.indicator_engine = indicator_engine.IndicatorEngine(TC.STREAM_INDICATORS)
+        else:
+            self.indicator_engine = None
+
         ## Here long market activity is recorded:
         self.long_position = {}
 
         ## Here short market activity is recorded:
         self.short_position = {}
 
-        ## Here all buy/sell trades will be stored
+        ## Here the most recent buy/sell trades will be stored (all of them if trade_history is None, older trades are in the ledger).
         self.trade_recorder = []
+        self.trade_history = trade_history
+
+        ## Running totals over every trade (including those no longer in trade_recorder).
+        self.trade_stats = {ptype:{'trades':0, 'wins':0, 'outcome':0.0} for ptype in ['LONG', 'SHORT']}
 
         ## Data thats used to inform about the trader:
         self.state_data = {}
@@ -114,6 +172,16 @@ class BaseTrader(object):
         ## Market rules are set here:
         self.rules = {}
 
+        ## Position types traded and the account state version the wallets were last updated from:
+        self.position_types = []
+        self.last_wallet_version = 0
+
+        ## If passes should sleep (only when the trader polls the socket from its own thread).
+        self.poll_sleep = False
+
+        ## Goes up whenever persistent state changes (positions, trades, runtime state), used to journal only dirty traders.
+        self.state_version = 0
+
         logging.debug('[BaseTrader][{0}] Initilized trader object.'.format(self.print_pair))
 
 
@@ -155,16 +223,23 @@ class BaseTrader(object):
 
         self.rules.update(filters)
 
-        self.long_position.update(BASE_MARKET_LAYOUT)
+        if market_type == 'SPOT':
+            self.position_types = ['LONG']
+        elif market_type == 'MARGIN':
+            self.position_types = ['LONG', 'SHORT']
+
+        ## Deep copies so the nested order dicts are not shared between positions/traders.
+        self.long_position.update(copy.deepcopy(BASE_MARKET_LAYOUT))
 
         if market_type == 'MARGIN':
-            self.short_position.update(BASE_MARKET_LAYOUT, TYPE_MARKET_EXTRA)
+            self.short_position.update(copy.deepcopy(BASE_MARKET_LAYOUT))
+            self.short_position.update(TYPE_MARKET_EXTRA)
             self.long_position.update(TYPE_MARKET_EXTRA)
 
         logging.debug('[BaseTrader][{0}] Initilized trader attributes with data.'.format(self.print_pair))
 
 
-    def start(self, MAC, wallet_pair):
+    def start(self, MAC, wallet_pair, threaded=True, ready_event=None):
         '''
         Start the trader.
         Requires: MAC (Max Allowed Currency, the max amount the trader is allowed to trade with in BTC).
@@ -174,14 +249,22 @@ class BaseTrader(object):
         
         ->  Start the trader thread. 
             Once all is good the trader will then start the thread to allow for the market to be monitored.
+            If threaded is False no thread is started and the trader is stepped by calling run_iteration.
+
+        -> Wait for market data.
+            Live traders block until their market has candles and depth, on ready_event (set by BotCore when the data
+            arrives) if given otherwise by checking every READY_POLL_INTERVAL.
         '''
         logging.info('[BaseTrader][{0}] Starting the trader object.'.format(self.print_pair))
         sock_symbol = self.base_asset+self.quote_asset
 
         if self.socket_api != None:
-            while True:
-                if self.socket_api.get_live_candles(sock_symbol) and ('a' in self.socket_api.get_live_depths(sock_symbol)):
-                    break
+            wait_start = time.time()
+
+            while not (ready_event.wait(READY_WARN_TIME) if ready_event != None else self._wait_for_data()):
+                logging.warning('[BaseTrader][{0}] Still waiting for market data after {1:.0f}s.'.format(self.print_pair, time.time()-wait_start))
+
+            logging.debug('[BaseTrader][{0}] Market data ready after {1:.3f}s.'.format(self.print_pair, time.time()-wait_start))
 
         self.state_data['runtime_state'] = 'SETUP'
         self.wallet_pair = wallet_pair
@@ -190,10 +273,36 @@ class BaseTrader(object):
         self.long_position['currency_left'] = float(MAC)
         if self.short_position != {}:
             self.short_position['currency_left'] = float(MAC)
+        self.mark_dirty()
+
+        ## Book VWAPs are worked out for the size of the traders orders.
+        if self.order_books:
+            self.order_books.set_fill_size(sock_symbol, float(MAC))
 
         ## Start the main of the trader in a thread.
-        trader_thread = threading.Thread(target=self._main)
-        trader_thread.start()
+        self.poll_sleep = threaded and self.socket_api != None and self.notifier == None
+
+        if threaded:
+            trader_thread = threading.Thread(target=self._main)
+            trader_thread.start()
+        return(True)
+
+
+    def has_market_data(self):
+        ''' If the market has the candles and depth a pass needs. '''
+        sock_symbol = self.base_asset+self.quote_asset
+        depth = self.depth_endpoint(sock_symbol)
+        return(len(self.candle_enpoint(sock_symbol)) > 0 and bool(depth) and len(depth.get('a', [])) > 0)
+
+
+    def _wait_for_data(self):
+        ''' Check for market data for up to READY_WARN_TIME seconds, returns False if there is still none. '''
+        wait_start = time.time()
+
+        while not self.has_market_data():
+            if time.time()-wait_start > READY_WARN_TIME:
+                return(False)
+            time.sleep(READY_POLL_INTERVAL)
         return(True)
 
 
@@ -209,15 +318,17 @@ class BaseTrader(object):
         if self.long_position['order_type']['S'] == None:
             self.long_position['order_status']['B'] = 'FORCE_PREVENT_BUY'
 
-        if self.short_position['order_type']['S'] == None:
+        if self.short_position != {} and self.short_position['order_type']['S'] == None:
             self.short_position['order_status']['B'] = 'FORCE_PREVENT_BUY'
+        self.mark_dirty()
 
         while True:
-            if self.long_position['order_type']['S'] == None and self.short_position['order_type']['S'] == None:
+            if self.long_position['order_type']['S'] == None and (self.short_position == {} or self.short_position['order_type']['S'] == None):
                 break
             time.sleep(10)
 
         self.state_data['runtime_state'] = 'STOP'
+        self.mark_dirty()
         return(True)
 
 
@@ -238,87 +349,128 @@ class BaseTrader(object):
             Trader Manager is used to check the current conditions of the indicators then set orders if any can be PLACED.
         '''
         sock_symbol = self.base_asset+self.quote_asset
-        last_wallet_update_time = 0
-
-        if self.configuration['market_type'] == 'SPOT':
-            position_types = ['LONG']
-        elif self.configuration['market_type'] == 'MARGIN':
-            position_types = ['LONG', 'SHORT']
 
         while self.state_data['runtime_state'] != 'STOP':
-            ## Call the update function for the trader.
-            candles = self.candle_enpoint(sock_symbol)
-            books_data = self.depth_endpoint(sock_symbol)
-            indicators = TC.technical_indicators(candles)
-            self.indicators = indicators
-            logging.debug('[BaseTrader][{0}] Collected trader data.'.format(self.print_pair))
+            ## Block until the socket signals new data for this market.
+            if self.notifier and self.state_data['runtime_state'] != 'SETUP':
+                self.notifier.wait(sock_symbol)
 
-            if self.configuration['run_type'] == 'REAL':
-                socket_buffer_global = self.socket_api.socketBuffer
+            self.run_iteration()
 
-                if sock_symbol in self.socket_api.socketBuffer:
-                    socket_buffer_symbol = self.socket_api.socketBuffer[sock_symbol]
-                else:
-                    socket_buffer_symbol = None
 
-                ## Pull account balance data via the SPOT user data stream endpoint to update wallet pair information.
-                if 'outboundAccountInfo' in socket_buffer_global:
-                    if last_wallet_update_time != socket_buffer_global['outboundAccountInfo']['E']:
-                        self.wallet_pair, last_wallet_update_time = self.update_wallets(socket_buffer_global)
+    def run_iteration(self):
+        '''
+        Carry out a single pass of the trader (update data, manage orders and check conditions).
+        This is what the trader loop calls, it can also be called directly (e.g. by the backtester) to step the trader.
+        '''
+        sock_symbol = self.base_asset+self.quote_asset
+        iteration_start = stage_start = self.timer.begin()
+        self.tick_time = self.timer.tick_time()
+
+        ## Call the update function for the trader.
+        candles = self.candle_enpoint(sock_symbol)
+        books_data = self.depth_endpoint(sock_symbol)
+        stage_start = self.timer.observe('market_data', stage_start)
+
+        if self.indicator_engine:
+            indicators = self.indicator_engine.update(candles)
+        else:
+            indicators = TC.technical_indicators(candles)
+        self.indicators = indicators
+        stage_start = self.timer.observe('indicators', stage_start)
+        logging.debug('[BaseTrader][{0}] Collected trader data.'.format(self.print_pair))
+
+        if self.configuration['run_type'] == 'REAL':
+            if sock_symbol in self.socket_api.socketBuffer:
+                socket_buffer_symbol = self.socket_api.socketBuffer[sock_symbol]
             else:
                 socket_buffer_symbol = None
-                            
-            self.market_prices = {
-                'lastPrice':candles[0][4],
-                'askPrice':books_data['a'][0][0],
-                'bidPrice':books_data['b'][0][0]}
-
-            if not self.state_data['runtime_state'] in ['STANDBY', 'FORCE_STANDBY', 'FORCE_PAUSE', 'SETUP']:
-                ## Call for custom conditions that can be used for more advanced managemenet of the trader.
-
-                for ptype in position_types:
-                    self.custom_conditional_data, cp = TC.other_conditions(
-                        self.custom_conditional_data, 
-                        self.long_position if ptype == 'LONG' else self.short_position,
-                        ptype,
-                        candles,
-                        indicators, 
-                        self.configuration['symbol'],
-                        self.configuration['btc_base_pair'])
-
-                    ## logic to force only short or long to be activly traded, both with still monitor passivly tho.
-                    if self.configuration['trade_only_one'] and self.configuration['market_type'] == 'MARGIN':
-                        if (self.long_position['order_type']['B'] != 'WAIT' or self.long_position['order_type']['S'] != None) and ptype == 'SHORT':
-                            continue
-                        elif (self.short_position['order_type']['B'] != 'WAIT' or self.short_position['order_type']['S'] != None) and ptype == 'LONG':
-                            continue
-
-                    logging.debug('[BaseTrader][{0}] Checking for {1}'.format(self.print_pair, ptype))
-
-                    ## For managing active orders.
-                    if socket_buffer_symbol != None or self.configuration['run_type'] == 'TEST':
-                        cp = self._order_status_manager(ptype, cp, socket_buffer_symbol)
-
-                    ## For managing the placement of orders/condition checking.
-                    if cp['can_order'] == True:
-                        if self.state_data['runtime_state'] == 'RUN' and cp['market_status'] == 'TRADING':
-                            tm_data = self._trade_manager(ptype, cp, indicators, candles)
-                            cp = tm_data if tm_data else cp
-
-                    if not cp['market_status']: 
-                        cp['market_status'] = 'TRADING'
-
-                    if ptype == 'long': self.long_position = cp
-                    else: self.short_position = cp
 
+            ## Update the wallet pair from the shared account state when any balance has changed.
+            if self.last_wallet_version != self.account_state.version:
+                self.last_wallet_version = self.account_state.version
+                self.wallet_pair = self.account_state.get_wallet_pair(self.base_asset, self.quote_asset)
+        else:
+            socket_buffer_symbol = None
+                        
+        self.market_prices = {
+            'lastPrice':candles[0][4],
+            'askPrice':books_data['a'][0][0],
+            'bidPrice':books_data['b'][0][0]}
+
+        ## Book metrics (spread, midPrice, imbalance, buyVWAP, sellVWAP) are passed to the conditions with the prices.
+        if self.order_books:
+            self.market_prices.update(self.order_books.get_metrics(sock_symbol))
+
+        ## Let the matching engine fill any paper orders against the new depth/trades.
+        if self.paper_engine and self.configuration['run_type'] == 'TEST':
+            self.paper_engine.update(sock_symbol, books_data, candles[0], self.clock())
+
+        if not self.state_data['runtime_state'] in ['STANDBY', 'FORCE_STANDBY', 'FORCE_PAUSE', 'SETUP']:
+            ## Call for custom conditions that can be used for more advanced managemenet of the trader.
+
+            for ptype in self.position_types:
+                stage_start = self.timer.now()
+                cp = self.long_position if ptype == 'LONG' else self.short_position
+                self.custom_conditional_data, cp = TC.other_conditions(
+                    self.custom_conditional_data, 
+                    cp,
+                    ptype,
+                    candles,
+                    indicators, 
+                    self.configuration['symbol'],
+                    self.configuration['btc_base_pair'])
+                ## Conditions can change the state in place, the journal works out which fields changed when it saves.
+                self.mark_dirty()
+                stage_start = self.timer.observe('other_conditions', stage_start)
+
+                ## logic to force only short or long to be activly traded, both with still monitor passivly tho.
+                if self.configuration['trade_only_one'] and self.configuration['market_type'] == 'MARGIN':
+                    if (self.long_position['order_type']['B'] != 'WAIT' or self.long_position['order_type']['S'] != None) and ptype == 'SHORT':
+                        continue
+                    elif (self.short_position['order_type']['B'] != 'WAIT' or self.short_position['order_type']['S'] != None) and ptype == 'LONG':
+                        continue
+
+                logging.debug('[BaseTrader][{0}] Checking for {1}'.format(self.print_pair, ptype))
+
+                ## Pick up gateway orders that have been sent since the last pass.
+                if self.pending_orders:
+                    cp = self._check_pending_orders(ptype, cp)
+
+                ## For managing active orders.
+                if socket_buffer_symbol != None or self.configuration['run_type'] == 'TEST':
+                    cp = self._order_status_manager(ptype, cp, socket_buffer_symbol)
+                    self.timer.observe('order_status', stage_start)
+
+                ## For managing the placement of orders/condition checking.
+                if cp['can_order'] == True:
+                    if self.state_data['runtime_state'] == 'RUN' and cp['market_status'] == 'TRADING':
+                        tm_data = self._trade_manager(ptype, cp, indicators, candles)
+                        cp = tm_data if tm_data else cp
+
+                if not cp['market_status']: 
+                    cp['market_status'] = 'TRADING'
+                    self.mark_dirty()
+
+                if ptype == 'LONG': self.long_position = cp
+                else: self.short_position = cp
+
+                if self.poll_sleep:
                     time.sleep(.8)
 
-            current_localtime = time.localtime()
-            self.state_data['last_update_time'] = '{0}:{1}:{2}'.format(current_localtime[3], current_localtime[4], current_localtime[5])
+        elif self.poll_sleep:
+            ## Prevent paused/standby traders from spinning when polling.
+            time.sleep(1)
+
+        current_localtime = time.localtime(self.clock())
+        self.state_data['last_update_time'] = '{0}:{1}:{2}'.format(current_localtime[3], current_localtime[4], current_localtime[5])
+
+        if self.state_data['runtime_state'] == 'SETUP':
+            self.state_data['runtime_state'] = 'RUN'
+            self.mark_dirty()
+
+        self.timer.observe('iteration', iteration_start)
 
-            if self.state_data['runtime_state'] == 'SETUP':
-                self.state_data['runtime_state'] = 'RUN'
-        
 
     def _order_status_manager(self, ptype, cp, socket_buffer_symbol):
         '''
@@ -352,8 +504,8 @@ class BaseTrader(object):
                     if order_seen['i'] in all_mt_trades:
                         active_trade = True
         else:
-            # Basic update for test orders.
-            if cp['order_status']['B'] == 'PLACED' or cp['order_status']['S'] == 'PLACED':
+            # Basic update for test orders (LOCKED paper orders are part filled and still need checking).
+            if cp['order_status']['B'] in ['PLACED', 'LOCKED'] or cp['order_status']['S'] in ['PLACED', 'LOCKED']:
                 active_trade = True
                 order_seen = None
 
@@ -365,11 +517,12 @@ class BaseTrader(object):
         ## Monitor trade outcomes.
         if trade_done:
             print('Finished {0} trade for {1}'.format(side, self.print_pair))
+            self.mark_dirty()
 
             if side == 'BUY':
                 # Here all the necissary variables and values are added to signal a completion on a buy trade.
                 cp['tokens_holding'] = tokens_bought
-                cp['buy_time'] = time.time()
+                cp['buy_time'] = self.clock()
                 logging.info('[BaseTrader][{0}] Completed buy order.'.format(self.print_pair))
 
             elif side == 'SELL':
@@ -377,30 +530,40 @@ class BaseTrader(object):
                 tokens_holding = cp['tokens_holding']
                 fee = tokens_holding*COMMISION_FEE
 
-                sellTime = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(time.time()))
+                sellTime = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(self.clock()))
                 buyTime = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(cp['buy_time']))
 
                 if self.configuration['market_type']  == 'MARGIN':
                     if self.configuration['run_type'] == 'REAL' and cp['loan_cost'] != 0:
                         loan_repay_result = self.rest_api.repay_loan(asset=self.base_asset, amount=cp['loan_cost'])
+                        self.account_state.record_loan(self.base_asset, -cp['loan_cost'])
 
                 if self.rules['isFiat'] == True and self.rules['invFiatToBTC']:
                     outcome = float('{0:.8f}'.format(((cp['sell_price']-cp['buy_price'])*(tokens_holding/cp['sell_price']))))
                 else: 
                     outcome = float('{0:.8f}'.format(((cp['sell_price']-cp['buy_price'])*tokens_holding)))
 
-                print(self.orders_log_path)
-
-                if self.orders_log_path != None:
-                    with open(self.orders_log_path, 'a') as file:
-                        buyResp = 'marketType:{3}, Buy order, price: {0:.8f}, time: {1} [{2}] | '.format(cp['buy_price'], buyTime, cp['order_description']['B'], ptype)
-                        sellResp = 'Sell order, price: {0:.8f}, time: {1} [{2}], outcome: {3:.8f} [{4}]'.format(cp['sell_price'], sellTime, cp['order_description']['S'], outcome, self.configuration['symbol'])
-                        file.write(buyResp+sellResp+'\n')
-                        file.close()
-
-                self.trade_recorder.append([cp['buy_price'], buyTime, cp['sell_price'], sellTime, outcome, ptype])
+                cp['sell_time'] = self.clock()
+
+                if self.trade_ledger != None:
+                    self.trade_ledger.record({
+                        'symbol':self.configuration['symbol'],
+                        'market':self.print_pair,
+                        'position_type':ptype,
+                        'market_type':self.configuration['market_type'],
+                        'run_type':self.configuration['run_type'],
+                        'buy_price':cp['buy_price'],
+                        'buy_time':cp['buy_time'],
+                        'sell_price':cp['sell_price'],
+                        'sell_time':cp['sell_time'],
+                        'quantity':tokens_holding,
+                        'fee':fee,
+                        'outcome':outcome,
+                        'buy_description':cp['order_description']['B'],
+                        'sell_description':cp['order_description']['S']})
+
+                self._record_trade([cp['buy_price'], buyTime, cp['sell_price'], sellTime, outcome, ptype])
 
-                cp['sell_time'] = time.time()
                 cp['market_status'] = 'COMPLETE_TRADE'
                 logging.info('[BaseTrader][{0}] Completed sell order.'.format(self.print_pair))
             return(self._setup_market(side, cp))
@@ -415,7 +578,9 @@ class BaseTrader(object):
         if side == 'BUY':
             if self.configuration['run_type'] == 'REAL':
                 if order_seen['S'] == 'BUY' or (ptype == 'SHORT' and order_seen['S'] == 'SELL'):
-                    cp['buy_price'] = float(order_seen['L'])
+                    if cp['buy_price'] != float(order_seen['L']):
+                        cp['buy_price'] = float(order_seen['L'])
+                        self.mark_dirty()
 
                     if ptype == 'LONG':
                         target_wallet = self.base_asset
@@ -431,6 +596,13 @@ class BaseTrader(object):
                             tokens_bought = wallet_pair[self.base_asset][0]
                     elif order_seen['X'] == 'PARTIALLY_FILLED' and cp['order_status']['B'] != 'LOCKED':
                         cp['order_status']['B'] = 'LOCKED'
+                        self.mark_dirty()
+            elif self.paper_engine:
+                paper_order = self._check_paper_order('B', cp)
+                if paper_order:
+                    cp['buy_price'] = paper_order['avgPrice']
+                    trade_done = True
+                    tokens_bought = paper_order['executedQty']
             else:
                 if ptype == 'LONG':
                     if cp['buy_price'] <= self.market_prices['lastPrice']:
@@ -449,6 +621,14 @@ class BaseTrader(object):
                         trade_done = True
                     elif order_seen['X'] == 'PARTIALLY_FILLED' and cp['order_status']['S'] != 'LOCKED':
                         cp['order_status']['S'] = 'LOCKED'
+                        self.mark_dirty()
+            elif self.paper_engine:
+                paper_order = self._check_paper_order('S', cp)
+                if paper_order:
+                    cp['sell_price'] = paper_order['avgPrice']
+                    if paper_order['status'] != 'FILLED':
+                        cp['tokens_holding'] = paper_order['executedQty']
+                    trade_done = True
             else:
                 if ptype == 'LONG':
                     if cp['sell_price'] >= self.market_prices['lastPrice']:
@@ -459,6 +639,29 @@ class BaseTrader(object):
         return(cp, trade_done, tokens_bought)
 
 
+    def _check_paper_order(self, side_key, cp):
+        '''
+        Check a paper order with the matching engine, returns the order once it is done (filled, or cancelled with
+        some of it filled). Part filled MARKET orders have the rest cancelled and are done with what was filled.
+        '''
+        paper_order = self.paper_engine.get_order(cp['order_id'][side_key])
+
+        if paper_order == None or (paper_order['status'] == 'CANCELED' and not paper_order['executedQty']):
+            ## Not known to the engine (placed before a restart) or cancelled unfilled, let the conditions place it again.
+            cp['order_status'][side_key] = None
+            cp['order_type'][side_key] = 'WAIT'
+            self.mark_dirty()
+        elif paper_order['status'] in ['FILLED', 'CANCELED']:
+            return(paper_order)
+        elif paper_order['status'] == 'PARTIALLY_FILLED' and paper_order['type'] == 'MARKET':
+            self.paper_engine.cancel(paper_order['orderId'])
+            return(paper_order)
+        elif paper_order['status'] == 'PARTIALLY_FILLED' and cp['order_status'][side_key] != 'LOCKED':
+            cp['order_status'][side_key] = 'LOCKED'
+            self.mark_dirty()
+        return(None)
+
+
     def _trade_manager(self, ptype, cp, indicators, candles):
         ''' 
         Here both the sell and buy conditions are managed by the trader.
@@ -480,6 +683,7 @@ class BaseTrader(object):
             logging.debug('[BaseTrader][{0}] Checking for Sell condition.'.format(self.print_pair))
             exit_conditions = TC.long_exit_conditions if ptype == 'LONG' else TC.short_exit_conditions
 
+            stage_start = self.timer.now()
             new_order = exit_conditions(
                 self.custom_conditional_data,
                 cp,
@@ -488,6 +692,9 @@ class BaseTrader(object):
                 candles,
                 self.print_pair,
                 self.configuration['btc_base_pair'])
+            ## Conditions can change the state in place, the journal works out which fields changed when it saves.
+            self.mark_dirty()
+            self.timer.observe('exit_conditions', stage_start)
 
             if not(new_order):
                 return
@@ -496,7 +703,7 @@ class BaseTrader(object):
 
             if orderType != 'WAIT':
                 cp['order_description']['S'] = new_order['description']
-                if self.configuration['run_type'] == 'TEST' and new_order['ptype'] == 'MARKET':
+                if self.configuration['run_type'] == 'TEST' and new_order['ptype'] == 'MARKET' and not self.paper_engine:
                     updateOrder = True
                 elif 'price' in new_order:
                     if 'price' in new_order:
@@ -516,9 +723,10 @@ class BaseTrader(object):
                     order = new_order
                 elif orderType == 'WAIT':
                     # If WAIT is set then remove all orders and change order type to wait.
-                    self._cancel_order(cp['order_id']['S'])
+                    self._cancel_order(cp['order_id']['S'], ptype, 'S')
                     cp['order_status']['S'] = None
                     cp['order_type']['S'] = 'WAIT'
+                    self.mark_dirty()
                 else:
                     logging.critical('[BaseTrader][{0}] The order type [{1}] is not currently available.'.format(self.print_pair, orderType))
 
@@ -527,6 +735,7 @@ class BaseTrader(object):
             logging.debug('[BaseTrader][{0}] Checking for Buy condition.'.format(self.print_pair))
             entry_conditions = TC.long_entry_conditions if ptype == 'LONG' else TC.short_entry_conditions
 
+            stage_start = self.timer.now()
             new_order = entry_conditions(
                 self.custom_conditional_data,
                 cp,
@@ -535,6 +744,9 @@ class BaseTrader(object):
                 candles,
                 self.print_pair,
                 self.configuration['btc_base_pair'])
+            ## Conditions can change the state in place, the journal works out which fields changed when it saves.
+            self.mark_dirty()
+            self.timer.observe('entry_conditions', stage_start)
 
             if not(new_order):
                 return
@@ -545,13 +757,14 @@ class BaseTrader(object):
 
                 if cp['current_stage'] != stage and stage != 0:
                     cp['current_stage'] = stage
+                    self.mark_dirty()
                     print('Market {0} at type {1} is at stage {2}'.format(self.configuration['symbol'], ptype, str(stage)))
 
             orderType = new_order['order_type']
 
             if orderType != 'WAIT':
                 cp['order_description']['B'] = new_order['description']
-                if self.configuration['run_type'] == 'TEST' and new_order['ptype'] == 'MARKET':
+                if self.configuration['run_type'] == 'TEST' and new_order['ptype'] == 'MARKET' and not self.paper_engine:
                     updateOrder = True
                 elif 'price' in new_order:
                     if 'price' in new_order:
@@ -568,62 +781,78 @@ class BaseTrader(object):
                     order = new_order
                 elif orderType == 'WAIT':
                     # If WAIT is set then remove all orders and change order type to wait.
-                    self._cancel_order(cp['order_id']['B'])
+                    self._cancel_order(cp['order_id']['B'], ptype, 'B')
                     cp['order_status']['B'] = None
                     cp['order_type']['B'] = 'WAIT'
+                    self.mark_dirty()
                 else:
                     logging.critical('[BaseTrader][{0}] The order type [{1}] is not currently available.'.format(self.print_pair, orderType))
 
         ## Place Market Order.
         if order:
+            stage_start = self.timer.now()
             order_results = self._place_order(ptype, cp, order)
+            self.timer.observe('place_order', stage_start)
             logging.debug('order: {0}\norder result:\n{1}'.format(order, order_results))
 
             if order_results != None:
-                print(order_results)
-                order_results = order_results['data']
-                logging.info('[BaseTrader][{0}] Order placed for {1}.'.format(self.print_pair, orderType))
-                logging.debug('[BaseTrader][{0}] Order placement results:\n{1}'.format(self.print_pair, str(order_results)))
-
-                if 'type' in order_results:
-                    if order_results['type'] == 'MARKET':
-                        price1 = order_results['fills'][0]['price']
-                    else:
-                        price1 = order_results['price']
-                else: price1 = None
-
-                price2 = None
-                if 'price' in order:
-                    price2 = float(order['price'])
-                    if price1 == 0.0 or price1 == None: 
-                        order_price = price2
-                    else: order_price = price1
-                else: order_price = price1
+                cp = self._order_placed(ptype, cp, order, order_results)
+                logging.info('[BaseTrader][{0}] Update: {1}, type: {2}, status: {3}'.format(self.print_pair, updateOrder, orderType, cp['order_status']))
+            return(cp)
 
-                if order['side'] == 'BUY':
-                    cp['buy_price'] = order_price
 
-                    if self.configuration['run_type'] == 'REAL':
-                        cp['order_id']['B'] = order_results['orderId']
+    def _order_placed(self, ptype, cp, order, order_results):
+        ''' Update the position with the results of a placed order. '''
+        orderType = order['order_type']
 
-                        if self.configuration['market_type'] == 'MARGIN':
-                            if 'loan_id' in order_results:
-                                cp['load_id'] = order_results['load_id'] 
-                                cp['loan_cost'] = order_results['loan_cost']
-                    else:
-                        cp['tokens_holding'] = order_results['tester_quantity']
+        print(order_results)
+        order_results = order_results['data']
+        logging.info('[BaseTrader][{0}] Order placed for {1}.'.format(self.print_pair, orderType))
+        logging.debug('[BaseTrader][{0}] Order placement results:\n{1}'.format(self.print_pair, str(order_results)))
 
-                else:
-                    cp['sell_price'] = order_price
+        if 'type' in order_results:
+            if order_results['type'] == 'MARKET':
+                price1 = order_results['fills'][0]['price']
+            else:
+                price1 = order_results['price']
+        else: price1 = None
 
-                    if self.configuration['run_type'] == 'REAL':
-                        cp['order_id']['S'] = order_results['orderId']
+        price2 = None
+        if 'price' in order:
+            price2 = float(order['price'])
+            if price1 == 0.0 or price1 == None: 
+                order_price = price2
+            else: order_price = price1
+        else: order_price = price1
 
-                cp['order_type'][order['side'][0]] = orderType
-                cp['order_status'][order['side'][0]] = 'PLACED'
+        if order['side'] == 'BUY':
+            cp['buy_price'] = order_price
 
-                logging.info('[BaseTrader][{0}] Update: {1}, type: {2}, status: {3}'.format(self.print_pair, updateOrder, orderType, cp['order_status']))
-            return(cp)
+            if self.configuration['run_type'] == 'REAL':
+                cp['order_id']['B'] = order_results['orderId']
+
+                if self.configuration['market_type'] == 'MARGIN':
+                    if 'loan_id' in order_results:
+                        cp['load_id'] = order_results['load_id'] 
+                        cp['loan_cost'] = order_results['loan_cost']
+            else:
+                cp['tokens_holding'] = order_results['tester_quantity']
+                cp['order_id']['B'] = order_results.get('orderId')
+
+        else:
+            cp['sell_price'] = order_price
+
+            if self.configuration['run_type'] == 'REAL' or self.paper_engine:
+                cp['order_id']['S'] = order_results['orderId']
+
+        cp['order_type'][order['side'][0]] = orderType
+        cp['order_status'][order['side'][0]] = 'PLACED'
+        self.mark_dirty()
+
+        ## Socket receive of the data the order was placed on to the order being acknowledged.
+        self.timer.observe('tick_to_order', self.tick_time)
+
+        return(cp)
 
 
     def _place_order(self, ptype, cp, order):
@@ -638,9 +867,14 @@ class BaseTrader(object):
             if self.rules['isFiat']:
                 quantity = cp['currency_left']
             else:
-                quantity = float(cp['currency_left'])/float(self.market_prices['bidPrice'])
+                ## Market orders are sized from the VWAP to fill the order when there is a local book.
+                if order['ptype'] == 'MARKET' and self.market_prices.get('buyVWAP'):
+                    size_price = self.market_prices['buyVWAP']
+                else:
+                    size_price = self.market_prices['bidPrice']
+                quantity = float(cp['currency_left'])/float(size_price)
 
-            if self.configuration['run_type'] == 'REAL':
+            if (self.configuration['run_type'] == 'REAL' and not self.order_gateway) or self.paper_engine:
                 if cp['order_id']['B']:
                     print("order id:", cp['order_id']['B'])
                     cancel_order_results = self._cancel_order(cp['order_id']['B'])
@@ -659,14 +893,11 @@ class BaseTrader(object):
                 quantity = float(tokens_holding)
             elif ptype == 'SHORT':
                 if self.configuration['run_type'] == 'REAL':
-                    for asset in self.rest_api.get_account(api_type='MARGIN')['userAssets']:
-                        if asset['asset'] == self.base_asset:
-                            quantity = float(asset['borrowed'])+float(asset['interest'])
-                            break
+                    quantity = self.account_state.get_loan(self.base_asset)
                 else:
                     quantity = float(tokens_holding)
 
-            if self.configuration['run_type'] == 'REAL':
+            if (self.configuration['run_type'] == 'REAL' and not self.order_gateway) or self.paper_engine:
                 if cp['order_id']['S']:
                     print("order id:", cp['order_id']['S'])
                     self._cancel_order(cp['order_id']['S'])
@@ -681,14 +912,14 @@ class BaseTrader(object):
         ## Place orders for both SELL/BUY sides for both TEST/REAL run types.
         if self.configuration['run_type'] == 'REAL':
             rData = {}
+            loan_amount = None
             ## Convert BUY to SELL if the order is a short (for short orders are inverted)
             if ptype == 'LONG':
                 side = order['side']
             elif ptype == 'SHORT':
                 if order['side'] == 'BUY':
-                    ## Calculate the quantity required for a short loan.
-                    loan_get_result = self.rest_api.apply_for_loan(asset=self.base_asset, amount=quantity)
-                    rData.update({'loan_id':loan_get_result['tranId'], 'loan_cost':quantity})
+                    ## The quantity required for a short loan, borrowed when the order is sent.
+                    loan_amount = quantity
                     side = 'SELL'
                 else:
                     side = 'BUY'
@@ -700,13 +931,11 @@ class BaseTrader(object):
                     order['ptype'], 
                     quantity))
 
-                rData.update(self.rest_api.place_order(
-                    self.configuration['market_type'], 
+                return(self._send_order(ptype, cp, order, rData, 'PLACED_MARKET_ORDER', dict(
                     symbol=self.configuration['symbol'], 
                     side=side, 
                     type=order['ptype'], 
-                    quantity=quantity))
-                return({'action':'PLACED_MARKET_ORDER', 'data':rData})
+                    quantity=quantity), loan_amount))
 
             elif order['ptype'] == 'LIMIT':
                 logging.info('[BaseTrader][{0}]  side:{1}, type:{2}, quantity:{3} price:{4}'.format(
@@ -716,15 +945,13 @@ class BaseTrader(object):
                     quantity,
                     order['price']))
 
-                rData.update(self.rest_api.place_order(
-                    self.configuration['market_type'], 
+                return(self._send_order(ptype, cp, order, rData, 'PLACED_LIMIT_ORDER', dict(
                     symbol=self.configuration['symbol'], 
                     side=side, 
                     type=order['ptype'], 
                     timeInForce='GTC', 
                     quantity=quantity,
-                    price=order['price']))
-                return({'action':'PLACED_LIMIT_ORDER', 'data':rData})
+                    price=order['price']), loan_amount))
 
             elif order['ptype'] == 'STOP_LOSS_LIMIT':
                 logging.info('[BaseTrader][{0}] side:{1}, type:{2}, quantity:{3} price:{4}, stopPrice:{5}'.format(
@@ -735,16 +962,14 @@ class BaseTrader(object):
                     order['price'],
                     order['stopPrice']))
 
-                rData.update(self.rest_api.place_order(
-                    self.configuration['market_type'], 
+                return(self._send_order(ptype, cp, order, rData, 'PLACED_STOPLOSS_ORDER', dict(
                     symbol=self.configuration['symbol'], 
                     side=side, 
                     type=order['ptype'], 
                     timeInForce='GTC', 
                     quantity=quantity,
                     price=order['price'],
-                    stopPrice=order['price']))
-                return({'action':'PLACED_STOPLOSS_ORDER', 'data':rData})
+                    stopPrice=order['price']), loan_amount))
 
         else:
             if order['ptype'] == 'MARKET':
@@ -752,13 +977,117 @@ class BaseTrader(object):
             else:
                 price = order['price']
 
-            return({'action':'PLACED_TEST_ORDER', 'data':{'type':'test', 'price':price, 'tester_quantity':float(quantity)}})
+            test_data = {'type':'test', 'price':price, 'tester_quantity':float(quantity)}
 
+            if self.paper_engine:
+                ## Shorts are inverted on the exchange (same as real orders).
+                if ptype == 'LONG':
+                    side = order['side']
+                else:
+                    side = 'SELL' if order['side'] == 'BUY' else 'BUY'
+
+                test_data['orderId'] = self.paper_engine.submit(
+                    self.configuration['symbol'],
+                    side,
+                    order['ptype'],
+                    quantity,
+                    price=order.get('price'),
+                    stop_price=order.get('stopPrice'),
+                    now=self.clock())
 
-    def _cancel_order(self, order_id):
+            return({'action':'PLACED_TEST_ORDER', 'data':test_data})
+
+
+    def _send_order(self, ptype, cp, order, rData, action, params, loan_amount=None):
+        '''
+        Place a real order, through the order gateway (replacing the open order for the side in one request) when there is one.
+        loan_amount is borrowed just before the order is sent, so queued orders that are replaced or dropped never borrow.
+        '''
+        request_start = self.timer.now()
+        before_send = functools.partial(self._apply_for_loan, loan_amount, rData) if loan_amount else None
+
+        if not self.order_gateway:
+            if before_send:
+                before_send()
+                self._record_loan(rData)
+            rData.update(self.rest_api.place_order(self.configuration['market_type'], **params))
+            self.timer.observe('order_request', request_start)
+            return({'action':action, 'data':rData})
+
+        side_key = order['side'][0]
+
+        ## Any older queued order for the side is replaced by this one (and as the budget is in use, do not wait for it).
+        wait = 0 if self.pending_orders.pop((ptype, side_key), None) else ORDER_WAIT
+        future = self.order_gateway.submit(
+            (self.print_pair, ptype, side_key), 
+            self.configuration['market_type'], 
+            params, 
+            cancel_order_id=cp['order_id'][side_key],
+            before_send=before_send)
+
+        try:
+            result = future.result(timeout=wait)
+        except futures.TimeoutError:
+            ## Held back by the rate limits, the result is picked up on a later pass.
+            self.pending_orders.update({(ptype, side_key):(future, order, rData, action)})
+            return(None)
+        except Exception as error:
+            self._record_loan(rData)
+            logging.warning('[BaseTrader][{0}] Order failed: {1}'.format(self.print_pair, error))
+            return(None)
+
+        self._record_loan(rData)
+        rData.update(result)
+        self.timer.observe('order_request', request_start)
+        return({'action':action, 'data':rData})
+
+
+    def _apply_for_loan(self, amount, rData):
+        ''' Borrow for a short order (called as the order is sent). '''
+        loan_get_result = self.rest_api.apply_for_loan(asset=self.base_asset, amount=amount)
+        rData.update({'loan_id':loan_get_result['tranId'], 'loan_cost':amount})
+
+
+    def _record_loan(self, rData):
+        ''' Record a loan taken for an order once the order has been sent (even if it then failed the loan was still taken). '''
+        if 'loan_cost' in rData:
+            self.account_state.record_loan(self.base_asset, rData['loan_cost'])
+
+
+    def _check_pending_orders(self, ptype, cp):
+        ''' Apply the results of gateway orders that were still queued when the trader placed them. '''
+        for side_key in ['B', 'S']:
+            pending = self.pending_orders.get((ptype, side_key))
+            if pending == None or not pending[0].done():
+                continue
+
+            future, order, rData, action = self.pending_orders.pop((ptype, side_key))
+            if future.cancelled():
+                continue
+
+            try:
+                result = future.result()
+            except Exception as error:
+                self._record_loan(rData)
+                logging.warning('[BaseTrader][{0}] Order failed: {1}'.format(self.print_pair, error))
+                continue
+
+            self._record_loan(rData)
+            rData.update(result)
+
+            cp = self._order_placed(ptype, cp, order, {'action':action, 'data':rData})
+        return(cp)
+
+
+    def _cancel_order(self, order_id, ptype=None, side_key=None):
         ''' cancel orders '''
-        if self.configuration['run_type'] == 'REAL':
+        if self.configuration['run_type'] == 'REAL' and self.order_gateway:
+            self.pending_orders.pop((ptype, side_key), None)
+            result = self.order_gateway.cancel((self.print_pair, ptype, side_key), self.configuration['market_type'], self.configuration['symbol'], order_id)
+        elif self.configuration['run_type'] == 'REAL':
             result = self.rest_api.cancel_order(self.configuration['market_type'], symbol=self.configuration['symbol'], orderId=order_id)
+        elif self.paper_engine and order_id:
+            result = 'CANCELED_TEST_ORDER' if self.paper_engine.cancel(order_id) else 'UNKNOWN_TEST_ORDER'
         else: result = 'CANCELED_TEST_ORDER'
         logging.debug('[BaseTrader][{0}] Cancel order results:\n{1}'.format(self.print_pair, str(result)))
 
@@ -792,6 +1121,46 @@ class BaseTrader(object):
         return(self.indicators)
 
 
+    def _record_trade(self, trade):
+        ''' Add a completed trade to the recent trades and running totals. '''
+        stats = self.trade_stats[trade[5]]
+        stats['trades'] += 1
+        stats['outcome'] += trade[4]
+        if trade[4] > 0:
+            stats['wins'] += 1
+
+        self.trade_recorder.append(trade)
+
+        if self.trade_history != None and len(self.trade_recorder) > self.trade_history:
+            del self.trade_recorder[:len(self.trade_recorder)-self.trade_history]
+
+
+    def load_trades(self, trade_record, trade_stats=None):
+        '''
+        Restore saved trades, the running totals are rebuilt from the trades if they were saved 
+        before the totals were kept.
+        '''
+        if trade_stats:
+            self.trade_stats = trade_stats
+        else:
+            self.trade_stats = {ptype:{'trades':0, 'wins':0, 'outcome':0.0} for ptype in ['LONG', 'SHORT']}
+            for trade in trade_record:
+                stats = self.trade_stats[trade[5]]
+                stats['trades'] += 1
+                stats['outcome'] += trade[4]
+                if trade[4] > 0:
+                    stats['wins'] += 1
+
+        if self.trade_history != None:
+            trade_record = trade_record[-self.trade_history:] if self.trade_history else []
+        self.trade_recorder = trade_record
+
+
+    def mark_dirty(self):
+        ''' Flag that the persistent state has changed. '''
+        self.state_version += 1
+
+
     def get_trader_data(self):
         trader_data = {
             'market':self.print_pair,
@@ -801,6 +1170,7 @@ class BaseTrader(object):
             'custom_conditions':self.custom_conditional_data,
             'long_position':self.long_position,
             'trade_record':self.trade_recorder,
+            'trade_stats':self.trade_stats,
             'state_data':self.state_data,
             'rules':self.rules
         }
@@ -808,30 +1178,4 @@ class BaseTrader(object):
         if self.configuration['market_type'] == 'MARGIN':
             trader_data.update({'short_position':self.short_position})
 
-        return(trader_data)
-
-
-    def update_wallets(self, socket_buffer_global):
-        last_wallet_update_time = socket_buffer_global['outboundAccountInfo']['E']
-        foundBase = False
-        foundQuote = False
-        wallet_pair = {}
-
-        for wallet in socket_buffer_global['outboundAccountInfo']['B']:
-            if wallet['a'] == self.base_asset:
-                wallet_pair.update({self.base_asset:[float(wallet['f']), float(wallet['l'])]})
-                foundBase = True
-            elif wallet['a'] == self.quote_asset:
-                wallet_pair.update({self.quote_asset:[float(wallet['f']), float(wallet['l'])]})
-                foundQuote = True
-
-            if foundQuote and foundBase:
-                break
-
-        if not(foundBase):
-            wallet_pair.update({self.base_asset:[0.0, 0.0]})
-        if not(foundQuote):
-            wallet_pair.update({self.quote_asset:[0.0, 0.0]})
-
-        logging.info('[BaseTrader][{0}] New account data pulled, wallets updated.'.format(self.print_pair))
-        return(wallet_pair, last_wallet_update_time)
\ No newline at end of file
+        return(trader_data)
\ No newline at end of file
@@ -30,6 +30,56 @@ if __name__ == '__main__':
 
     if len(sys.argv) > 1:
         if sys.argv[1] == 'pullCandles':
-            botCore.pull_candles(cache_handler)
+            ## Usage: run.py pullCandles [days (default 365)] [rest url]
+            days = int(sys.argv[2]) if len(sys.argv) > 2 else 365
+            if len(sys.argv) > 3:
+                botCore.pull_candles(cache_handler, days=days, rest_url=sys.argv[3])
+            else:
+                botCore.pull_candles(cache_handler, days=days)
+
+        elif sys.argv[1] == 'backtest':
+            ## Usage: run.py backtest <market e.g. BTC-ETH> <candles file .npy/.json>
+            from core import backtester
+            settings = handler.settings_reader()
+            trade_ledger = backtester.run_backtest(
+                sys.argv[2], 
+                backtester.load_candles(sys.argv[3]), 
+                market_type=settings['market_type'], 
+                MAC=settings['trading_currency'], 
+                window=settings['max_candles'])
+            cache_handler.save_cache_file(trade_ledger, 'backtest_trades.json')
+            logger.info('Backtest summary: {0}'.format(backtester.summarise(trade_ledger)))
+
+        elif sys.argv[1] == 'optimize':
+            ## Usage: run.py optimize <space json file> (uses the pulled candles for the TRADING_MARKETS)
+            from core import optimizer
+            from core import candle_archive
+            settings = handler.settings_reader()
+            candle_paths = {}
+            for market in settings['trading_markets']:
+                quote_asset, base_asset = market.split('-')
+                candle_paths.update({market:candle_archive.archive_path('{0}candles/'.format(CACHE_DIR), base_asset+quote_asset, settings['trader_interval'])})
+
+            results = optimizer.run_from_file(
+                sys.argv[2], 
+                candle_paths, 
+                market_type=settings['market_type'], 
+                MAC=settings['trading_currency'], 
+                window=settings['max_candles'])
+            cache_handler.save_cache_file(results, 'optimizer_results.json')
+            logger.info('Optimizer results saved to {0}optimizer_results.json'.format(CACHE_DIR))
+
+        elif sys.argv[1] == 'loadTest':
+            ## Usage: run.py loadTest [scenario json file] (results are saved to cache/load_test.json)
+            from core import load_runner
+            exit_code = load_runner.main([sys.argv[2] if len(sys.argv) > 2 else None, '{0}load_test.json'.format(CACHE_DIR)])
+            ## The BotCore under test leaves its trader threads running.
+            sys.stdout.flush()
+            os._exit(exit_code)
+
+        elif sys.argv[1] == 'benchmark':
+            ## Usage: run.py benchmark [baseline results file] (results are saved to cache/benchmark.json)
+            from core import benchmark
+            sys.exit(benchmark.main(['{0}benchmark.json'.format(CACHE_DIR)]+sys.argv[2:3]))
     else:
         main()
\ No newline at end of file
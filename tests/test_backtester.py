@@ -0,0 +1,86 @@
+#! /usr/bin/env python3
+
+'''
+test_backtester
+
+'''
+import json
+import shutil
+import tempfile
+import unittest
+import numpy as np
+
+from core import candle_archive
+from core.indicators import bench
+
+## The backtester runs the trader which needs technical_indicators (via trader_configuration).
+try:
+    from core import backtester
+except ImportError:
+    backtester = None
+
+
+@unittest.skipIf(backtester == None, 'technical_indicators is not installed')
+class BacktesterTests(unittest.TestCase):
+
+    def setUp(self):
+        self.data_dir = tempfile.mkdtemp()+'/'
+        self.candles = np.array(bench.make_candles(800))[::-1].copy()
+
+
+    def tearDown(self):
+        shutil.rmtree(self.data_dir)
+
+
+    def test_load_candles_formats(self):
+        json_path = self.data_dir+'candles.json'
+        with open(json_path, 'w') as file:
+            file.write(json.dumps(self.candles[::-1].tolist()))
+
+        npy_path = self.data_dir+'candles.npy'
+        np.save(npy_path, self.candles)
+
+        bin_path = candle_archive.archive_path(self.data_dir, 'ETHBTC', '1m')
+        candle_archive.CandleArchive(bin_path).append(self.candles)
+
+        for file_path in [json_path, npy_path, bin_path]:
+            np.testing.assert_array_equal(backtester.load_candles(file_path), self.candles)
+
+
+    def test_replay_data_window(self):
+        data = backtester.ReplayData(self.candles, window=100, spread=0.01)
+
+        candles = data.get_candle_data('ETHBTC')
+        self.assertEqual(len(candles), 100)
+        self.assertEqual(candles[0][0], self.candles[99][0])
+
+        self.assertTrue(data.step())
+        self.assertEqual(data.get_candle_data('ETHBTC')[0][0], self.candles[100][0])
+
+        depth = data.get_depth_data('ETHBTC')
+        close = self.candles[100][4]
+        self.assertAlmostEqual(depth['a'][0][0]-depth['b'][0][0], close*0.01)
+
+        while data.step():
+            pass
+        self.assertEqual(data.position, len(self.candles))
+
+
+    def test_run_backtest(self):
+        ledger = backtester.run_backtest('BTC-ETH', self.candles, window=200)
+        summary = backtester.summarise(ledger)
+
+        self.assertGreater(len(ledger), 0)
+        self.assertEqual(summary['trades'], len(ledger))
+        self.assertAlmostEqual(summary['total'], summary['LONG']+summary['SHORT'])
+        for trade in ledger:
+            self.assertEqual(trade[5], 'LONG')
+            self.assertLessEqual(trade[1], trade[3])
+
+
+    def test_empty_candles(self):
+        self.assertEqual(backtester.run_backtest('BTC-ETH', np.empty((0, 6))), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
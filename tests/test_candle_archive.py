@@ -0,0 +1,58 @@
+#! /usr/bin/env python3
+
+'''
+test_candle_archive
+
+'''
+import os
+import shutil
+import tempfile
+import unittest
+
+from core import candle_archive
+
+
+def candles(start, count):
+    return([[open_time*60000, 1.0, 2.0, 0.5, 1.5, 10.0] for open_time in range(start, start+count)])
+
+
+class CandleArchiveTests(unittest.TestCase):
+
+    def setUp(self):
+        self.archive_dir = tempfile.mkdtemp()+'/'
+        self.data_path = candle_archive.archive_path(self.archive_dir, 'ETHBTC', '1m')
+
+
+    def tearDown(self):
+        shutil.rmtree(self.archive_dir)
+
+
+    def test_append_and_find(self):
+        archive = candle_archive.CandleArchive(self.data_path, 60000, index_stride=4)
+        self.assertEqual(archive.append(candles(0, 10)), 10)
+        ## Candles already stored are skipped.
+        self.assertEqual(archive.append(candles(5, 10)), 5)
+
+        reopened = candle_archive.CandleArchive(self.data_path)
+        self.assertEqual(len(reopened), 15)
+        self.assertEqual(reopened.candles(3*60000, 6*60000)[:, 0].tolist(), [180000.0, 240000.0, 300000.0])
+
+
+    def test_partial_record_is_truncated_on_open(self):
+        archive = candle_archive.CandleArchive(self.data_path, 60000)
+        archive.append(candles(0, 3))
+
+        ## Crash part way through writing the next record.
+        with open(self.data_path, 'ab') as file:
+            file.write(b'\x00'*(candle_archive.RECORD_SIZE//2))
+
+        reopened = candle_archive.CandleArchive(self.data_path)
+        self.assertEqual(len(reopened), 3)
+        self.assertEqual(os.path.getsize(self.data_path), 3*candle_archive.RECORD_SIZE)
+
+        reopened.append(candles(3, 2))
+        self.assertEqual(candle_archive.CandleArchive(self.data_path).candles()[:, 0].tolist(), [open_time*60000.0 for open_time in range(5)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,89 @@
+#! /usr/bin/env python3
+
+'''
+test_candle_store
+
+'''
+import unittest
+import numpy as np
+
+from core import candle_store
+
+
+def candle(open_time, close=1.0):
+    return([open_time, close, close, close, close, 1.0])
+
+
+class CandleStoreTests(unittest.TestCase):
+
+    def setUp(self):
+        self.store = candle_store.CandleStore(capacity=5)
+
+
+    def test_ring_buffer_keeps_newest_first(self):
+        for open_time in range(8):
+            self.store.push(candle(open_time))
+
+        view = self.store.view()
+        self.assertEqual(view[:, candle_store.TIME].tolist(), [7, 6, 5, 4, 3])
+        self.assertEqual(self.store.last_time(), 7)
+
+
+    def test_view_is_unchanged_by_next_push(self):
+        for open_time in range(5):
+            self.store.push(candle(open_time))
+
+        view = self.store.view()
+        self.store.push(candle(5))
+        self.assertEqual(view[:, candle_store.TIME].tolist(), [4, 3, 2, 1, 0])
+
+
+    def test_update_patches_open_candle(self):
+        self.store.seed([candle(1), candle(0)])
+
+        self.store.update(candle(1, close=2.0))
+        self.store.update(candle(0, close=9.0))
+        self.assertEqual(self.store.view()[:, candle_store.CLOSE].tolist(), [2.0, 1.0])
+
+        self.store.update(candle(2, close=3.0))
+        self.assertEqual(self.store.view()[:, candle_store.TIME].tolist(), [2, 1, 0])
+
+
+    def test_seed_keeps_capacity(self):
+        self.store.seed([candle(open_time) for open_time in range(9, -1, -1)])
+        self.assertEqual(self.store.view()[:, candle_store.TIME].tolist(), [9, 8, 7, 6, 5])
+
+
+    def test_since(self):
+        for open_time in range(0, 50, 10):
+            self.store.push(candle(open_time))
+
+        self.assertEqual(len(self.store.since()), 5)
+        self.assertEqual(self.store.since(20)[:, candle_store.TIME].tolist(), [40, 30, 20])
+        self.assertEqual(self.store.since(25)[:, candle_store.TIME].tolist(), [40, 30])
+
+
+    def test_since_always_includes_open_candle(self):
+        for open_time in range(0, 50, 10):
+            self.store.push(candle(open_time))
+
+        self.assertEqual(self.store.since(40)[:, candle_store.TIME].tolist(), [40])
+        self.assertEqual(self.store.since(45)[:, candle_store.TIME].tolist(), [40])
+
+        ## The open candle changing also changes the tag.
+        etag = self.store.etag()
+        self.store.update(candle(40, close=2.0))
+        self.assertNotEqual(self.store.etag(), etag)
+        self.assertEqual(self.store.since(45)[0][candle_store.CLOSE], 2.0)
+
+
+    def test_merge_candles(self):
+        older = np.array([candle(open_time) for open_time in range(30, -10, -10)], dtype=np.float64)
+        merged = candle_store.merge_candles([candle(50), candle(40), candle(30, close=2.0)], older)
+
+        self.assertEqual(merged[:, candle_store.TIME].tolist(), [50, 40, 30, 20, 10, 0])
+        self.assertEqual(merged[2][candle_store.CLOSE], 2.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+#! /usr/bin/env python3
+
+'''
+test_indicator_engine
+
+'''
+import unittest
+
+from core import indicator_engine
+from core.indicators import kernels, bench
+
+
+SETUP = {
+    'MACD':['MACD', {'fast':12, 'slow':26, 'signal':9}],
+    'MFI':['MFI', {'period':14}],
+    'ADX':['ADX', {'period':14}],
+    'MA_50':['SMA', {'period':50}]
+}
+
+
+def kernel_values(candles):
+    ''' Work out the same indicators with the vectorised kernels from a newest first list of candles. '''
+    close_prices = [candle[4] for candle in candles]
+    return({
+        'MACD':kernels.get_MACD(close_prices, 12, 26, 9),
+        'MFI':kernels.get_MFI(candles, 14),
+        'ADX':kernels.get_ADX_DI(candles, 14),
+        'MA_50':kernels.get_SMA(close_prices, 50)
+    })
+
+
+class IndicatorEngineTests(unittest.TestCase):
+
+    def assertSeriesEqual(self, engine_values, kernel_values):
+        ## The engine only keeps as many values as the window it was built from.
+        kernel_values = kernel_values[:len(engine_values)]
+        self.assertGreater(len(engine_values), 100)
+
+        for engine_value, kernel_value in zip(engine_values, kernel_values):
+            if isinstance(kernel_value, dict):
+                for key in kernel_value:
+                    self.assertAlmostEqual(engine_value[key], kernel_value[key], places=9)
+            else:
+                self.assertAlmostEqual(engine_value, kernel_value, places=9)
+
+
+    def test_rebuild_matches_kernels(self):
+        candles = bench.make_candles(500)
+        engine = indicator_engine.IndicatorEngine(SETUP)
+
+        indicators = engine.rebuild(candles)
+        expected = kernel_values(candles)
+
+        for name in SETUP:
+            self.assertEqual(len(indicators[name]), len(expected[name]))
+            self.assertSeriesEqual(indicators[name].tolist(), expected[name])
+
+
+    def test_updates_match_kernels_over_same_history(self):
+        '''
+        EMA and Wilder smoothed values (MACD, ADX) depend on all the history seen, so the streamed values
+        are checked against the kernels over every candle the engine has been given.
+        '''
+        candles = bench.make_candles(400)
+        engine = indicator_engine.IndicatorEngine(SETUP)
+        engine.rebuild(candles[200:])
+
+        for start in range(199, -1, -1):
+            ## Patch the in progress candle then move on to the next one.
+            in_progress = list(candles[start])
+            in_progress[4] = in_progress[1]
+            engine.update([in_progress]+candles[start+1:])
+            indicators = engine.update(candles[start:])
+
+        expected = kernel_values(candles)
+        for name in SETUP:
+            self.assertSeriesEqual(indicators[name].tolist(), expected[name])
+
+
+if __name__ == '__main__':
+    unittest.main()
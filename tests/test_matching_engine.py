@@ -0,0 +1,106 @@
+#! /usr/bin/env python3
+
+'''
+test_matching_engine
+
+'''
+import unittest
+import numpy as np
+
+from core import matching_engine
+
+## The trader needs technical_indicators (via trader_configuration).
+try:
+    from core import trader
+    from core import backtester
+    from core.indicators import bench
+except ImportError:
+    trader = None
+
+
+DEPTH = {'a':[[101.0, 1.0], [102.0, 1.0]], 'b':[[100.0, 1.0], [99.0, 1.0]]}
+
+
+class RestingOrderTests(unittest.TestCase):
+
+    def setUp(self):
+        self.engine = matching_engine.PaperMatchingEngine(fee=0.0, latency=0)
+
+
+    def test_order_past_shown_levels_has_empty_queue(self):
+        ''' A BUY limit under the shown bids rests with nothing ahead of it and survives further updates. '''
+        order_id = self.engine.submit('TESTBTC', 'BUY', 'LIMIT', 1.0, price=90.0)
+
+        self.engine.update('TESTBTC', DEPTH, [0, 100.0, 100.5, 99.5, 100.0, 10.0], 1)
+        order = self.engine.get_order(order_id)
+        self.assertTrue(order['resting'])
+        self.assertEqual(order['queue_ahead'], 0.0)
+
+        self.engine.update('TESTBTC', DEPTH, [0, 100.0, 100.5, 99.0, 99.5, 12.0], 2)
+        self.assertEqual(self.engine.get_order(order_id)['status'], 'NEW')
+
+
+    def test_order_past_shown_levels_fills_when_traded_through(self):
+        order_id = self.engine.submit('TESTBTC', 'BUY', 'LIMIT', 1.0, price=90.0)
+
+        self.engine.update('TESTBTC', DEPTH, [0, 100.0, 100.5, 99.5, 100.0, 10.0], 1)
+        self.engine.update('TESTBTC', DEPTH, [0, 100.0, 100.5, 89.0, 95.0, 20.0], 2)
+
+        order = self.engine.get_order(order_id)
+        self.assertEqual(order['status'], 'FILLED')
+        self.assertEqual(order['avgPrice'], 90.0)
+
+
+@unittest.skipIf(trader == None, 'technical_indicators is not installed')
+class TraderPartialFillTests(unittest.TestCase):
+
+    def make_trader(self, volume, count=600):
+        candles = np.array(bench.make_candles(count))[::-1].copy()
+        candles[:, 5] = volume
+        self.data = backtester.ReplayData(candles, window=500)
+        self.engine = matching_engine.PaperMatchingEngine(fee=0.0, latency=0.0)
+
+        trader_ = trader.BaseTrader('BTC', 'ETH', None, data_if=self.data, paper_engine=self.engine)
+        trader_.setup_initial_values('SPOT', 'TEST', dict(backtester.DEFAULT_RULES))
+        trader_.start(0.0015, {}, threaded=False)
+        return(trader_)
+
+
+    def test_thin_market_orders_complete(self):
+        ''' Orders bigger than the candle volume part fill, the trades still finish instead of staying LOCKED. '''
+        trader_ = self.make_trader(0.05, count=3000)
+
+        while True:
+            trader_.run_iteration()
+            if not self.data.step():
+                break
+
+        self.assertGreater(len(trader_.trade_recorder), 0)
+        self.assertNotEqual(trader_.long_position['order_status']['B'], 'LOCKED')
+
+
+    def test_locked_limit_order_is_checked_until_filled(self):
+        trader_ = self.make_trader(1.0)
+        price = float(self.data.candles[self.data.position][4])
+        depth = {'a':[[price*1.01, 1.0]], 'b':[[price, 0.0]]}
+
+        order_id = self.engine.submit('ETHBTC', 'BUY', 'LIMIT', 1.0, price=price)
+        self.engine.update('ETHBTC', depth, [0, price, price, price, price, 0.0], 1)
+        self.engine.update('ETHBTC', depth, [0, price, price, price, price, 0.4], 2)
+
+        cp = trader_.long_position
+        cp['order_id']['B'] = order_id
+        cp['order_status']['B'] = 'PLACED'
+        cp['order_type']['B'] = 'SIGNAL'
+
+        cp = trader_._order_status_manager('LONG', cp, None)
+        self.assertEqual(cp['order_status']['B'], 'LOCKED')
+
+        self.engine.update('ETHBTC', depth, [0, price, price, price*0.99, price, 1.0], 3)
+        cp = trader_._order_status_manager('LONG', cp, None)
+        self.assertEqual(cp['tokens_holding'], 1.0)
+        self.assertEqual(cp['buy_price'], price)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,114 @@
+#! /usr/bin/env python3
+
+'''
+test_order_book
+
+'''
+import unittest
+
+from core import order_book
+
+
+SNAPSHOT = {'lastUpdateId':100, 'bids':[['10.0', '1.0'], ['9.0', '2.0']], 'asks':[['11.0', '1.0'], ['12.0', '3.0']]}
+
+
+def diff(first_id, last_id, bids=[], asks=[]):
+    return({'e':'depthUpdate', 'U':first_id, 'u':last_id, 'b':bids, 'a':asks})
+
+
+class OrderBookTests(unittest.TestCase):
+
+    def setUp(self):
+        self.book = order_book.OrderBook('ETHBTC')
+
+
+    def test_buffered_diffs_applied_after_snapshot(self):
+        ## Seen before the snapshot, the first is already covered by it.
+        self.assertFalse(self.book.apply(diff(95, 100, bids=[['10.0', '5.0']])))
+        self.assertFalse(self.book.apply(diff(101, 102, bids=[['10.5', '1.0']], asks=[['11.0', '0']])))
+
+        self.assertTrue(self.book.load_snapshot(SNAPSHOT))
+        self.assertEqual(self.book.last_update_id, 102)
+        self.assertEqual(self.book.metrics['bestBid'], 10.5)
+        self.assertEqual(self.book.metrics['bestAsk'], 12.0)
+        self.assertEqual(self.book.bids[10.0], 1.0)
+
+
+    def test_diffs_follow_on(self):
+        self.book.load_snapshot(SNAPSHOT)
+
+        self.assertTrue(self.book.apply(diff(99, 101, bids=[['9.0', '0']])))
+        self.assertTrue(self.book.apply(diff(102, 103, asks=[['10.5', '2.0']])))
+        ## Old events are skipped.
+        self.assertTrue(self.book.apply(diff(90, 101, bids=[['1.0', '1.0']])))
+
+        self.assertEqual(self.book.bid_prices, [-10.0])
+        self.assertEqual(self.book.ask_prices, [10.5, 11.0, 12.0])
+        self.assertEqual(self.book.depth(2), {'a':[[10.5, 2.0], [11.0, 1.0]], 'b':[[10.0, 1.0]]})
+
+
+    def test_gap_clears_book(self):
+        self.book.load_snapshot(SNAPSHOT)
+
+        self.assertFalse(self.book.apply(diff(105, 106, bids=[['10.0', '2.0']])))
+        self.assertFalse(self.book.synced)
+        self.assertEqual(self.book.bids, {})
+        self.assertEqual(self.book.metrics, {})
+        ## The event after the gap is kept for the next snapshot.
+        self.assertEqual(len(self.book.buffer), 1)
+
+
+    def test_stale_snapshot_stays_unsynced(self):
+        ## Buffered diffs start after the snapshot so it can not be used.
+        self.book.apply(diff(150, 151))
+
+        self.assertFalse(self.book.load_snapshot(SNAPSHOT))
+        self.assertFalse(self.book.synced)
+        self.assertEqual(len(self.book.buffer), 1)
+
+
+class SnapshotBookSet(order_book.OrderBookSet):
+    ''' Serves queued snapshots instead of calling the REST api. '''
+
+    def __init__(self, snapshots, **kwargs):
+        super(SnapshotBookSet, self).__init__(**kwargs)
+        self.snapshots = list(snapshots)
+        self.limits = []
+
+
+    def _get_depth(self, symbol):
+        self.limits.append(self.snapshot_limit)
+        return(self.snapshots.pop(0))
+
+
+class OrderBookSetTests(unittest.TestCase):
+
+    def test_snapshot_limit_follows_levels(self):
+        self.assertEqual(order_book.OrderBookSet(levels=50).snapshot_limit, 50)
+        self.assertEqual(order_book.OrderBookSet(levels=500).snapshot_limit, order_book.MAX_SNAPSHOT_LIMIT)
+        self.assertEqual(order_book.depth_weight(order_book.MAX_SNAPSHOT_LIMIT), 5)
+
+
+    def test_resync_after_gap(self):
+        resync = {'lastUpdateId':110, 'bids':[['10.0', '4.0']], 'asks':[['11.0', '4.0']]}
+        books = SnapshotBookSet([SNAPSHOT, resync], levels=20)
+        book = books.get_book('ETHBTC')
+
+        books.on_update('ETHBTC', 'depth', diff(101, 101))
+        books.executor.shutdown(wait=True)
+        self.assertTrue(book.synced)
+
+        books.executor = order_book.ThreadPoolExecutor(max_workers=1)
+        ## Gap from 101 to 108, the book is cleared and resynced from the next snapshot with the buffered event applied.
+        books.on_update('ETHBTC', 'depth', diff(108, 111, bids=[['10.0', '6.0']]))
+        books.executor.shutdown(wait=True)
+
+        self.assertTrue(book.synced)
+        self.assertEqual(book.last_update_id, 111)
+        self.assertEqual(book.bids, {10.0:6.0})
+        self.assertEqual(books.limits, [20, 20])
+        self.assertEqual(books.fetching, set())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,118 @@
+#! /usr/bin/env python3
+
+'''
+test_order_gateway
+
+'''
+import time
+import threading
+import unittest
+
+from core import order_gateway
+
+
+KEY = ('BTC-ETH', 'LONG', 'B')
+
+
+class RecordingGateway(order_gateway.OrderGateway):
+    ''' Records the intents that would be sent instead of sending them, sends block while hold is cleared. '''
+
+    def __init__(self):
+        super(RecordingGateway, self).__init__('public', 'private', workers=1)
+        self.sent = []
+        self.hold = threading.Event()
+        self.hold.set()
+
+
+    def _send(self, intent):
+        self.hold.wait(5)
+        self.sent.append((intent['action'], dict(intent['params']), intent['cancel_order_id']))
+        if intent['action'] == 'PLACE':
+            return({'orderId':len(self.sent)})
+        return({'status':'CANCELED'})
+
+
+class OrderGatewayTests(unittest.TestCase):
+
+    def setUp(self):
+        self.gateway = RecordingGateway()
+
+
+    def tearDown(self):
+        self.gateway.hold.set()
+        self.gateway.stop()
+
+
+    def test_queued_place_is_replaced(self):
+        borrowed = []
+        first = self.gateway.submit(KEY, 'SPOT', {'symbol':'ETHBTC', 'price':1.0}, before_send=lambda: borrowed.append(1.0))
+        second = self.gateway.submit(KEY, 'SPOT', {'symbol':'ETHBTC', 'price':2.0}, before_send=lambda: borrowed.append(2.0))
+        self.gateway.start()
+
+        self.assertTrue(first.cancelled())
+        self.assertEqual(second.result(timeout=5), {'orderId':1})
+        self.assertEqual(self.gateway.sent, [('PLACE', {'symbol':'ETHBTC', 'price':2.0}, None)])
+        ## Only the intent that was sent borrows.
+        self.assertEqual(borrowed, [2.0])
+
+
+    def test_replaced_place_keeps_order_to_cancel(self):
+        self.gateway.submit(KEY, 'SPOT', {'symbol':'ETHBTC', 'price':1.0}, cancel_order_id=7)
+        future = self.gateway.submit(KEY, 'SPOT', {'symbol':'ETHBTC', 'price':2.0})
+        self.gateway.start()
+
+        future.result(timeout=5)
+        self.assertEqual(self.gateway.sent, [('PLACE', {'symbol':'ETHBTC', 'price':2.0}, 7)])
+
+
+    def test_cancel_drops_unsent_place(self):
+        borrowed = []
+        place = self.gateway.submit(KEY, 'SPOT', {'symbol':'ETHBTC', 'price':1.0}, before_send=lambda: borrowed.append(1.0))
+        cancel = self.gateway.cancel(KEY, 'SPOT', 'ETHBTC', None)
+        self.gateway.start()
+
+        self.assertTrue(place.cancelled())
+        self.assertEqual(cancel.result(timeout=5), None)
+        self.gateway.stop()
+        self.assertEqual(self.gateway.sent, [])
+        self.assertEqual(borrowed, [])
+
+
+    def test_cancel_of_replacing_place_cancels_open_order(self):
+        self.gateway.submit(KEY, 'SPOT', {'symbol':'ETHBTC', 'price':1.0}, cancel_order_id=7)
+        cancel = self.gateway.cancel(KEY, 'SPOT', 'ETHBTC', None)
+        self.gateway.start()
+
+        cancel.result(timeout=5)
+        self.assertEqual(self.gateway.sent, [('CANCEL', {'symbol':'ETHBTC'}, 7)])
+
+
+    def test_place_behind_in_flight_replaces_its_order(self):
+        self.gateway.hold.clear()
+        self.gateway.start()
+        first = self.gateway.submit(KEY, 'SPOT', {'symbol':'ETHBTC', 'price':1.0})
+
+        ## Wait for the first place to be taken by the worker before queueing the next.
+        while not KEY in self.gateway.in_flight:
+            time.sleep(0.01)
+        second = self.gateway.submit(KEY, 'SPOT', {'symbol':'ETHBTC', 'price':2.0})
+        self.gateway.hold.set()
+
+        self.assertEqual(first.result(timeout=5), {'orderId':1})
+        self.assertEqual(second.result(timeout=5), {'orderId':2})
+        self.assertEqual(self.gateway.sent[1], ('PLACE', {'symbol':'ETHBTC', 'price':2.0}, 1))
+
+
+    def test_failed_before_send_does_not_send(self):
+        def fail():
+            raise ValueError('loan refused')
+
+        future = self.gateway.submit(KEY, 'SPOT', {'symbol':'ETHBTC', 'price':1.0}, before_send=fail)
+        self.gateway.start()
+
+        self.assertRaises(ValueError, future.result, 5)
+        self.assertEqual(self.gateway.sent, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,104 @@
+#! /usr/bin/env python3
+
+'''
+test_state_journal
+
+'''
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+
+from core import state_journal
+
+
+class FakeTrader(object):
+    ''' Just the parts of BaseTrader the journal reads. '''
+
+    def __init__(self, market):
+        self.print_pair = market
+        self.state_version = 0
+        self.long_position = {'buy_price':0.0, 'order_status':{'B':None, 'S':None}}
+        self.trade_recorder = []
+        self.state_data = {'runtime_state':'RUN'}
+
+
+    def mark_dirty(self):
+        self.state_version += 1
+
+
+    def get_trader_data(self):
+        return({
+            'market':self.print_pair,
+            'long_position':self.long_position,
+            'trade_record':self.trade_recorder,
+            'state_data':self.state_data})
+
+
+class StateJournalTests(unittest.TestCase):
+
+    def setUp(self):
+        self.state_dir = tempfile.mkdtemp()+'/'
+        self.journal = state_journal.StateJournal(self.state_dir)
+
+
+    def tearDown(self):
+        if self.journal.journal_file != None:
+            self.journal.journal_file.close()
+        shutil.rmtree(self.state_dir)
+
+
+    def test_recover_snapshot_and_journal(self):
+        traders = [FakeTrader('BTC-ETH'), FakeTrader('BTC-LTC')]
+
+        traders[0].long_position['buy_price'] = 0.05
+        traders[0].trade_recorder.append([1, 0.05, 1.0, 'BUY', 0.0])
+        traders[0].mark_dirty()
+        ## Both are written the first time they are seen.
+        self.assertEqual(self.journal.write_changes(traders), 2)
+
+        self.journal.compact(traders)
+
+        ## Changes after the snapshot are only in the journal (NumPy values come straight from the candle arrays).
+        traders[0].long_position['order_status']['S'] = 'PLACED'
+        traders[0].trade_recorder.append([2, np.float64(0.06), 1.0, 'SELL', np.float64(0.01)])
+        traders[0].mark_dirty()
+        traders[1].state_data['runtime_state'] = 'STANDBY'
+        traders[1].mark_dirty()
+        self.assertEqual(self.journal.write_changes(traders), 2)
+
+        ## Unchanged traders are not written again.
+        self.assertEqual(self.journal.write_changes(traders), 0)
+        self.journal.journal_file.close()
+        self.journal.journal_file = None
+
+        recovered = dict((data['market'], data) for data in state_journal.StateJournal(self.state_dir).recover())
+
+        self.assertEqual(recovered['BTC-ETH']['long_position'], {'buy_price':0.05, 'order_status':{'B':None, 'S':'PLACED'}})
+        self.assertEqual(recovered['BTC-ETH']['trade_record'], [[1, 0.05, 1.0, 'BUY', 0.0], [2, 0.06, 1.0, 'SELL', 0.01]])
+        self.assertEqual(recovered['BTC-LTC']['state_data'], {'runtime_state':'STANDBY'})
+
+
+    def test_torn_entry_is_dropped(self):
+        trader_ = FakeTrader('BTC-ETH')
+        trader_.long_position['buy_price'] = 0.05
+        trader_.mark_dirty()
+        self.journal.write_changes([trader_])
+        self.journal.journal_file.close()
+        self.journal.journal_file = None
+
+        good_size = os.path.getsize(self.journal.journal_path)
+        with open(self.journal.journal_path, 'a') as file:
+            file.write('{"seq": 2, "market": "BTC-ETH", "set": {"long_po')
+
+        journal = state_journal.StateJournal(self.state_dir)
+        recovered = journal.recover()
+
+        self.assertEqual(recovered[0]['long_position']['buy_price'], 0.05)
+        self.assertEqual(journal.seq, 1)
+        self.assertEqual(os.path.getsize(self.journal.journal_path), good_size)
+
+
+if __name__ == '__main__':
+    unittest.main()
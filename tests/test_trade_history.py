@@ -0,0 +1,77 @@
+#! /usr/bin/env python3
+
+'''
+test_trade_history
+
+'''
+import unittest
+import numpy as np
+
+from core.indicators import bench
+
+## The trader needs technical_indicators (via trader_configuration).
+try:
+    from core import trader
+    from core import backtester
+except ImportError:
+    trader = None
+
+
+def trade(index, outcome, position_type='LONG'):
+    return([1.0, index, 1.0+outcome, index+1, outcome, position_type])
+
+
+@unittest.skipIf(trader == None, 'technical_indicators is not installed')
+class TradeHistoryTests(unittest.TestCase):
+
+    def make_trader(self, trade_history):
+        data = backtester.ReplayData(np.array(bench.make_candles(10))[::-1])
+        return(trader.BaseTrader('BTC', 'ETH', None, data_if=data, trade_history=trade_history))
+
+
+    def test_recent_trades_are_bounded(self):
+        trader_ = self.make_trader(3)
+
+        for index in range(5):
+            trader_._record_trade(trade(index, 0.1 if index % 2 else -0.1))
+
+        self.assertEqual([row[1] for row in trader_.trade_recorder], [2, 3, 4])
+        ## Totals still cover every trade.
+        self.assertEqual(trader_.trade_stats['LONG']['trades'], 5)
+        self.assertEqual(trader_.trade_stats['LONG']['wins'], 2)
+        self.assertAlmostEqual(trader_.trade_stats['LONG']['outcome'], -0.1)
+
+
+    def test_unbounded_history(self):
+        trader_ = self.make_trader(None)
+
+        for index in range(5):
+            trader_._record_trade(trade(index, 0.1))
+        self.assertEqual(len(trader_.trade_recorder), 5)
+
+
+    def test_zero_history_keeps_totals_only(self):
+        trader_ = self.make_trader(0)
+
+        trader_._record_trade(trade(0, 0.1, 'SHORT'))
+        self.assertEqual(trader_.trade_recorder, [])
+        self.assertEqual(trader_.trade_stats['SHORT']['trades'], 1)
+
+
+    def test_load_trades(self):
+        trader_ = self.make_trader(2)
+        trades = [trade(index, 0.1) for index in range(4)]+[trade(4, -0.2, 'SHORT')]
+
+        ## Saved before the totals were kept, they are rebuilt from the trades.
+        trader_.load_trades(trades)
+        self.assertEqual([row[1] for row in trader_.trade_recorder], [3, 4])
+        self.assertEqual(trader_.trade_stats['LONG']['trades'], 4)
+        self.assertEqual(trader_.trade_stats['SHORT']['wins'], 0)
+
+        saved_stats = {'LONG':{'trades':40, 'wins':20, 'outcome':1.0}, 'SHORT':{'trades':0, 'wins':0, 'outcome':0.0}}
+        trader_.load_trades(trades, saved_stats)
+        self.assertEqual(trader_.trade_stats, saved_stats)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,82 @@
+#! /usr/bin/env python3
+
+'''
+test_trade_ledger
+
+'''
+import shutil
+import tempfile
+import unittest
+
+from core import trade_ledger
+
+
+def trade(symbol, position_type, sell_time, outcome):
+    return({
+        'symbol':symbol,
+        'market':'BTC-'+symbol[:-3],
+        'position_type':position_type,
+        'buy_price':1.0,
+        'sell_price':1.0+outcome,
+        'sell_time':sell_time,
+        'outcome':outcome})
+
+
+class TradeLedgerTests(unittest.TestCase):
+
+    def setUp(self):
+        self.ledger_dir = tempfile.mkdtemp()+'/'
+        self.ledger = trade_ledger.TradeLedger(self.ledger_dir+trade_ledger.LEDGER_FILE, flush_size=3)
+
+
+    def tearDown(self):
+        self.ledger.close()
+        shutil.rmtree(self.ledger_dir)
+
+
+    def test_writes_are_buffered(self):
+        self.ledger.record(trade('ETHBTC', 'LONG', 1, 0.1))
+        self.ledger.record(trade('ETHBTC', 'LONG', 2, 0.1))
+        self.assertEqual(len(self.ledger.buffer), 2)
+
+        self.ledger.record(trade('ETHBTC', 'LONG', 3, 0.1))
+        self.assertEqual(self.ledger.buffer, [])
+
+        ## Queries see buffered trades.
+        self.ledger.record(trade('ETHBTC', 'LONG', 4, 0.1))
+        self.assertEqual(len(self.ledger.query()['trades']), 4)
+
+
+    def test_query_pages_and_filters(self):
+        for index in range(10):
+            self.ledger.record(trade('ETHBTC' if index % 2 else 'LTCBTC', 'LONG' if index < 6 else 'SHORT', index, 0.1))
+
+        page = self.ledger.query(limit=4)
+        self.assertEqual([row['sell_time'] for row in page['trades']], [9, 8, 7, 6])
+
+        page = self.ledger.query(before_id=page['next_id'], limit=4)
+        self.assertEqual([row['sell_time'] for row in page['trades']], [5, 4, 3, 2])
+
+        page = self.ledger.query(before_id=page['next_id'], limit=4)
+        self.assertEqual([row['sell_time'] for row in page['trades']], [1, 0])
+        self.assertEqual(page['next_id'], None)
+
+        page = self.ledger.query(symbol='ETHBTC', position_type='LONG', start_time=2)
+        self.assertEqual([row['sell_time'] for row in page['trades']], [5, 3])
+
+
+    def test_pnl(self):
+        self.ledger.record(trade('ETHBTC', 'LONG', 1, 0.2))
+        self.ledger.record(trade('ETHBTC', 'LONG', 2, -0.1))
+        self.ledger.record(trade('ETHBTC', 'SHORT', 3, 0.3))
+
+        pnl = dict(((row['symbol'], row['position_type']), row) for row in self.ledger.pnl())
+
+        self.assertEqual(pnl[('ETHBTC', 'LONG')]['trades'], 2)
+        self.assertEqual(pnl[('ETHBTC', 'LONG')]['wins'], 1)
+        self.assertAlmostEqual(pnl[('ETHBTC', 'LONG')]['outcome'], 0.1)
+        self.assertEqual(pnl[('ETHBTC', 'SHORT')]['last_time'], 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
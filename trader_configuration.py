@@ -3,25 +3,77 @@
 import time
 import logging
 import numpy as np
-import technical_indicators as TI
+
+## Indicators are worked out by the technical_indicators module, set to True to use the vectorised NumPy kernels
+## in core/indicators instead (they can be timed against technical_indicators with 'python3 -m core.indicators.bench').
+USE_NUMPY_INDICATORS = False
+
+if USE_NUMPY_INDICATORS:
+    from core import indicators as TI
+else:
+    import technical_indicators as TI
 
 ## Minimum price rounding.
 pRounding = 8
 
+## Strategy parameters used by the indicators and conditions (these can be tuned with the optimizer).
+PARAMETERS = {
+    'macd_fast':12,
+    'macd_slow':26,
+    'macd_signal':9,
+    'entry_min_hist':0.0,
+    'ma_period':50
+}
+
+## Indicators kept up to date incrementally by the trader (output name:[indicator, params]), built by setup_parameters.
+## Supported indicators are SMA, EMA, MACD, MFI and ADX, off by default so technical_indicators is recalculated every pass,
+## set USE_STREAM_INDICATORS to True to use them (their values are checked against the kernels in tests/test_indicator_engine.py).
+USE_STREAM_INDICATORS = False
+STREAM_INDICATORS = None
+
+
+def setup_parameters(parameters):
+    '''
+    Build anything that depends on PARAMETERS, this is called again by the optimizer after it changes them.
+    '''
+    global STREAM_INDICATORS
+    PARAMETERS.update(parameters)
+
+    if not USE_STREAM_INDICATORS:
+        STREAM_INDICATORS = None
+        return
+
+    STREAM_INDICATORS = {
+        'MACD':['MACD', {'fast':PARAMETERS['macd_fast'], 'slow':PARAMETERS['macd_slow'], 'signal':PARAMETERS['macd_signal']}],
+        'MFI':['MFI', {'period':14}],
+        'ADX':['ADX', {'period':14}],
+        'MA_50':['SMA', {'period':PARAMETERS['ma_period']}]
+    }
+
+setup_parameters(PARAMETERS)
+
 #time, open, high, low, close, volume
 
 def technical_indicators(candles):
     indicators = {}
 
-    open_prices     = [candle[1] for candle in candles]
-    high_prices     = [candle[2] for candle in candles]
-    low_prices      = [candle[3] for candle in candles]
-    close_prices    = [candle[4] for candle in candles]
+    ## Candles are a newest first (n, 6) array when read from the candle store (no copy is made here).
+    candles         = np.asarray(candles, dtype=np.float64)
+
+    open_prices     = candles[:, 1]
+    high_prices     = candles[:, 2]
+    low_prices      = candles[:, 3]
+    close_prices    = candles[:, 4]
+
+    if not USE_NUMPY_INDICATORS:
+        ## The technical_indicators module works on lists.
+        candles         = candles.tolist()
+        close_prices    = close_prices.tolist()
     
-    indicators.update({'MACD':TI.get_MACD(close_prices)})
+    indicators.update({'MACD':TI.get_MACD(close_prices, PARAMETERS['macd_fast'], PARAMETERS['macd_slow'], PARAMETERS['macd_signal'])})
     indicators.update({'MFI':TI.get_MFI(candles)})
     indicators.update({'ADX':TI.get_ADX_DI(candles)})
-    indicators.update({'MA_50':TI.get_SMA(close_prices, 50)})
+    indicators.update({'MA_50':TI.get_SMA(close_prices, PARAMETERS['ma_period'])})
 
     return(indicators)
 
@@ -82,7 +134,7 @@ def long_entry_conditions(custom_conditional_data, trade_information, indicators
     macd = indicators['MACD']
 
     ## Logic for BUY conditions.
-    if macd[0]['hist'] > 0 and macd[0]['macd'] > macd[1]['macd'] and macd[0]['macd'] > macd[0]['signal']:
+    if macd[0]['hist'] > PARAMETERS['entry_min_hist'] and macd[0]['macd'] > macd[1]['macd'] and macd[0]['macd'] > macd[0]['signal']:
         return({'order_type':'SIGNAL', 
             'side':'BUY', 
             'description':'long entry signal', 